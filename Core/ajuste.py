@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+
+#--------------------------------------------------
+#Ajuste de rede: vários circuitos, estações repetidas e várias bases
+#--------------------------------------------------
+'''
+Ajusta numa única solução de mínimos quadrados ponderados (scipy.sparse) a
+gravidade de cada estação, um polinômio de deriva por circuito e os saltos
+(taras) do gravímetro. Cada leitura corrigida de maré g_i, na estação s e
+no circuito k, é modelada como
+    g_i = G_s + c_k + d_k1*(t_i-t0_k) + ... + d_kP*(t_i-t0_k)**P + taras + e_i
+e cada base absoluta acrescenta a observação G_b = g_b com sua incerteza.
+Como cada leitura ocupa uma só estação, o bloco das estações da matriz
+normal é diagonal: as estações são eliminadas (complemento de Schur) e só o
+sistema pequeno dos parâmetros dos circuitos é resolvido de forma densa.
+----------------------------
+Adjusts, in one weighted least-squares solution (scipy.sparse), the gravity
+of every station, one drift polynomial per loop and the tares (steps) of the
+gravimeter. Each tide-corrected reading g_i, at station s and in loop k, is
+modelled as
+    g_i = G_s + c_k + d_k1*(t_i-t0_k) + ... + d_kP*(t_i-t0_k)**P + tares + e_i
+and each absolute base adds the observation G_b = g_b with its uncertainty.
+Since each reading occupies a single station, the station block of the
+normal matrix is diagonal: the stations are eliminated (Schur complement)
+and only the small system of the loop parameters is solved densely.
+'''
+
+ç_BASE_PADRAO = 0.03 #Incerteza padrão de uma base absoluta em mGal (ç_gref da redução)
+
+
+def _sparse():
+    try:
+        import scipy.sparse as sp
+        import scipy.linalg as la
+    except ImportError as erro:
+        raise ImportError('O ajuste de rede precisa do pacote scipy (pip install scipy): %s' % (erro,))
+    return sp, la
+
+
+def _bases(bases, pontos):
+    """
+    Station indices, values and weights of the absolute bases. bases maps a
+    station to its value in mGal or to a (value, uncertainty) pair.
+    """
+    indices, valores, pesos = [], [], []
+    for ponto, base in bases.items():
+        valor, ç_valor = base if np.ndim(base) else (base, ç_BASE_PADRAO)
+        k = np.searchsorted(pontos, ponto)
+        if k >= len(pontos) or pontos[k] != ponto:
+            raise ValueError('A base %r não foi ocupada por nenhuma leitura' % (ponto,))
+        indices.append(k)
+        valores.append(float(valor))
+        pesos.append(1/float(ç_valor)**2)
+    return np.array(indices, dtype=np.intp), np.array(valores), np.array(pesos)
+
+
+def ajustar_rede(ponto, g_leitura, tempo, circuito, bases, ç_leitura=0.5, grau_deriva=1, tara=None):
+    """
+    Network adjustment of relative gravity readings.
+
+    ponto, g_leitura (tide-corrected readings in mGal, g_cls), tempo
+    (hours) and circuito (loop id) have one value per reading. bases maps
+    each absolute base station to its gravity in mGal or to a (gravity,
+    uncertainty) pair; at least one base is needed. ç_leitura is the
+    uncertainty of each reading (scalar or array), grau_deriva the degree
+    of the drift polynomial of each loop and tara an optional boolean
+    array marking the readings where a tare happened: every later reading
+    of that loop gets an extra unknown offset.
+
+    Returns a dictionary with the adjusted stations ('pontos', 'g',
+    'ç_g'), the loop parameters ('circuitos', 'deriva' and 'ç_deriva', one
+    row [c, d1, ..., dP] per loop), the tares ('taras', 'ç_taras',
+    'linhas_taras'), the a posteriori standard deviation of unit weight
+    ('sigma0', 'graus_de_liberdade') and, per reading, the residuals and
+    the columns used by the reduction: 'cd', 'g_cd', 'g_abs', 'ç_cd' and
+    'ç_gabs'.
+    """
+    sp, la = _sparse()
+    y = np.asarray(g_leitura, dtype=np.float64)
+    t = np.asarray(tempo, dtype=np.float64)
+    n = len(y)
+    P = int(grau_deriva)
+    if not bases:
+        raise ValueError('O ajuste de rede precisa de ao menos uma base absoluta')
+    pontos, s_idx = np.unique(np.asarray(ponto), return_inverse=True)
+    circuitos, k_idx = np.unique(np.asarray(circuito), return_inverse=True)
+    S, K = len(pontos), len(circuitos)
+    w = 1/np.broadcast_to(np.asarray(ç_leitura, dtype=np.float64), (n,))**2
+
+    #Taras: uma incógnita por tara, somada às leituras seguintes do mesmo circuito
+    linhas_taras = np.flatnonzero(tara) if tara is not None else np.array([], dtype=np.intp)
+    taras_por_circuito = np.bincount(k_idx[linhas_taras], minlength=K)
+    colunas_por_circuito = 1 + P + taras_por_circuito
+    inicio = np.concatenate(([0], np.cumsum(colunas_por_circuito)))
+    L = int(inicio[-1])
+
+    #Matriz de projeto dos parâmetros dos circuitos (esparsa)
+    t0 = np.full(K, np.inf)
+    np.minimum.at(t0, k_idx, t)
+    dt = t - t0[k_idx]
+    linhas = [np.repeat(np.arange(n), 1 + P)]
+    colunas = [(inicio[k_idx][:, None] + np.arange(1 + P)).ravel()]
+    valores = [(dt[:, None]**np.arange(1 + P)).ravel()]
+    proxima = inicio[:-1] + 1 + P
+    for j in linhas_taras:
+        k = k_idx[j]
+        depois = np.flatnonzero((k_idx == k) & (t >= t[j]))
+        linhas.append(depois)
+        colunas.append(np.full(len(depois), proxima[k]))
+        valores.append(np.ones(len(depois)))
+        proxima[k] += 1
+    Al = sp.csr_matrix((np.concatenate(valores), (np.concatenate(linhas), np.concatenate(colunas))), shape=(n, L))
+    As = sp.csr_matrix((np.ones(n), (np.arange(n), s_idx)), shape=(n, S))
+    AlW = sp.diags(w) @ Al
+
+    #Equações normais, com as bases como observações ponderadas das estações
+    b_idx, b_val, b_w = _bases(bases, pontos)
+    D = np.bincount(s_idx, w, S)
+    rhs_s = np.bincount(s_idx, w*y, S)
+    np.add.at(D, b_idx, b_w)
+    np.add.at(rhs_s, b_idx, b_w*b_val)
+    N_sl = (As.T @ AlW).tocsr()
+    N_ll = (Al.T @ AlW).toarray()
+    rhs_l = AlW.T @ y
+
+    #Eliminação das estações (bloco diagonal) e solução densa dos circuitos
+    B = (sp.diags(1/D) @ N_sl).tocsr()
+    M = N_ll - (N_sl.T @ B).toarray()
+    try:
+        fator = la.cho_factor(M)
+    except la.LinAlgError:
+        raise ValueError('A rede não tem solução única: cada circuito deve reocupar estações ligadas a uma base '
+                         'e ter leituras suficientes para o grau da deriva (%d)' % P)
+    x_l = la.cho_solve(fator, rhs_l - B.T @ rhs_s)
+    Cov_ll = la.cho_solve(fator, np.eye(L))
+    x_s = (rhs_s - N_sl @ x_l)/D
+    var_s = 1/D
+    for k in range(0, S, 2000): #Diagonal de B·Cov·Bᵀ em blocos de linhas
+        Bk = B[k:k+2000]
+        var_s[k:k+2000] += np.asarray(Bk.multiply(Bk @ Cov_ll).sum(axis=1)).ravel()
+
+    #Resíduos e desvio padrão a posteriori da unidade de peso
+    modelo_l = Al @ x_l
+    residuos = y - x_s[s_idx] - modelo_l
+    graus_de_liberdade = n + len(b_idx) - S - L
+    soma = np.sum(w*residuos**2) + np.sum(b_w*(b_val - x_s[b_idx])**2)
+    sigma0 = np.sqrt(soma/graus_de_liberdade) if graus_de_liberdade > 0 else np.nan
+
+    #Colunas por leitura: deriva (e taras) desde o início do circuito
+    c = x_l[inicio[:-1]][k_idx]
+    cd = -(modelo_l - c)
+    ç_cd = np.zeros(n)
+    por_circuito = np.split(np.argsort(k_idx, kind='stable'), np.cumsum(np.bincount(k_idx, minlength=K))[:-1])
+    for k, linhas_k in enumerate(por_circuito):
+        bloco = slice(inicio[k] + 1, inicio[k + 1])
+        Ak = Al[linhas_k][:, bloco].toarray()
+        ç_cd[linhas_k] = np.sqrt(np.einsum('ij,jk,ik->i', Ak, Cov_ll[bloco, bloco], Ak))
+    parametros = np.array([x_l[inicio[k]:inicio[k] + 1 + P] for k in range(K)])
+    ç_parametros = np.sqrt(np.array([np.diag(Cov_ll)[inicio[k]:inicio[k] + 1 + P] for k in range(K)]))
+    colunas_taras = np.concatenate([np.arange(inicio[k] + 1 + P, inicio[k + 1]) for k in range(K)]).astype(np.intp)
+    return {'pontos': pontos, 'g': x_s, 'ç_g': np.sqrt(var_s),
+            'circuitos': circuitos, 'deriva': parametros, 'ç_deriva': ç_parametros,
+            'taras': x_l[colunas_taras], 'ç_taras': np.sqrt(np.diag(Cov_ll)[colunas_taras]),
+            'linhas_taras': linhas_taras[np.argsort(k_idx[linhas_taras], kind='stable')],
+            'sigma0': sigma0, 'graus_de_liberdade': graus_de_liberdade,
+            'residuos': residuos, 'cd': cd, 'g_cd': y + cd, 'g_abs': y - modelo_l,
+            'ç_cd': ç_cd, 'ç_gabs': np.sqrt(var_s)[s_idx]}
+
+
+def tabela_de_estacoes(rede, dec=3):
+    """
+    Table of the adjusted stations (point, gravity and uncertainty in
+    mGal), in the DAT/TXT naming style.
+    """
+    import pandas as pd
+    return pd.DataFrame({'00_Pt': rede['pontos'],
+                         '01_g.Aj': np.around(rede['g'], dec),
+                         '02_ç.g.Aj': np.around(rede['ç_g'], dec)})
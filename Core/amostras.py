@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from esquema import (ESQUEMA_GRARED_P, Coluna, Problema, ErroValidacao, mapear_colunas, numerico,
+                     validar_leituras)
+
+#--------------------------------------------------
+#Agregação de amostras de gravímetros de registro contínuo
+#--------------------------------------------------
+'''
+Gravímetros modernos registram centenas de amostras (uma por segundo, por
+exemplo) em cada ocupação de estação, em vez das 3 leituras do modelo
+GRARED_P. Este módulo lê o registro em formato longo (uma amostra por
+linha: ponto, instante, leitura e os dados da estação), separa as
+ocupações (sequências de amostras do mesmo ponto) e calcula, para todas
+as ocupações de uma só vez, sem laço por amostra: remoção do tempo de
+assentamento, corte iterativo em sigma e média, mediana ou média aparada.
+O valor de cada ocupação, com a dispersão e o número de amostras usadas,
+segue para a conversão e a maré como as leituras do modelo GRARED_P.
+----------------------------
+Modern gravimeters log hundreds of samples (one per second, for example)
+per station occupation, instead of the 3 readings of the GRARED_P layout.
+This module reads the log in long format (one sample per line: station,
+instant, reading and the station data), splits the occupations (runs of
+samples of the same station) and computes, for every occupation at once,
+without a loop per sample: settling time removal, iterative sigma
+clipping and mean, median or trimmed mean. The value of each occupation,
+with its scatter and the number of samples used, goes on to the
+conversion and tide stages as the readings of the GRARED_P layout.
+'''
+
+ESTIMADORES = ('media', 'mediana', 'aparada')
+
+#Opções da agregação, com os nomes e valores padrão usados nos parâmetros da redução
+AGREGACAO_PADRAO = {'estimador': 'mediana', #Valor de cada ocupação
+                    'corte_sigma': 3.,       #Amostras a mais de corte_sigma desvios são descartadas (0: sem corte)
+                    'iteracoes_sigma': 5,    #Máximo de iterações do corte
+                    'fracao_aparada': 0.1,   #Fração descartada em cada ponta pela média aparada
+                    'assentamento': 0.,      #Segundos descartados no início de cada ocupação
+                    'intervalo_maximo': 0.}  #Intervalo (s) sem amostras que inicia nova ocupação (0: só a troca de ponto)
+
+#Colunas do registro de amostras; os dados da estação são os do modelo GRARED_P
+_ESTACAO = tuple(c for c in ESQUEMA_GRARED_P if c.nome not in ('g_l1', 'g_l2', 'g_l3', 'hora', 'minuto'))
+ESQUEMA_AMOSTRAS = (_ESTACAO[0],
+                    Coluna('instante', ('instante', 'timestamp', 'data hora', 'tempo', 'time'), None, None, False),
+                    Coluna('leitura', ('leitura', 'reading', 'g', 'grav'), 0., np.inf, False)) + _ESTACAO[1:]
+
+#Colunas por ocupação que a redução repassa à saída
+COLUNAS_AMOSTRAS = ('n_amostras', 'ç_amostras')
+
+
+def ler_amostras(nome_arquivo):
+    """
+    Reads a long-format sample log (CSV or whitespace separated text, one
+    header line) with the pandas C parser. Columns are found by their
+    header titles (see ESQUEMA_AMOSTRAS); instants are ISO 8601 and
+    become datetime64[ns] (NaT when invalid). Returns a dictionary of the
+    columns as read, plus 'instante'.
+    """
+    import pandas as pd
+    with open(nome_arquivo) as arq:
+        cabecalho = arq.readline()
+    separador = ',' if ',' in cabecalho else r'\s+'
+    titulos = [t.strip() for t in (cabecalho.split(',') if separador == ',' else cabecalho.split())]
+    nomes = mapear_colunas(titulos, ESQUEMA_AMOSTRAS)
+    if nomes is None:
+        raise ValueError('Cabeçalho do registro de amostras não reconhecido: %s' % ', '.join(titulos))
+    colunas = [n for n in nomes if n]
+    tabela = pd.read_csv(nome_arquivo, sep=separador, header=None, skiprows=1,
+                         names=[n or '_%d' % k for k, n in enumerate(nomes)], usecols=colunas,
+                         dtype={'instante': str}, engine='c')
+    amostras = {c: tabela[c].to_numpy() for c in colunas}
+    amostras['instante'] = pd.to_datetime(tabela['instante'], format='ISO8601',
+                                          errors='coerce').to_numpy(dtype='datetime64[ns]')
+    if np.isnat(amostras['instante']).any():
+        amostras['instante_lido'] = tabela['instante'].to_numpy() #Texto original, para o relatório de erros
+    return amostras
+
+
+def ocupacoes(ponto, instante, intervalo_maximo=0.):
+    """
+    Occupation index (0, 1, ...) of each sample: a new occupation starts
+    when the station changes or, with intervalo_maximo (s), after a gap
+    longer than it. A station visited again later is a new occupation.
+    """
+    ponto = np.asarray(ponto)
+    nova = np.ones(len(ponto), dtype=bool)
+    nova[1:] = ponto[1:] != ponto[:-1]
+    if intervalo_maximo:
+        nova[1:] |= np.diff(instante) > np.timedelta64(int(intervalo_maximo*1e9), 'ns')
+    return np.cumsum(nova) - 1
+
+
+def _posicoes(chave, g, n_ocup):
+    #Posição (0, 1, ...) de cada amostra entre as amostras escolhidas da sua ocupação, em ordem de g
+    cont = np.cumsum(chave)
+    inicio = np.searchsorted(g, np.arange(n_ocup)) #Toda ocupação tem ao menos uma amostra
+    return cont - 1 - (cont[inicio] - chave[inicio])[g]
+
+
+def _mediana(x, g, manter, n_ocup):
+    #Mediana das amostras mantidas de cada ocupação; x ordenado por (g, x)
+    n = np.bincount(g, weights=manter, minlength=n_ocup).astype(np.int64)
+    pos = _posicoes(manter, g, n_ocup)
+    mediana = np.zeros(n_ocup)
+    for meio in ((n - 1)//2, n//2): #Os dois elementos centrais (o mesmo quando n é ímpar)
+        escolhidos = manter & (pos == meio[g])
+        mediana[g[escolhidos]] += x[escolhidos]/2
+    return np.where(n > 0, mediana, np.nan)
+
+
+def _media_desvio(x, g, manter, n_ocup):
+    #Média e desvio padrão amostral das amostras mantidas de cada ocupação
+    n = np.bincount(g, weights=manter, minlength=n_ocup)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.bincount(g, weights=np.where(manter, x, 0.), minlength=n_ocup)/n
+        residuo = np.where(manter, x - media[g], 0.)
+        desvio = np.sqrt(np.bincount(g, weights=residuo*residuo, minlength=n_ocup)/(n - 1))
+    return media, np.where(n > 1, desvio, 0.)
+
+
+def agregar_amostras(ponto, instante, leitura, estimador='mediana', corte_sigma=3., iteracoes_sigma=5,
+                     fracao_aparada=0.1, assentamento=0., intervalo_maximo=0.):
+    """
+    Robust value of each occupation of a sample stream (see
+    AGREGACAO_PADRAO for the options). Samples within assentamento seconds
+    of the first one of their occupation, and invalid ones, are dropped.
+    With corte_sigma, samples farther than corte_sigma standard deviations
+    from the median are dropped, iterating until nothing changes (at most
+    iteracoes_sigma times). The remaining samples give the mean, median or
+    mean trimmed by fracao_aparada at each end. Returns, per occupation:
+    'primeira' (index of its first sample), 'ponto', 'instante' (mean
+    instant of the samples used), 'leitura', 'ç_amostras' (standard
+    deviation of the samples used), 'n_amostras' (samples used) and
+    'n_total'.
+    """
+    if estimador not in ESTIMADORES:
+        raise ValueError('Estimador desconhecido: %r (use %s)' % (estimador, ', '.join(ESTIMADORES)))
+    leitura = np.asarray(leitura, dtype=np.float64)
+    instante = np.asarray(instante, dtype='datetime64[ns]')
+    ocup = ocupacoes(ponto, instante, intervalo_maximo)
+    n_ocup = int(ocup[-1]) + 1 if len(ocup) else 0
+    primeira = np.searchsorted(ocup, np.arange(n_ocup))
+
+    #Segundos desde a primeira amostra da ocupação
+    segundos = (instante - instante[primeira][ocup]).astype(np.float64)/1e9
+    manter = np.isfinite(leitura) & ~np.isnat(instante) & (segundos >= assentamento)
+
+    #Amostras ordenadas por ocupação e, dentro dela, por leitura: a posição global de cada leitura
+    #compõe com a ocupação uma chave inteira única, que ordena bem mais rápido que np.lexsort
+    posicao = np.empty(len(leitura), dtype=np.int64)
+    posicao[np.argsort(leitura)] = np.arange(len(leitura))
+    ordem = np.argsort(ocup*np.int64(len(leitura)) + posicao)
+    x, g, manter_o = leitura[ordem], ocup[ordem], manter[ordem]
+    for _ in range(int(iteracoes_sigma) if corte_sigma else 0):
+        centro = _mediana(x, g, manter_o, n_ocup)
+        _, desvio = _media_desvio(x, g, manter_o, n_ocup)
+        with np.errstate(invalid='ignore'):
+            novo = manter_o & (np.abs(x - centro[g]) <= corte_sigma*desvio[g])
+        if np.array_equal(novo, manter_o):
+            break
+        manter_o = novo
+
+    media, desvio = _media_desvio(x, g, manter_o, n_ocup)
+    n_usadas = np.bincount(g, weights=manter_o, minlength=n_ocup).astype(np.int64)
+    if estimador == 'mediana':
+        valor = _mediana(x, g, manter_o, n_ocup)
+    elif estimador == 'aparada':
+        corte = np.floor(fracao_aparada*n_usadas).astype(np.int64)
+        pos = _posicoes(manter_o, g, n_ocup)
+        valor, _ = _media_desvio(x, g, manter_o & (pos >= corte[g]) & (pos < (n_usadas - corte)[g]), n_ocup)
+    else:
+        valor = media
+
+    manter[ordem] = manter_o
+    with np.errstate(invalid='ignore'):
+        deslocamento = np.bincount(ocup, weights=np.where(manter, segundos, 0.), minlength=n_ocup)/n_usadas
+    instante_medio = instante[primeira] + np.round(np.nan_to_num(deslocamento)*1e9).astype('timedelta64[ns]')
+    return {'primeira': primeira, 'ponto': np.asarray(ponto)[primeira], 'instante': instante_medio,
+            'leitura': valor, 'ç_amostras': desvio, 'n_amostras': n_usadas,
+            'n_total': np.bincount(ocup, minlength=n_ocup)}
+
+
+def leituras_das_amostras(amostras, tabela=None, **opcoes):
+    """
+    Readings in the GRARED_P layout (see reducao.ler_levantamento) from a
+    sample stream read by ler_amostras: one row per occupation, with the
+    aggregated value in g_l1, g_l2 and g_l3, the time of day and date of
+    its mean instant, the station data of its first sample and the
+    COLUNAS_AMOSTRAS. opcoes are those of agregar_amostras. Invalid samples
+    and occupations left without samples are reported, with the station
+    data checked as in ler_levantamento, in an ErroValidacao.
+    """
+    leitura = numerico(amostras['leitura'])
+    ponto = numerico(amostras['ponto'])
+    instante = amostras['instante']
+    #Linha do arquivo de cada amostra: depois do cabeçalho
+    lidos = dict(amostras, instante=amostras.get('instante_lido', instante))
+    problemas = [Problema(i + 2, c, lidos[c][i], 'valor ausente ou não numérico' if c != 'instante'
+                          else 'instante inválido (use AAAA-MM-DDThh:mm:ss)')
+                 for c, ruins in (('ponto', ~np.isfinite(ponto)), ('instante', np.isnat(instante)),
+                                  ('leitura', ~np.isfinite(leitura)))
+                 for i in np.flatnonzero(ruins).tolist()]
+    ocup = agregar_amostras(ponto, instante, leitura, **opcoes)
+
+    primeira = ocup['primeira']
+    data = ocup['instante'].astype('datetime64[D]')
+    segundos = (ocup['instante'] - data).astype(np.float64)/1e9
+    hora = np.floor(segundos/3600)
+    leituras = {'ponto': ocup['ponto'], 'g_l1': ocup['leitura'], 'g_l2': ocup['leitura'],
+                'g_l3': ocup['leitura'], 'hora': hora, 'minuto': (segundos - 3600*hora)/60}
+    for c in _ESTACAO[1:]:
+        leituras[c.nome] = numerico(amostras[c.nome])[primeira]
+    leituras['data'] = data
+    leituras['n_amostras'] = ocup['n_amostras']
+    leituras['ç_amostras'] = ocup['ç_amostras']
+
+    linhas = primeira + 2
+    problemas += [Problema(linhas[k], 'leitura', int(ocup['n_total'][k]),
+                           'ocupação do ponto %g sem amostras válidas' % ocup['ponto'][k])
+                  for k in np.flatnonzero(ocup['n_amostras'] == 0).tolist()]
+    validas = ocup['n_amostras'] > 0
+    problemas += validar_leituras({c: v[validas] for c, v in leituras.items()}, tabela, linhas[validas])
+    if problemas:
+        raise ErroValidacao(sorted(problemas, key=lambda p: p.linha))
+    return leituras
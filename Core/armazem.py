@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from conversao import TabelaConversao, pasta_cache
+from reducao import (ler_levantamento, corrigir_leituras, corrigir_leituras_em_blocos, corrigir_circuito,
+                     corrigir_anomalias, PARAMETROS_PADRAO)
+from correcoes import saidas_anomalias
+from instrumentacao import etapa
+
+#--------------------------------------------------
+#Armazém em disco dos resultados intermediários
+#--------------------------------------------------
+'''
+Guarda as colunas de cada etapa da redução em arquivos .npy, lidos de volta
+por mapeamento de memória. Cada levantamento tem uma pasta identificada pelo
+hash do conteúdo do arquivo de entrada, e cada etapa uma subpasta
+identificada pela chave da etapa anterior e pelos parâmetros dos quais ela
+depende (DEPENDENCIAS). Assim, ao mudar só a densidade ou o elipsoide,
+apenas as anomalias são recalculadas e a conversão e a maré são
+reaproveitadas.
+----------------------------
+Keeps the columns of each reduction stage in .npy files, read back through
+memory mapping. Each survey has a folder named after the hash of the
+content of the input file, and each stage a subfolder named after the key
+of the previous stage and the parameters it depends on (DEPENDENCIAS). So,
+when only the density or the ellipsoid change, only the anomalies are
+recomputed and the conversion and tide are reused.
+'''
+
+VERSAO_ARMAZEM = 3 #Mudar quando o cálculo de alguma etapa mudar, para invalidar o armazém
+
+#Parâmetros de que cada etapa depende, na ordem do pipeline
+DEPENDENCIAS = (('leituras', ('dia', 'mes', 'ano', 'fuso_horario', 'estimador', 'corte_sigma', 'iteracoes_sigma',
+                              'fracao_aparada', 'assentamento', 'intervalo_maximo')),
+                ('circuito', ('g_ref', 'eotvos', 'incertezas')),
+                ('anomalias', ('densidade', 'incertezas', 'free_air', 'bouguer', 'elipsoide', 'formula_normal',
+                               'ar_livre_2a_ordem', 'atmosferica')))
+
+
+def _hash(*partes):
+    h = hashlib.blake2b(digest_size=12)
+    for parte in partes:
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def hash_arquivo(nome_arquivo, bloco=2**20):
+    """
+    Hash of the content of a file, read in blocks of 1 MB.
+    """
+    h = hashlib.blake2b(digest_size=12)
+    with open(nome_arquivo, 'rb') as arq:
+        for parte in iter(lambda: arq.read(bloco), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def hash_tabela(tabela):
+    if not isinstance(tabela, TabelaConversao):
+        tabela = TabelaConversao(*tabela)
+    return _hash(*(np.ascontiguousarray(c).tobytes() for c in tabela))
+
+
+class ArmazemResultados:
+    """
+    On-disk store of the intermediate columns of the reduction, under
+    pasta (by default the 'resultados' folder of conversao.pasta_cache()).
+    versoes is how many versions of each stage are kept per survey; older
+    ones are removed when a new one is written.
+    """
+
+    def __init__(self, pasta=None, versoes=3):
+        self.pasta = pasta or os.path.join(pasta_cache(), 'resultados')
+        self.versoes = versoes
+
+    def _pasta_etapa(self, entrada, nome, chave):
+        return os.path.join(self.pasta, entrada, '%s-%s' % (nome, chave))
+
+    def obter(self, entrada, nome, chave):
+        """
+        The columns of stage nome with the given key, memory mapped
+        read-only, or None when they were not stored.
+        """
+        pasta = self._pasta_etapa(entrada, nome, chave)
+        try:
+            with open(os.path.join(pasta, 'colunas.json'), encoding='utf-8') as arq:
+                colunas = json.load(arq)
+            saida = {}
+            for c in colunas:
+                valor = np.load(os.path.join(pasta, c + '.npy'), mmap_mode='r')
+                saida[c] = valor[()] if valor.ndim == 0 else valor
+        except (OSError, ValueError):
+            return None
+        return saida
+
+    def guardar(self, entrada, nome, chave, colunas):
+        """
+        Stores the columns of stage nome. The folder is written aside and
+        renamed at the end, so a half-written stage is never read. Failures
+        to write are ignored, since the store is only an optimization.
+        """
+        final = self._pasta_etapa(entrada, nome, chave)
+        try:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            temporaria = tempfile.mkdtemp(prefix='.%s-' % nome, dir=os.path.dirname(final))
+        except OSError:
+            return
+        try:
+            for c, valor in colunas.items():
+                np.save(os.path.join(temporaria, c + '.npy'), np.asarray(valor), allow_pickle=False)
+            with open(os.path.join(temporaria, 'colunas.json'), 'w', encoding='utf-8') as arq:
+                json.dump(list(colunas), arq, ensure_ascii=False)
+            os.rename(temporaria, final)
+        except OSError: #Outro processo já guardou a mesma etapa, ou falta espaço
+            shutil.rmtree(temporaria, ignore_errors=True)
+            return
+        self._podar(entrada, nome)
+
+    def _podar(self, entrada, nome):
+        pasta = os.path.join(self.pasta, entrada)
+        versoes = [os.path.join(pasta, v) for v in os.listdir(pasta) if v.startswith(nome + '-')]
+        versoes.sort(key=os.path.getmtime, reverse=True)
+        for antiga in versoes[self.versoes:]:
+            shutil.rmtree(antiga, ignore_errors=True)
+
+    def limpar(self):
+        """
+        Removes every stored result.
+        """
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+
+def _valor(v):
+    #1, 1.0 e '1' (CLI, GUI) levam à mesma chave; dicionários, em qualquer ordem, também
+    if isinstance(v, dict):
+        return repr(sorted((k, _valor(x)) for k, x in v.items()))
+    try:
+        return repr(float(v))
+    except (TypeError, ValueError):
+        return repr(v)
+
+
+def chaves_das_etapas(entrada, tabela, params):
+    """
+    Key of each stage of DEPENDENCIAS: every key chains the previous one
+    with the parameters of its own stage, so a change upstream also
+    invalidates everything downstream.
+    """
+    parametros = dict(PARAMETROS_PADRAO, **params)
+    chaves = {}
+    anterior = _hash(VERSAO_ARMAZEM, entrada, hash_tabela(tabela))
+    for nome, dependencias in DEPENDENCIAS:
+        anterior = _hash(anterior, *('%s=%s' % (p, _valor(parametros[p])) for p in dependencias))
+        chaves[nome] = anterior
+    return chaves
+
+
+def reduzir_com_armazem(nome_arquivo, tabela, params, tipo_arquivo='excel', aba='Plan1', armazem=None,
+                        linhas_por_bloco=None, instrumentacao=None):
+    """
+    Same results as reading the file and running reduce_survey (or
+    reduzir_txt_em_blocos when linhas_por_bloco is given), but every stage
+    whose input and parameters did not change is read from armazem (an
+    ArmazemResultados, or a folder) instead of recomputed. When every stage
+    is stored, the input file is only hashed, not read.
+    """
+    if not isinstance(armazem, ArmazemResultados):
+        armazem = ArmazemResultados(armazem)
+    if not isinstance(tabela, TabelaConversao):
+        tabela = TabelaConversao(*tabela)
+    with etapa(instrumentacao, 'armazem'):
+        entrada = _hash(hash_arquivo(nome_arquivo), tipo_arquivo, aba if tipo_arquivo == 'excel' else '')
+        chaves = chaves_das_etapas(entrada, tabela, params)
+        guardados = {nome: armazem.obter(entrada, nome, chaves[nome]) for nome, _ in DEPENDENCIAS}
+
+    parciais = guardados['leituras']
+    if parciais is None:
+        if tipo_arquivo == 'txt' and linhas_por_bloco:
+            parciais = corrigir_leituras_em_blocos(nome_arquivo, tabela, params, linhas_por_bloco, instrumentacao)
+        else:
+            leituras = ler_levantamento(nome_arquivo, tipo_arquivo, aba, instrumentacao, tabela, params)
+            parciais = corrigir_leituras(leituras, tabela, params, instrumentacao)
+        armazem.guardar(entrada, 'leituras', chaves['leituras'], parciais)
+
+    circuito = guardados['circuito']
+    if circuito is None:
+        resultados = corrigir_circuito(parciais, params, instrumentacao)
+        anomalias = {c: resultados[c] for c in saidas_anomalias(dict(PARAMETROS_PADRAO, **params))}
+        circuito = {c: v for c, v in resultados.items() if c not in parciais and c not in anomalias}
+        armazem.guardar(entrada, 'circuito', chaves['circuito'], circuito)
+        if guardados['anomalias'] is None:
+            armazem.guardar(entrada, 'anomalias', chaves['anomalias'], anomalias)
+        return resultados
+
+    resultados = dict(parciais)
+    resultados.update(circuito)
+    anomalias = guardados['anomalias']
+    if anomalias is None:
+        anomalias = corrigir_anomalias(resultados, params, instrumentacao)
+        armazem.guardar(entrada, 'anomalias', chaves['anomalias'], anomalias)
+    resultados.update(anomalias)
+    return resultados
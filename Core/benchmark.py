@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from mare import TideModel, EphemerisCache
+from conversao import TabelaConversao
+from calculos import (dms_para_graus, tempo_decorrido, deriva_linear, gravidade_teorica,
+                      correcao_bouguer)
+from reducao import (COLUNAS_LEVANTAMENTO, ler_levantamento, corrigir_leituras, corrigir_circuito,
+                     reduce_survey, escrever_saida)
+
+#--------------------------------------------------
+#Benchmark do pipeline de redução
+#--------------------------------------------------
+'''
+Gera levantamentos sintéticos no modelo GRARED_P (14 colunas) e tabelas no
+modelo Tabelas_conv_todas, mede cada etapa separadamente e grava o
+resultado em JSON, para comparar versões.
+----------------------------
+Generates synthetic surveys in the GRARED_P layout (14 columns) and tables
+in the Tabelas_conv_todas layout, times each stage on its own and saves the
+result as JSON, so that versions can be compared.
+
+Com --importacao, mede o tempo de importação (python -X importtime) dos
+módulos de ORCAMENTO_IMPORTACAO em processos novos e falha se algum passar
+do seu orçamento ou carregar um pacote pesado (pandas, Tk, Excel) só por
+ser importado. A mesma conferência roda no pytest (test_importacao.py).
+----------------------------
+With --importacao, measures the import time (python -X importtime) of the
+modules of ORCAMENTO_IMPORTACAO in fresh processes and fails when one goes
+over its budget or loads a heavy package (pandas, Tk, Excel) just by being
+imported. The same check runs under pytest (test_importacao.py).
+
+Uso / Usage:
+    python benchmark.py --tamanhos 10 1000 100000 --json bench.json
+    python benchmark.py --json novo.json --comparar bench.json
+    python benchmark.py --importacao
+'''
+
+TAMANHOS_PADRAO = (10, 100, 1000, 10000, 100000, 1000000)
+LIMITE_EXCEL = 20000 #Acima disso a leitura/escrita Excel domina o tempo total
+LIMITE_ESCALAR = 10000 #Maior n para o TideModel.solve_longman escalar
+
+#Pacotes que só podem ser carregados quando a função que os usa é chamada
+PACOTES_PESADOS = ('pandas', 'tkinter', 'openpyxl', 'xlsxwriter', 'scipy', 'rasterio', 'pyarrow',
+                   'multiprocessing')
+#Módulo e tempo de importação permitido, em múltiplos do tempo do próprio NumPy na mesma máquina
+#(o pandas sozinho leva uns 4x o NumPy). A razão varia de uma máquina para outra, por isso cada
+#orçamento tem ao menos 30% de folga sobre a maior razão medida
+ORCAMENTO_IMPORTACAO = (('mare', 1.6), ('gravidade_normal', 1.6), ('conversao', 1.6), ('calculos', 1.6),
+                        ('correcoes', 2.0), ('grade', 1.9), ('controle', 1.9), ('reducao', 2.3),
+                        ('lote', 2.4), ('grared_cli', 2.5), ('servico', 3.0))
+
+
+def gerar_tabela_conversao(grav='996', passo=100., linhas=71, semente=0):
+    """
+    Synthetic conversion table in the Tabelas_conv_todas layout (gc1 every
+    100 counter units, cumulative gc2 and a slowly varying gf0).
+    """
+    rng = np.random.default_rng(semente)
+    gc1 = np.arange(linhas)*passo
+    gf0 = 1.005 - np.cumsum(rng.uniform(0, 2e-5, linhas))
+    gc2 = np.concatenate(([0.], np.cumsum(gf0[:-1]*passo)))
+    return TabelaConversao(gc1, gc2, gf0, grav=grav)
+
+
+def gerar_levantamento(n, semente=0):
+    """
+    Synthetic loop of n readings in the GRARED_P layout, closing on its
+    first point, spread between 8h and 18h local time over one day.
+    """
+    n = max(int(n), 2)
+    rng = np.random.default_rng(semente)
+    ponto = np.arange(1, n+1, dtype=np.float64)
+    ponto[-1] = ponto[0]
+    base = rng.uniform(1000, 6000, n)
+    base[-1] = base[0] + rng.normal(0, 0.05)
+    hora_dec = np.linspace(8., 18., n)
+    lat = -22.5 + rng.uniform(-0.5, 0.5, n)
+    lon = -46.5 + rng.uniform(-0.5, 0.5, n)
+    lat[-1], lon[-1] = lat[0], lon[0]
+    Lat_gra = np.trunc(lat)
+    Lon_gra = np.trunc(lon)
+    Lat_m = np.abs(lat - Lat_gra)*60
+    Lon_m = np.abs(lon - Lon_gra)*60
+    alt = rng.uniform(0, 1500, n)
+    alt[-1] = alt[0]
+    return {'ponto': ponto,
+            'g_l1': base + rng.normal(0, 0.02, n),
+            'g_l2': base + rng.normal(0, 0.02, n),
+            'g_l3': base + rng.normal(0, 0.02, n),
+            'hora': np.floor(hora_dec), 'minuto': (hora_dec - np.floor(hora_dec))*60,
+            'h_instrumento': rng.uniform(0.005, 0.015, n),
+            'Lat_gra': Lat_gra, 'Lat_min': np.floor(Lat_m), 'Lat_seg': (Lat_m - np.floor(Lat_m))*60,
+            'Lon_gra': Lon_gra, 'Lon_min': np.floor(Lon_m), 'Lon_seg': (Lon_m - np.floor(Lon_m))*60,
+            'alt_m': alt}
+
+
+def salvar_levantamento_txt(leituras, caminho):
+    matriz = np.column_stack([leituras[c] for c in COLUNAS_LEVANTAMENTO])
+    np.savetxt(caminho, matriz, fmt='%.6f', delimiter='\t', header='\t'.join(COLUNAS_LEVANTAMENTO), comments='')
+
+
+def salvar_levantamento_excel(leituras, caminho):
+    #Duas linhas de cabeçalho, como no GRARED_P.xlsx
+    matriz = np.column_stack([leituras[c] for c in COLUNAS_LEVANTAMENTO])
+    df = pd.DataFrame(matriz)
+    with pd.ExcelWriter(caminho) as excel_writer:
+        pd.DataFrame([list(COLUNAS_LEVANTAMENTO), ['']*14]).to_excel(excel_writer, sheet_name='Plan1', header=False, index=False)
+        df.to_excel(excel_writer, sheet_name='Plan1', header=False, index=False, startrow=2)
+
+
+def cronometrar(funcao, repeticoes):
+    """
+    Runs funcao repeticoes times and returns the list of wall times.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - t)
+    return tempos
+
+
+def medir(n, repeticoes, pasta, parametros):
+    """
+    Times every stage for a survey of n readings. Returns a list of
+    dictionaries (stage, n, times).
+    """
+    leituras = gerar_levantamento(n)
+    tabela = gerar_tabela_conversao()
+    n = len(leituras['ponto'])
+    txt = os.path.join(pasta, 'levantamento_%d.txt' % n)
+    salvar_levantamento_txt(leituras, txt)
+    parciais = corrigir_leituras(leituras, tabela, parametros)
+    resultados = corrigir_circuito(parciais, parametros)
+    g_med_lido = (leituras['g_l1']+leituras['g_l2']+leituras['g_l3'])/3
+    lat = dms_para_graus(leituras['Lat_gra'], leituras['Lat_min'], leituras['Lat_seg'])
+    lon = dms_para_graus(leituras['Lon_gra'], leituras['Lon_min'], leituras['Lon_seg'])
+    instantes = (np.datetime64('2017-01-01T11:00', 'm') + np.trunc(leituras['hora']).astype('timedelta64[h]')
+                 + np.trunc(leituras['minuto']).astype('timedelta64[m]'))
+    Lat_rad = np.radians(lat)
+
+    etapas = [('ingestao_txt', lambda: ler_levantamento(txt, 'txt')),
+              ('conversao', lambda: tabela.converter(g_med_lido)),
+              ('dms_graus', lambda: dms_para_graus(leituras['Lat_gra'], leituras['Lat_min'], leituras['Lat_seg'])),
+              ('mare_vetorizada', lambda: TideModel().solve_longman_array(lat, lon, leituras['alt_m'], instantes)),
+              ('mare_cache_efemerides', lambda: TideModel(EphemerisCache()).solve_longman_array(lat, lon, leituras['alt_m'], instantes)),
+              ('deriva', lambda: deriva_linear(parciais['ponto'], parciais['g_cls'], tempo_decorrido(parciais['hora_dec']))),
+              ('gravidade_normal', lambda: gravidade_teorica(Lat_rad, parametros.get('elipsoide', 'grs84'))),
+              ('ar_livre_bouguer', lambda: (0.308596*leituras['alt_m'], correcao_bouguer(leituras['alt_m'], 2.67))),
+              ('saida_txt', lambda: escrever_saida(resultados, os.path.join(pasta, 'saida.dat'))),
+              ('reducao_completa', lambda: reduce_survey(leituras, tabela, parametros))]
+
+    if n <= LIMITE_ESCALAR:
+        tide = TideModel()
+        datas = instantes.astype('datetime64[s]').astype(object)
+        etapas.append(('mare_escalar', lambda: [tide.solve_longman(lat[k], lon[k], leituras['alt_m'][k], datas[k])
+                                                for k in range(n)]))
+    if n <= LIMITE_EXCEL:
+        xlsx = os.path.join(pasta, 'levantamento_%d.xlsx' % n)
+        salvar_levantamento_excel(leituras, xlsx)
+        etapas.append(('ingestao_excel', lambda: ler_levantamento(xlsx, 'excel')))
+        etapas.append(('saida_excel', lambda: escrever_saida(resultados, None, os.path.join(pasta, 'saida.xlsx'))))
+
+    medidas = []
+    for nome, funcao in etapas:
+        tempos = cronometrar(funcao, repeticoes)
+        medidas.append({'etapa': nome, 'n': n, 'repeticoes': repeticoes,
+                        'min_s': min(tempos), 'mediana_s': float(np.median(tempos))})
+    return medidas
+
+
+def tempo_de_importacao(modulo, repeticoes=5):
+    """
+    Cumulative import time of modulo in milliseconds (the minimum of
+    repeticoes fresh interpreters, from python -X importtime) and the set
+    of every module it loaded.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % modulo],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        if saida.returncode:
+            raise RuntimeError('Falha ao importar %s:\n%s' % (modulo, saida.stderr))
+        carregados = set()
+        for linha in saida.stderr.splitlines():
+            if not linha.startswith('import time:') or '|' not in linha:
+                continue
+            _, cumulativo, nome = linha.split('|')
+            if cumulativo.strip().isdigit():
+                carregados.add(nome.strip())
+                if nome.strip() == modulo:
+                    tempos.append(int(cumulativo)/1000)
+    return min(tempos), carregados
+
+
+def conferir_importacao(repeticoes=7):
+    """
+    Checks every module of ORCAMENTO_IMPORTACAO and returns the list of
+    problems (empty when all are within budget). The budget is a multiple
+    of the import time of NumPy on the same machine, so it holds on slower
+    machines too.
+    """
+    numpy_ms, _ = tempo_de_importacao('numpy', repeticoes)
+    print('%-18s %8.1f ms' % ('numpy', numpy_ms))
+    problemas = []
+    for modulo, orcamento in ORCAMENTO_IMPORTACAO:
+        tempo, carregados = tempo_de_importacao(modulo, repeticoes)
+        pesados = sorted(p for p in PACOTES_PESADOS if p in carregados)
+        limite = numpy_ms*orcamento
+        print('%-18s %8.1f ms (orçamento %.1f ms)%s' % (modulo, tempo, limite,
+                                                        ' carrega ' + ', '.join(pesados) if pesados else ''))
+        if pesados:
+            problemas.append('%s carrega %s ao ser importado' % (modulo, ', '.join(pesados)))
+        if tempo > limite:
+            problemas.append('%s leva %.1f ms para importar (orçamento: %.1f ms)' % (modulo, tempo, limite))
+    return problemas
+
+
+def comparar(atual, referencia, tolerancia=1.25, minimo_s=1e-3):
+    """
+    Compares two benchmark reports and returns the (stage, n, ratio) of
+    every measurement that became slower than tolerancia times the
+    reference minimum. Times below minimo_s are too noisy and are ignored.
+    """
+    ref = {(m['etapa'], m['n']): m['min_s'] for m in referencia['medidas']}
+    piores = []
+    for m in atual['medidas']:
+        chave = (m['etapa'], m['n'])
+        if chave in ref and m['min_s'] >= minimo_s and m['min_s'] > tolerancia*max(ref[chave], 1e-12):
+            piores.append((m['etapa'], m['n'], m['min_s']/ref[chave]))
+    return piores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline de redução do GRARED')
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=list(TAMANHOS_PADRAO),
+                        help='números de leituras dos levantamentos sintéticos')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--json', default='benchmark.json', help='arquivo JSON de saída')
+    parser.add_argument('--comparar', default=None, help='JSON de referência para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=1.25,
+                        help='razão de tempo acima da qual uma etapa é considerada regressão')
+    parser.add_argument('--importacao', action='store_true',
+                        help='só confere o tempo de importação dos módulos contra ORCAMENTO_IMPORTACAO')
+    args = parser.parse_args(argv)
+
+    if args.importacao:
+        problemas = conferir_importacao(max(args.repeticoes, 7)) #O mínimo de poucas repetições ainda tem ruído
+        for problema in problemas:
+            print('REGRESSÃO: %s' % problema, file=sys.stderr)
+        return 1 if problemas else 0
+
+    parametros = {'g_ref': 978600.0}
+    pasta = tempfile.mkdtemp(prefix='grared_bench_')
+    relatorio = {'data': datetime.now(timezone.utc).isoformat(),
+                 'python': platform.python_version(), 'plataforma': platform.platform(),
+                 'numpy': np.__version__, 'pandas': pd.__version__, 'medidas': []}
+    try:
+        for n in args.tamanhos:
+            for m in medir(n, args.repeticoes, pasta, parametros):
+                relatorio['medidas'].append(m)
+                print('%-22s n=%-8d min=%.6fs' % (m['etapa'], m['n'], m['min_s']))
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    with open(args.json, 'w', encoding='utf-8') as arq:
+        json.dump(relatorio, arq, indent=1)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arq:
+            piores = comparar(relatorio, json.load(arq), args.tolerancia)
+        for etapa, n, razao in piores:
+            print('REGRESSÃO: %s n=%d %.2fx mais lenta' % (etapa, n, razao), file=sys.stderr)
+        return 1 if piores else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
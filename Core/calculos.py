@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from gravidade_normal import gravidade_normal
+
+#--------------------------------------------------
+#Etapas vetorizadas da redução
+#--------------------------------------------------
+'''
+Versões vetorizadas das etapas que antes cresciam arrays com np.append
+dentro de laços (custo O(n²)). Todas recebem e devolvem arrays NumPy.
+----------------------------
+Vectorized versions of the stages that used to grow arrays with np.append
+inside loops (O(n²) cost). All of them take and return NumPy arrays.
+'''
+
+
+def dms_para_graus(graus, minutos, segundos):
+    """
+    Converts degrees, minutes and seconds to decimal degrees. The sign is
+    taken from the degrees column: minutes and seconds are added when it is
+    >= 0 and subtracted otherwise.
+    """
+    graus = np.asarray(graus, dtype=np.float64)
+    minutos = np.asarray(minutos, dtype=np.float64)/60
+    segundos = np.asarray(segundos, dtype=np.float64)/3600
+    return np.where(graus >= 0, graus + minutos + segundos, graus - minutos - segundos) #Mesma ordem das somas da versão em laço
+
+
+def tempo_decorrido(hora_dec):
+    """
+    Elapsed time of each reading since the first one, in the units of
+    hora_dec (decimal hours).
+    """
+    hora_dec = np.asarray(hora_dec, dtype=np.float64)
+    return hora_dec - hora_dec[0]
+
+
+def correcao_bouguer(alt_m, densidade, ç_densidade=0.01, ç_alt=0.5):
+    """
+    Simple Bouguer correction (mGal) and its uncertainty for each altitude.
+    Positive altitudes use 0.04192*densidade*alt, negative ones (stations
+    below sea level) 0.08384*densidade*alt, and zero altitude gives zero.
+    """
+    alt_m = np.asarray(alt_m, dtype=np.float64)
+    fator = np.where(alt_m > 0, 0.04192, np.where(alt_m < 0, 0.08384, 0.))
+    cb = fator*densidade*alt_m
+    ç_cb = fator*(alt_m**2*ç_densidade**2+densidade**2*ç_alt**2)**0.5
+    return cb, ç_cb
+
+
+def deriva_linear(ponto, g_cls, delta_t):
+    """
+    Linear drift correction of a loop that opens and closes on the same
+    point: the closing difference is spread proportionally to the elapsed
+    time delta_t. Returns the correction of each reading.
+    """
+    if ponto[0]!=ponto[-1]:
+        raise ValueError('A deriva exige que o circuito comece e termine no mesmo ponto (ponto %g, ponto %g)' % (ponto[0], ponto[-1]))
+    delta_g=g_cls[-1]-g_cls[0]
+    return (-delta_g/delta_t[-1])*delta_t
+
+
+def gravidade_teorica(Lat_rad, elipsoide):
+    """
+    Normal (theoretical) gravity in mGal at the latitudes Lat_rad (radians)
+    for a reference ellipsoid of gravidade_normal.ELIPSOIDES ('grs67',
+    'grs80', 'grs84' or 'wgs84'), with its default formula.
+    """
+    return gravidade_normal(np.sin(Lat_rad)**2, elipsoide)
+
+
+def datas_das_leituras(datas):
+    """
+    Converts a per-row date column to datetime64[D]. Accepts datetime64
+    values, dates or timestamps read from Excel, ISO or DD/MM/YYYY strings
+    and YYYYMMDD numbers (the form that fits a numeric DAT/TXT file).
+    Dates that cannot be read are NaT.
+    """
+    datas = np.asarray(datas)
+    if np.issubdtype(datas.dtype, np.datetime64):
+        return datas.astype('datetime64[D]')
+    if np.issubdtype(datas.dtype, np.number):
+        validas = np.isfinite(datas)
+        aaaammdd = np.where(validas, datas, 19700101).astype(np.int64)
+        anos = (aaaammdd//10000 - 1970).astype('datetime64[Y]')
+        meses = anos.astype('datetime64[M]') + (aaaammdd//100 % 100 - 1).astype('timedelta64[M]')
+        saida = meses.astype('datetime64[D]') + (aaaammdd % 100 - 1).astype('timedelta64[D]')
+        #Mês ou dia fora da faixa (ou data que não existe, como 31/04) viram NaT
+        validas &= saida.astype('datetime64[M]') == meses
+        validas &= (aaaammdd//100 % 100 >= 1) & (aaaammdd//100 % 100 <= 12) & (aaaammdd % 100 >= 1)
+        return np.where(validas, saida, np.datetime64('NaT'))
+    import pandas as pd
+    textos = pd.Series(datas, dtype=object).astype(str)
+    iso = textos.str.match(r'^\d{4}-').to_numpy() #AAAA-MM-DD; os demais são DD/MM/AAAA
+    saida = np.empty(len(textos), dtype='datetime64[D]')
+    saida[iso] = pd.to_datetime(textos[iso], format='mixed', errors='coerce').to_numpy().astype('datetime64[D]')
+    saida[~iso] = pd.to_datetime(textos[~iso], format='mixed', dayfirst=True,
+                                 errors='coerce').to_numpy().astype('datetime64[D]')
+    return saida
+
+
+def virada_de_dia(hora_dec, anterior=None):
+    """
+    Day offset of each reading of a sequence without a date column: the day
+    advances whenever the clock goes back by more than 12 hours (a loop
+    that crosses midnight). anterior is the (day offset, hour) of the
+    reading just before this sequence, when it is read in blocks.
+    """
+    hora_dec = np.asarray(hora_dec, dtype=np.float64)
+    dia, hora = anterior if anterior is not None else (0, hora_dec[:1])
+    horas_anteriores = np.concatenate((np.atleast_1d(hora), hora_dec[:-1]))
+    return dia + np.cumsum(hora_dec < horas_anteriores - 12)
+
+
+def instantes_utc(datas, hora, minuto, fuso_horario):
+    """
+    UTC instants (datetime64[m]) of readings taken at local hora:minuto of
+    the dates datas. Hours past midnight and the time zone shift roll over
+    into the right day; fractional time zones (e.g. -3.5) are kept.
+    """
+    return (np.asarray(datas, dtype='datetime64[m]') + np.trunc(hora).astype('timedelta64[h]')
+            + np.trunc(minuto).astype('timedelta64[m]') - np.timedelta64(int(round(fuso_horario*60)), 'm'))
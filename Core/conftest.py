@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+
+#--------------------------------------------------
+#Dados comuns aos testes
+#--------------------------------------------------
+
+TITULOS = ('ponto', 'g_l1', 'g_l2', 'g_l3', 'hora', 'minuto', 'h_instrumento', 'Lat_gra', 'Lat_min', 'Lat_seg',
+           'Lon_gra', 'Lon_min', 'Lon_seg', 'alt_m', 'data')
+
+
+def _circuito(estacoes=12, semente=0):
+    #Circuito que abre e fecha na base (ponto 0), no modelo GRARED_P com a coluna da data
+    rng = np.random.default_rng(semente)
+    pontos = np.r_[0, np.arange(1, estacoes), 0]
+    leitura = np.r_[3000., rng.uniform(2500, 3500, estacoes - 1), 3000.02]
+    linhas = ['\t'.join(TITULOS)]
+    for k, (p, g) in enumerate(zip(pontos, leitura)):
+        linhas.append('\t'.join(str(v) for v in (p, g, g + 0.01, g - 0.01, 8 + k//5, 12*(k % 5), 0.2,
+                                                 -22, 10 + p, 30., -47, 5 + p, 15., 600. + 10*p, 20200501)))
+    return '\n'.join(linhas) + '\n'
+
+
+@pytest.fixture
+def circuito():
+    #Gerador do texto de um circuito sintético: circuito(estacoes=12, semente=0)
+    return _circuito
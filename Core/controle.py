@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from terreno import RAIO_TERRA
+from incertezas import FATOR_AR_LIVRE
+
+#--------------------------------------------------
+#Controle de qualidade das estações repetidas de uma campanha
+#--------------------------------------------------
+'''
+Confere a consistência entre as ocupações repetidas de uma campanha inteira
+(vários circuitos e dias) já reduzida. As ocupações são indexadas pelo
+número do ponto e pela posição: as estações com pontos diferentes a menos de
+tolerancia_m na horizontal (e tolerancia_alt_m na vertical) são achadas com
+uma grade de hash de células do tamanho da tolerância, em tempo quase
+linear, e formam um mesmo sítio (cruzamento). Dentro de cada sítio as
+ocupações são ordenadas no tempo e cada uma é comparada com a anterior,
+o que dá os pares repetidos e seus fechamentos, levados a uma altitude comum
+pelo gradiente ar-livre. O resíduo de cada ocupação em relação à mediana do
+seu sítio aponta as leituras discrepantes, e um degrau nos resíduos ao longo
+de um circuito aponta uma tara suspeita. A escala dos testes é estimada de
+forma robusta (MAD) a partir dos próprios resíduos.
+----------------------------
+Checks the consistency between the repeated occupations of a whole reduced
+campaign (several loops and days). Occupations are indexed by point number
+and by position: stations with different point numbers closer than
+tolerancia_m horizontally (and tolerancia_alt_m vertically) are found with
+a hash grid of cells the size of the tolerance, in near-linear time, and
+make a single site (crossover). Within each site the occupations are sorted
+in time and each one is compared with the previous one, which gives the
+repeat pairs and their misclosures, taken to a common altitude by the
+free-air gradient. The residual of each occupation from the median of its
+site points out the outlying readings, and a step in the residuals along a
+loop points out a suspicious tare. The scale of the tests is estimated
+robustly (MAD) from the residuals themselves.
+'''
+
+MAD_PARA_SIGMA = 1.4826 #Desvio padrão de uma normal a partir do desvio absoluto mediano
+
+
+def pares_proximos(x, y, raio):
+    """
+    Pairs (i, j), i < j, of the points x, y (metres) at most raio apart.
+    The points are hashed into square cells of side raio and each cell is
+    compared only with itself and its neighbours, so for a bounded point
+    density the cost grows linearly with the number of points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    vazio = np.array([], dtype=np.intp)
+    if len(x) < 2 or not raio > 0:
+        return vazio, vazio
+    cx = np.floor((x - x.min())/raio).astype(np.int64)
+    cy = np.floor((y - y.min())/raio).astype(np.int64)
+    largura = int(cy.max()) + 3 #Folga para que as vizinhas de cy-1 e cy+1 não se confundam com outra coluna
+    chave = cx*largura + cy
+    ordem = np.argsort(chave, kind='stable')
+    celulas, inicio, contagem = np.unique(chave[ordem], return_index=True, return_counts=True)
+    pares_i, pares_j = [], []
+    for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)): #Metade da vizinhança: cada par de células uma vez
+        vizinha = celulas + dx*largura + dy
+        k = np.minimum(np.searchsorted(celulas, vizinha), len(celulas) - 1)
+        existe = celulas[k] == vizinha
+        ini_a, n_a = inicio[existe], contagem[existe]
+        ini_b, n_b = inicio[k[existe]], contagem[k[existe]]
+        #Todos os pares entre os pontos das duas células
+        total = n_a*n_b
+        grupo = np.repeat(np.arange(len(total)), total)
+        dentro = np.arange(total.sum()) - np.repeat(np.cumsum(total) - total, total)
+        a = ini_a[grupo] + dentro//n_b[grupo]
+        b = ini_b[grupo] + dentro % n_b[grupo]
+        if dx == 0 and dy == 0:
+            a, b = a[a < b], b[a < b]
+        a, b = ordem[a], ordem[b]
+        perto = np.hypot(x[a] - x[b], y[a] - y[b]) <= raio
+        pares_i.append(a[perto])
+        pares_j.append(b[perto])
+    i, j = np.concatenate(pares_i), np.concatenate(pares_j)
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def _componentes(n, i, j):
+    #Rótulo (0, 1, ...) da componente conexa de cada nó do grafo de arestas (i, j)
+    rotulo = np.arange(n)
+    while len(i):
+        anterior = rotulo
+        menor = np.minimum(rotulo[i], rotulo[j])
+        rotulo = rotulo.copy()
+        np.minimum.at(rotulo, i, menor)
+        np.minimum.at(rotulo, j, menor)
+        rotulo = rotulo[rotulo] #Salto de ponteiros: o rótulo aponta sempre para um nó de índice menor
+        if np.array_equal(rotulo, anterior):
+            break
+    return np.unique(rotulo, return_inverse=True)[1]
+
+
+def _instante(resultados):
+    #Horas contínuas entre dias e circuitos: a data de cada leitura mais a hora do dia
+    hora = np.asarray(resultados['hora_dec'], dtype=np.float64)
+    if 'data' not in resultados:
+        return hora
+    dias = np.asarray(resultados['data'], dtype='datetime64[D]').astype(np.int64)
+    return 24.*dias + np.mod(hora, 24.)
+
+
+def _campanha(resultados, coluna):
+    #Colunas de todos os circuitos concatenadas, com o circuito e a linha de cada ocupação
+    tamanhos = [len(r['ponto']) for r in resultados]
+    juntar = lambda chave: np.concatenate([np.asarray(r[chave], dtype=np.float64) for r in resultados])
+    return {'ponto': np.concatenate([np.asarray(r['ponto']) for r in resultados]),
+            'g': juntar(coluna), 'lat': juntar('Lat_graus_dec'), 'lon': juntar('Lon_graus_dec'),
+            'alt': juntar('alt_m'), 'tempo': np.concatenate([_instante(r) for r in resultados]),
+            'circuito': np.repeat(np.arange(len(resultados)), tamanhos),
+            'linha': np.concatenate([np.arange(n) for n in tamanhos])}
+
+
+def _sitios(obs, tolerancia_m, tolerancia_alt_m):
+    #Sítio de cada ocupação: pontos iguais, ou pontos diferentes dentro da tolerância
+    pontos, idx = np.unique(obs['ponto'], return_inverse=True)
+    n = np.bincount(idx, minlength=len(pontos))
+    media = lambda v: np.bincount(idx, v, len(pontos))/n
+    lat, lon, alt = media(obs['lat']), media(obs['lon']), media(obs['alt'])
+    lat_c, lon_c = np.mean(lat), np.mean(lon)
+    x = np.radians(lon - lon_c)*RAIO_TERRA*np.cos(np.radians(lat_c))
+    y = np.radians(lat - lat_c)*RAIO_TERRA
+    i, j = pares_proximos(x, y, tolerancia_m)
+    mesma_altura = np.abs(alt[i] - alt[j]) <= tolerancia_alt_m
+    return _componentes(len(pontos), i[mesma_altura], j[mesma_altura])[idx]
+
+
+def _pares(sitio, ordem, todos):
+    #Pares (a, b) de ocupações do mesmo sítio, a antes de b: consecutivas ou todas
+    s = sitio[ordem]
+    if not todos:
+        seguida = s[1:] == s[:-1]
+        return ordem[:-1][seguida], ordem[1:][seguida]
+    _, inicio, n = np.unique(s, return_index=True, return_counts=True)
+    total = n*n
+    grupo = np.repeat(np.arange(len(n)), total)
+    dentro = np.arange(total.sum()) - np.repeat(np.cumsum(total) - total, total)
+    a, b = dentro//n[grupo], dentro % n[grupo]
+    manter = a < b
+    return ordem[inicio[grupo][manter] + a[manter]], ordem[inicio[grupo][manter] + b[manter]]
+
+
+def controlar_repeticoes(resultados, circuitos=None, coluna='g_abs', tolerancia_m=5., tolerancia_alt_m=2.,
+                         corte=3., corte_tara=5., ç_repeticao=None, todos_os_pares=False, minimo_tara=2):
+    """
+    Repeat-station and crossover control of a campaign. resultados is a
+    list with the reduced results of each loop (as returned by
+    reduce_survey, lote.reduzir_lote or lote.reduzir_rede) and circuitos
+    their names (default: 0, 1, ...). The values of coluna (g_abs by
+    default) are compared between occupations of the same point, or of
+    points within tolerancia_m metres horizontally and tolerancia_alt_m
+    vertically, after taking them to a common altitude with the free-air
+    gradient. Each occupation is paired with the previous occupation of
+    its site (every pair of the site with todos_os_pares).
+
+    ç_repeticao is the standard deviation of one occupation in mGal; by
+    default it is estimated from the MAD of the residuals. Pairs and
+    occupations are flagged beyond corte standard deviations. The step of
+    each loop is the largest one over every split of its repeated
+    occupations, so its threshold corte_tara is higher; a tare needs at
+    least minimo_tara repeated occupations on each side of the step.
+    Outlying occupations in runs shorter than minimo_tara are spikes and
+    are left out of the step.
+
+    Returns a dictionary with 'circuitos', 'sigma' (the standard deviation
+    used), 'pares' (one entry per repeat pair), 'ocupacoes' (residual,
+    normalised residual and flag of every occupation, NaN when not
+    repeated) and 'por_circuito' (one entry per loop), see
+    tabela_de_circuitos and tabela_de_pares.
+    """
+    if not resultados:
+        raise ValueError('Nenhum circuito para controlar')
+    if circuitos is None:
+        circuitos = list(range(len(resultados)))
+    K = len(resultados)
+    obs = _campanha(resultados, coluna)
+    n = len(obs['g'])
+    valor = obs['g'] + FATOR_AR_LIVRE*obs['alt'] #Gravidade levada à altitude zero, para comparar estações vizinhas
+    sitio = _sitios(obs, tolerancia_m, tolerancia_alt_m) if n else np.zeros(0, dtype=np.intp)
+    ordem = np.lexsort((obs['tempo'], sitio))
+
+    #Resíduo de cada ocupação em relação à mediana do seu sítio
+    S = int(sitio.max()) + 1 if n else 0
+    ocupacoes_sitio = np.bincount(sitio, minlength=S)
+    em_ordem = np.lexsort((valor, sitio))
+    inicio = np.concatenate(([0], np.cumsum(ocupacoes_sitio)[:-1])).astype(np.intp)
+    meio = valor[em_ordem][inicio + (ocupacoes_sitio - 1)//2] if S else np.zeros(0)
+    meio = (meio + valor[em_ordem][inicio + ocupacoes_sitio//2])/2 if S else meio
+    m = ocupacoes_sitio[sitio]
+    repetida = m > 1
+    residuo = np.where(repetida, valor - meio[sitio] if S else 0., np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        padronizado = residuo/np.sqrt((m - 1)/m) #Variância do resíduo de uma entre m ocupações: σ²(m-1)/m
+        if ç_repeticao is not None:
+            sigma = float(ç_repeticao)
+        else:
+            sigma = MAD_PARA_SIGMA*np.median(np.abs(padronizado[repetida])) if repetida.any() else np.nan
+        z_ocupacao = padronizado/sigma if sigma > 0 else np.full(n, np.nan)
+    discrepante = np.abs(z_ocupacao) > corte
+
+    #Pares repetidos e seus fechamentos
+    a, b = _pares(sitio, ordem, todos_os_pares)
+    fechamento = valor[b] - valor[a]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_par = fechamento/(sigma*np.sqrt(2)) if sigma > 0 else np.full(len(a), np.nan)
+    lat_m = np.radians(obs['lat'][b] - obs['lat'][a])*RAIO_TERRA
+    lon_m = np.radians(obs['lon'][b] - obs['lon'][a])*RAIO_TERRA*np.cos(np.radians(obs['lat'][a]))
+    pares = {'ponto_a': obs['ponto'][a], 'ponto_b': obs['ponto'][b],
+             'circuito_a': obs['circuito'][a], 'circuito_b': obs['circuito'][b],
+             'linha_a': obs['linha'][a], 'linha_b': obs['linha'][b],
+             'dt': obs['tempo'][b] - obs['tempo'][a], 'distancia': np.hypot(lat_m, lon_m),
+             'dalt': obs['alt'][b] - obs['alt'][a], 'fechamento': fechamento, 'z': z_par,
+             'suspeito': np.abs(z_par) > corte}
+
+    #Resumo por circuito: pares que tocam o circuito (os internos contam uma vez)
+    ca, cb = pares['circuito_a'], pares['circuito_b']
+    interno = ca == cb
+    por_circuito = lambda pesos=None: (np.bincount(ca, pesos, K) + np.bincount(cb, pesos, K)
+                                       - np.bincount(ca[interno], None if pesos is None else pesos[interno], K))
+    n_pares = por_circuito()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rms = np.sqrt(por_circuito(fechamento*fechamento)/n_pares)
+    maximo = np.zeros(K)
+    np.maximum.at(maximo, ca, np.abs(fechamento))
+    np.maximum.at(maximo, cb, np.abs(fechamento))
+    linhas_discrepantes = [[] for _ in range(K)]
+    for k, linha in zip(obs['circuito'][discrepante], obs['linha'][discrepante]):
+        linhas_discrepantes[k].append(int(linha))
+
+    #Taras: o degrau mais forte nos resíduos das ocupações repetidas de cada circuito, ao longo do tempo
+    rep = np.flatnonzero(repetida)
+    rep = rep[np.lexsort((obs['tempo'][rep], obs['circuito'][rep]))]
+    #Leituras discrepantes isoladas (sequências de menos de minimo_tara discrepantes do mesmo sinal, no
+    #mesmo circuito) são picos e não entram; as sequências longas são o lado de um degrau e ficam
+    sinal = np.where(discrepante[rep], np.sign(residuo[rep]), 0.)
+    c_rep = obs['circuito'][rep]
+    nova = np.r_[True, (sinal[1:] != sinal[:-1]) | (c_rep[1:] != c_rep[:-1])]
+    sequencia = np.cumsum(nova) - 1
+    rep = rep[(sinal == 0) | (np.bincount(sequencia)[sequencia] >= minimo_tara)]
+    c_rep = obs['circuito'][rep]
+    n_rep = np.bincount(c_rep, minlength=K)
+    primeiro = np.concatenate(([0], np.cumsum(n_rep)[:-1])).astype(np.intp)
+    r_rep = residuo[rep]
+    soma = np.cumsum(r_rep)
+    p0 = primeiro[c_rep]
+    antes = soma - soma[p0] + r_rep[p0] #Soma do circuito até a ocupação, inclusive
+    n1 = np.arange(len(rep)) - primeiro[c_rep] + 1
+    n2 = n_rep[c_rep] - n1
+    total = np.bincount(c_rep, r_rep, K)[c_rep]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        degrau = (total - antes)/n2 - antes/n1
+        z_degrau = degrau/(sigma*np.sqrt(1/n1 + 1/n2)) if sigma > 0 else np.full(len(rep), np.nan)
+    valido = (n1 >= minimo_tara) & (n2 >= minimo_tara) & np.isfinite(z_degrau)
+    forca = np.where(valido, np.abs(np.nan_to_num(z_degrau)), -1.)
+    melhor = np.lexsort((-forca, c_rep))
+    melhor = melhor[np.r_[True, c_rep[melhor][1:] != c_rep[melhor][:-1]]] if len(rep) else melhor
+    tem_tara = valido[melhor]
+    tara_linha = np.full(K, -1)
+    tara, tara_z = np.full(K, np.nan), np.full(K, np.nan)
+    k_tara = c_rep[melhor][tem_tara]
+    tara_linha[k_tara] = obs['linha'][rep][melhor[tem_tara] + 1] #Primeira ocupação depois do degrau
+    tara[k_tara] = degrau[melhor][tem_tara]
+    tara_z[k_tara] = z_degrau[melhor][tem_tara]
+
+    return {'circuitos': list(circuitos), 'sigma': sigma, 'pares': pares,
+            'ocupacoes': {'circuito': obs['circuito'], 'linha': obs['linha'], 'ponto': obs['ponto'],
+                          'sitio': sitio, 'residuo': residuo, 'z': z_ocupacao, 'discrepante': discrepante},
+            'por_circuito': {'leituras': np.bincount(obs['circuito'], minlength=K),
+                             'repetidas': np.bincount(obs['circuito'][repetida], minlength=K),
+                             'pares': n_pares.astype(np.int64), 'fechamento_rms': rms,
+                             'fechamento_max': np.where(n_pares > 0, maximo, np.nan),
+                             'discrepantes': linhas_discrepantes, 'tara_linha': tara_linha,
+                             'tara': tara, 'tara_z': tara_z, 'tara_suspeita': np.abs(tara_z) > corte_tara}}
+
+
+def tabela_de_circuitos(controle, dec=3):
+    """
+    Per-loop control table: readings, repeated occupations, repeat pairs,
+    RMS and largest misclosure (mGal), the outlying occupations (count and
+    row numbers, from 0 as in the 'taras' of lote.reduzir_rede) and the
+    strongest step in the residuals (first row after it, size in mGal,
+    normalised size and flag).
+    """
+    import pandas as pd
+    c = controle['por_circuito']
+    return pd.DataFrame({'00_Circuito': controle['circuitos'],
+                         '01_Leituras': c['leituras'],
+                         '02_Repetidas': c['repetidas'],
+                         '03_Pares': c['pares'],
+                         '04_Fech.RMS': np.around(c['fechamento_rms'], dec),
+                         '05_Fech.Max': np.around(c['fechamento_max'], dec),
+                         '06_Discrep': [len(d) for d in c['discrepantes']],
+                         '07_Linhas.Discrep': [','.join(str(x) for x in d) for d in c['discrepantes']],
+                         '08_Tara.Linha': pd.array(np.where(c['tara_linha'] >= 0, c['tara_linha'], None), dtype='Int64'),
+                         '09_Tara': np.around(c['tara'], dec),
+                         '10_Tara.z': np.around(c['tara_z'], 2),
+                         '11_Tara.Susp': np.where(c['tara_suspeita'], 'Sim', '')})
+
+
+def tabela_de_pares(controle, dec=3, apenas_suspeitos=False):
+    """
+    Table of the repeat pairs: points, loops and rows of both occupations,
+    elapsed time (h), horizontal and vertical distance (m), misclosure
+    (mGal, later minus earlier), normalised misclosure and flag.
+    """
+    import pandas as pd
+    p = controle['pares']
+    manter = p['suspeito'] if apenas_suspeitos else slice(None)
+    nomes = np.asarray(controle['circuitos'], dtype=object)
+    return pd.DataFrame({'00_Pt.A': p['ponto_a'][manter],
+                         '01_Pt.B': p['ponto_b'][manter],
+                         '02_Circ.A': nomes[p['circuito_a'][manter]],
+                         '03_Circ.B': nomes[p['circuito_b'][manter]],
+                         '04_Linha.A': p['linha_a'][manter],
+                         '05_Linha.B': p['linha_b'][manter],
+                         '06_Dt.h': np.around(p['dt'][manter], 3),
+                         '07_Dist.m': np.around(p['distancia'][manter], 1),
+                         '08_Dalt.m': np.around(p['dalt'][manter], 2),
+                         '09_Fech': np.around(p['fechamento'][manter], dec),
+                         '10_z': np.around(p['z'][manter], 2),
+                         '11_Suspeito': np.where(p['suspeito'][manter], 'Sim', '')})
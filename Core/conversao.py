@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import hashlib
+import numpy as np
+
+#--------------------------------------------------
+#Tabela de conversão leitura do contador -> mGal
+#--------------------------------------------------
+'''
+A tabela de cada gravímetro tem três colunas: gc1 (leitura do contador no
+início do intervalo), gc2 (valor em mGal nesse início) e gf0 (fator do
+intervalo). Uma leitura g com 0 <= g-gc1 < 100 é convertida por
+gc2 + gf0*(g-gc1).
+----------------------------
+Each gravimeter table has three columns: gc1 (counter reading at the start
+of the interval), gc2 (value in mGal at that start) and gf0 (interval
+factor). A reading g with 0 <= g-gc1 < 100 is converted with
+gc2 + gf0*(g-gc1).
+'''
+
+
+class TabelaConversao():
+    """
+    Conversion table indexed by the sorted gc1 column. Readings are located
+    with np.searchsorted, so converting n readings costs O(n log m) for a
+    table with m rows, and the object can be reused for every survey read
+    with the same gravimeter.
+    """
+    largura = 100. #Largura do intervalo de cada linha, em unidades do contador
+
+    def __init__(self, gc1, gc2, gf0, grav=None):
+        gc1 = np.asarray(gc1, dtype=np.float64)
+        gc2 = np.asarray(gc2, dtype=np.float64)
+        gf0 = np.asarray(gf0, dtype=np.float64)
+        validos = ~(np.isnan(gc1) | np.isnan(gc2) | np.isnan(gf0))
+        ordem = np.argsort(gc1[validos], kind='stable')
+        self.gc1 = gc1[validos][ordem]
+        self.gc2 = gc2[validos][ordem]
+        self.gf0 = gf0[validos][ordem]
+        self.grav = grav
+        if len(self.gc1) == 0:
+            raise ValueError('Tabela de conversão vazia (gravímetro %s)' % (grav,))
+
+    def __len__(self):
+        return len(self.gc1)
+
+    def __iter__(self):
+        #Permite desempacotar como (gc1, gc2, gf0)
+        return iter((self.gc1, self.gc2, self.gf0))
+
+    def faixa(self):
+        """
+        Returns the (minimum, maximum) counter readings covered by the table;
+        the maximum itself is not included.
+        """
+        return self.gc1[0], self.gc1[-1] + self.largura
+
+    def localizar(self, leituras):
+        """
+        Returns the table row of each reading and a boolean mask of the
+        readings that fall inside an interval of the table.
+        """
+        leituras = np.asarray(leituras, dtype=np.float64)
+        pos = np.searchsorted(self.gc1, leituras, side='right') - 1
+        dentro = pos >= 0
+        pos = np.where(dentro, pos, 0)
+        diferença = leituras - self.gc1[pos]
+        dentro &= (diferença >= 0) & (diferença < self.largura)
+        return pos, dentro
+
+    def converter(self, leituras, fora_da_faixa='erro'):
+        """
+        Converts an array of counter readings to mGal in a single call.
+        Readings outside the table are reported with ValueError
+        (fora_da_faixa='erro', the default) or returned as NaN
+        (fora_da_faixa='nan'), so the output is always aligned with the
+        input.
+        """
+        leituras = np.asarray(leituras, dtype=np.float64)
+        pos, dentro = self.localizar(leituras)
+        if fora_da_faixa == 'erro' and not dentro.all():
+            ruins = np.flatnonzero(~dentro)
+            raise ValueError('%d leitura(s) fora da tabela de conversão %s (faixa %g a %g): índices %s'
+                             % (len(ruins), self.grav if self.grav is not None else '',
+                                self.faixa()[0], self.faixa()[1],
+                                ', '.join(str(k) for k in ruins[:20]) + (' ...' if len(ruins) > 20 else '')))
+        elif fora_da_faixa not in ('erro', 'nan'):
+            raise ValueError("fora_da_faixa deve ser 'erro' ou 'nan'")
+        g_conv = self.gc2[pos] + self.gf0[pos]*(leituras - self.gc1[pos])
+        return np.where(dentro, g_conv, np.nan)
+
+    def salvar(self, caminho, **metadados):
+        """
+        Saves the table to a compact binary .npz file, together with the
+        given metadata (stored as 0-d arrays).
+        """
+        np.savez(caminho, gc1=self.gc1, gc2=self.gc2, gf0=self.gf0,
+                 grav=np.array('' if self.grav is None else str(self.grav)),
+                 **{k: np.array(v) for k, v in metadados.items()})
+
+    @classmethod
+    def carregar(cls, caminho):
+        """
+        Loads a table saved with salvar. Returns (table, metadata).
+        """
+        with np.load(caminho, allow_pickle=False) as arq:
+            metadados = {k: arq[k].item() for k in arq.files if k not in ('gc1', 'gc2', 'gf0', 'grav')}
+            tabela = cls(arq['gc1'], arq['gc2'], arq['gf0'], grav=arq['grav'].item() or None)
+        return tabela, metadados
+
+
+#--------------------------------------------------
+#Cache binário das tabelas lidas do Excel
+#--------------------------------------------------
+'''
+Ler o Tabelas_conv_todas.xlsx pelo openpyxl é a etapa mais lenta para
+circuitos pequenos. Cada aba lida é guardada em um .npz na pasta de cache
+(variável de ambiente GRARED_CACHE, ou ~/.cache/grared), identificado pelo
+caminho da planilha e pela aba. O arquivo guarda a data de modificação e o
+tamanho da planilha e é refeito automaticamente quando ela muda.
+----------------------------
+Reading Tabelas_conv_todas.xlsx through openpyxl is the slowest step for
+small loops. Every sheet read is kept as a .npz in the cache folder
+(GRARED_CACHE environment variable, or ~/.cache/grared), named after the
+workbook path and the sheet. The file stores the workbook modification
+time and size and is rebuilt automatically when the workbook changes.
+'''
+
+
+def pasta_cache():
+    return os.environ.get('GRARED_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'grared')
+
+
+def caminho_cache(planilha_conv, grav):
+    """
+    Returns the .npz cache file of sheet grav of the workbook planilha_conv.
+    """
+    origem = os.path.abspath(planilha_conv)
+    chave = hashlib.sha1(('%s\0%s' % (origem, grav)).encode('utf-8')).hexdigest()[:16]
+    nome = '%s_%s_%s.npz' % (os.path.splitext(os.path.basename(origem))[0], grav, chave)
+    return os.path.join(pasta_cache(), nome)
+
+
+def _assinatura(planilha_conv):
+    info = os.stat(planilha_conv)
+    return {'origem': os.path.abspath(planilha_conv), 'mtime_ns': info.st_mtime_ns, 'tamanho': info.st_size}
+
+
+def tabela_do_cache(planilha_conv, grav):
+    """
+    Returns the cached TabelaConversao of sheet grav, or None when there is
+    no cache yet or the workbook changed since it was written.
+    """
+    caminho = caminho_cache(planilha_conv, grav)
+    try:
+        tabela, metadados = TabelaConversao.carregar(caminho)
+        assinatura = _assinatura(planilha_conv)
+    except (OSError, ValueError, KeyError):
+        return None
+    if any(metadados.get(k) != v for k, v in assinatura.items()) or metadados.get('aba') != str(grav):
+        return None
+    return tabela
+
+
+def salvar_no_cache(tabela, planilha_conv, grav):
+    """
+    Writes tabela to the cache of sheet grav of planilha_conv. Failures to
+    write (e.g. a read-only folder) are ignored, since the cache is only an
+    optimization.
+    """
+    caminho = caminho_cache(planilha_conv, grav)
+    temporario = caminho[:-len('.npz')] + '.%d.tmp.npz' % os.getpid()
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        tabela.salvar(temporario, aba=str(grav), **_assinatura(planilha_conv))
+        os.replace(temporario, caminho) #Troca atômica, seguro entre processos
+    except OSError:
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+
+
+def limpar_cache():
+    """
+    Removes every cached conversion table.
+    """
+    pasta = pasta_cache()
+    if os.path.isdir(pasta):
+        for nome in os.listdir(pasta):
+            if nome.endswith('.npz'):
+                os.remove(os.path.join(pasta, nome))
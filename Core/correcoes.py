@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from mare import TideModel, EphemerisCache
+from calculos import (dms_para_graus, tempo_decorrido, correcao_bouguer, deriva_linear,
+                      datas_das_leituras, virada_de_dia, instantes_utc)
+from gravidade_normal import gravidade_normal, seno2
+from incertezas import contribuicoes_circuito, contribuicoes_anomalias, desvios, INCERTEZAS_PADRAO
+from terreno import corrigir_terreno
+from pipeline import Pipeline
+
+#--------------------------------------------------
+#Etapas de correção da redução gravimétrica
+#--------------------------------------------------
+'''
+Etapas da redução registradas no pipeline (ver pipeline.py), cada uma com
+as colunas de que precisa e as que produz: coordenadas, tempo, conversão,
+altura instrumental, maré, deriva, g absoluto, gravidade normal, ar-livre,
+Bouguer, terreno e anomalias, além da correção atmosférica da IAG e da
+correção de Eötvös para levantamentos em movimento (navio, avião).
+----------------------------
+Reduction stages registered in the pipeline (see pipeline.py), each one
+with the columns it needs and the ones it produces: coordinates, time,
+conversion, instrument height, tide, drift, absolute g, normal gravity,
+free-air, Bouguer, terrain and anomalies, plus the IAG atmospheric
+correction and the Eötvös correction for moving surveys (ship, aircraft).
+'''
+
+#Cache de efemérides compartilhado entre reduções do mesmo processo
+efemerides = EphemerisCache()
+
+OMEGA_TERRA = 7.292115e-5 #Velocidade angular da Terra (rad/s)
+RAIO_TERRA = 6371000. #Raio médio da Terra (m)
+SI_PARA_MGAL = 1e5
+
+PIPELINE = Pipeline()
+etapa_de_correcao = PIPELINE.registrar
+
+#Saídas de cada fase da redução (ver reducao.py)
+SAIDAS_LEITURAS = ('ponto', 'g_med_lido', 'g_conv', 'c_ai', 'g_ai', 'cls', 'g_cls',
+                   'Lat_graus_dec', 'Lon_graus_dec', 'sen2_lat', 'alt_m', 'hora_dec', 'data')
+SAIDAS_CIRCUITO = ('cd', 'g_cd', 'g_abs', 'delta_t', 'ç_gai', 'ç_gcls', 'ç_cd', 'ç_gcd', 'ç_gabs')
+SAIDAS_ANOMALIAS = ('g_teor', 'ca', 'g_ca', 'cb', 'g_cb', 'ç_gteor', 'ç_ca', 'ç_gca', 'ç_cb', 'ç_gcb')
+
+
+def saidas_circuito(parametros):
+    #A correção de Eötvös só é calculada (e escrita) quando pedida
+    return SAIDAS_CIRCUITO + (('c_eot',) if int(parametros.get('eotvos', 0)) else ())
+
+
+def saidas_anomalias(parametros):
+    #A correção atmosférica só é calculada (e escrita) quando pedida
+    return SAIDAS_ANOMALIAS + (('c_atm',) if int(parametros.get('atmosferica', 0)) else ())
+
+
+#Etapas por leitura
+#--------------------------------------------------
+@etapa_de_correcao('coordenadas', ('Lat_gra', 'Lat_min', 'Lat_seg', 'Lon_gra', 'Lon_min', 'Lon_seg'),
+                   ('Lat_graus_dec', 'Lon_graus_dec', 'sen2_lat'))
+def _coordenadas(dados, parametros, instrumentacao):
+    #Cálculo de Latitude e Longitude em Graus decimais
+    Lat_graus_dec=dms_para_graus(dados['Lat_gra'],dados['Lat_min'],dados['Lat_seg'])
+    Lon_graus_dec=dms_para_graus(dados['Lon_gra'],dados['Lon_min'],dados['Lon_seg'])
+    return {'Lat_graus_dec': Lat_graus_dec, 'Lon_graus_dec': Lon_graus_dec, 'sen2_lat': seno2(Lat_graus_dec)}
+
+
+@etapa_de_correcao('tempo', ('hora', 'minuto'), ('data', 'hora_dec'))
+def _tempo(dados, parametros, instrumentacao):
+    #Data de cada leitura: coluna de datas ('data_lida') ou a data do levantamento, avançando a cada meia-noite
+    data_base=np.datetime64('%04d-%02d-%02d' % (int(parametros['ano']),int(parametros['mes']),int(parametros['dia'])),'D') #Data do levantamento
+    hora_dec=(dados['hora'])+(dados['minuto']/(60))
+    datas=dados.get('data_lida')
+    if datas is None:
+        datas=data_base+virada_de_dia(hora_dec).astype('timedelta64[D]')
+    else:
+        datas=datas_das_leituras(datas)
+
+    #Cálculo do tempo em Horas decimais, contínuo desde a 0h da data do levantamento
+    hora_dec=hora_dec+24*(datas-data_base).astype(np.float64)
+    return {'data': datas, 'hora_dec': hora_dec}
+
+
+@etapa_de_correcao('conversao', ('g_l1', 'g_l2', 'g_l3', 'tabela'), ('g_med_lido', 'g_conv'))
+def _conversao(dados, parametros, instrumentacao):
+    #Média das 3 leituras
+    g_med_lido = (dados['g_l1']+dados['g_l2']+dados['g_l3'])/3
+
+    #Conversão de acel. Grav. instrumental para mGal
+    g_conv=dados['tabela'].converter(g_med_lido) #Busca binária do intervalo de cada leitura em gc1
+    return {'g_med_lido': g_med_lido, 'g_conv': g_conv}
+
+
+@etapa_de_correcao('altura_instrumental', ('h_instrumento', 'g_conv'), ('c_ai', 'g_ai'))
+def _altura_instrumental(dados, parametros, instrumentacao):
+    #Correção de Altura Instrumental
+    c_ai=0.308596*dados['h_instrumento']
+    g_ai=dados['g_conv']+c_ai
+    return {'c_ai': c_ai, 'g_ai': g_ai}
+
+
+@etapa_de_correcao('mare', ('Lat_graus_dec', 'Lon_graus_dec', 'alt_m', 'data', 'hora', 'minuto'), ('cls',))
+def _mare(dados, parametros, instrumentacao):
+    #Correção de maré
+    tide=TideModel(efemerides)
+    data_l=instantes_utc(dados['data'],dados['hora'],dados['minuto'],float(parametros['fuso_horario'])) #Instantes das leituras em UTC, com virada de dia
+    cls=tide.solve_longman_array(dados['Lat_graus_dec'],dados['Lon_graus_dec'],dados['alt_m'],data_l)
+    return {'cls': cls}
+
+
+@etapa_de_correcao('g_cls', ('g_ai', 'cls'), ('g_cls',))
+def _g_cls(dados, parametros, instrumentacao):
+    #######################################################################
+    #---------------Aqui podem ser colocadas outras correções,------------#
+    #---------------como a de pressão atm, precipitação, entre outras-----#
+    #---------------(ou registradas como novas etapas do pipeline)--------#
+    #######################################################################
+    return {'g_cls': dados['g_ai']+dados['cls']}
+
+
+#Etapas do circuito
+#--------------------------------------------------
+@etapa_de_correcao('eotvos', ('Lat_graus_dec', 'Lon_graus_dec', 'hora_dec'), ('c_eot',))
+def _eotvos(dados, parametros, instrumentacao):
+    '''
+    Correção de Eötvös de um levantamento em movimento: 2*Ω*ve*cos(φ) + (vn² + ve²)/R, com as
+    velocidades norte e leste tiradas das posições e horas de leituras consecutivas. Só faz sentido
+    para leituras contínuas ao longo de uma trajetória (navio, avião), por isso é opcional.
+    '''
+    lat = np.radians(dados['Lat_graus_dec'])
+    lon = np.unwrap(np.radians(dados['Lon_graus_dec']))
+    segundos = np.asarray(dados['hora_dec'], dtype=np.float64)*3600
+    if len(segundos) < 2:
+        return {'c_eot': np.zeros(len(segundos))}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vn = RAIO_TERRA*np.gradient(lat, segundos)
+        ve = RAIO_TERRA*np.cos(lat)*np.gradient(lon, segundos)
+    vn, ve = np.nan_to_num(vn, posinf=0., neginf=0.), np.nan_to_num(ve, posinf=0., neginf=0.) #Leituras no mesmo instante
+    return {'c_eot': (2*OMEGA_TERRA*ve*np.cos(lat) + (vn*vn + ve*ve)/RAIO_TERRA)*SI_PARA_MGAL}
+
+
+@etapa_de_correcao('deriva', lambda p: ('ponto', 'g_cls', 'hora_dec') + (('c_eot',) if int(p.get('eotvos', 0)) else ()),
+                   ('delta_t', 'cd', 'g_cd', 'ç_gai', 'ç_gcls'))
+def _deriva(dados, parametros, instrumentacao):
+    ponto = dados['ponto']
+    g_cls = dados['g_cls'] + dados['c_eot'] if int(parametros.get('eotvos', 0)) else dados['g_cls']
+    n = len(ponto)
+
+    #Incertezas das entradas (ver incertezas.py)
+    '''
+    As incertezas da altura instrumental (Aprox. 0.1 microGal) e da maré são desprezíveis para um levantamento
+    relativo normal e valem 0 em INCERTEZAS_PADRAO. Já para o caso de levantamentos na ordem de microGals, favor considerar
+    (parametros['incertezas'], as mesmas do relatório de incertezas).
+    '''
+    ç_entradas=dict(INCERTEZAS_PADRAO,**(parametros.get('incertezas') or {}))
+    ç_gai=np.zeros(n)+(ç_entradas['leitura']**2+(0.308596*ç_entradas['altura_instrumental'])**2)**0.5
+    ç_gcls=(ç_gai**2+ç_entradas['mare']**2)**0.5
+
+    #Correção da deriva instrumental
+    delta_t=tempo_decorrido(dados['hora_dec'])
+    cd=deriva_linear(ponto,g_cls,delta_t)
+    g_cd=g_cls+cd
+    return {'delta_t': delta_t, 'cd': cd, 'g_cd': g_cd, 'ç_gai': ç_gai, 'ç_gcls': ç_gcls}
+
+
+@etapa_de_correcao('g_abs', ('g_cd', 'g_cls', 'delta_t'), ('g_abs', 'ç_cd', 'ç_gcd', 'ç_gabs'))
+def _g_abs(dados, parametros, instrumentacao):
+    #Cálculo de Aceleração lida absoluta
+    g_cd = dados['g_cd']
+    g_abs=float(parametros['g_ref'])+(g_cd-g_cd[0])
+    ###Incertezas da deriva e de g absoluto, com a correlação das leituras de abertura e fechamento
+    ç=desvios(contribuicoes_circuito(dados['g_cls'],dados['delta_t'],parametros.get('incertezas')))
+    return {'g_abs': g_abs, 'ç_cd': ç['cd'], 'ç_gcd': ç['g_cd'], 'ç_gabs': ç['g_abs']}
+
+
+#Etapas das anomalias
+#--------------------------------------------------
+@etapa_de_correcao('gravidade_normal', ('sen2_lat',), ('g_teor',))
+def _gravidade_normal(dados, parametros, instrumentacao):
+    #Acelerações teóricas
+    '''
+    Os valores de ç_gteor observados para um erro fixo de 10m (já sendo para um receptor GNSS de navegação um erro considerável)
+    de Lat/Long são desprezíveis (Aprox. 6 microGal); a incerteza de posição vale 0 em INCERTEZAS_PADRAO
+    '''
+    return {'g_teor': gravidade_normal(dados['sen2_lat'],parametros['elipsoide'],formula=parametros['formula_normal'] or None)}
+
+
+@etapa_de_correcao('ar_livre', lambda p: ('alt_m', 'sen2_lat') + (('g_teor',) if int(p['ar_livre_2a_ordem']) else ()),
+                   ('ca',))
+def _ar_livre(dados, parametros, instrumentacao):
+    #Correção Ar-livre
+    alt_m = dados['alt_m']
+    if int(parametros['free_air'])==0:
+        ca=np.zeros(len(alt_m))
+    elif int(parametros['ar_livre_2a_ordem']):
+        #Diferença entre a gravidade normal no elipsoide e na altitude da estação
+        ca=dados['g_teor']-gravidade_normal(dados['sen2_lat'],parametros['elipsoide'],alt_m,parametros['formula_normal'] or None)
+    else:
+        ca=0.308596*alt_m
+    return {'ca': ca}
+
+
+@etapa_de_correcao('bouguer', ('alt_m',), ('cb',))
+def _bouguer(dados, parametros, instrumentacao):
+    #Correção Bouguer Simples
+    if int(parametros['bouguer'])==0:
+        return {'cb': np.zeros(len(dados['alt_m']))}
+    cb,_=correcao_bouguer(dados['alt_m'],float(parametros['densidade']))
+    return {'cb': cb}
+
+
+@etapa_de_correcao('atmosferica', ('alt_m',), ('c_atm',))
+def _atmosferica(dados, parametros, instrumentacao):
+    '''
+    Correção atmosférica da IAG (Wenzel, 1985), em mGal, para altitudes até 10 km: a atração da
+    atmosfera acima da estação, incluída na gravidade normal do elipsoide, é somada às anomalias.
+    '''
+    h = np.asarray(dados['alt_m'], dtype=np.float64)
+    return {'c_atm': 0.874 - 9.9e-5*h + 3.56e-9*h*h}
+
+
+@etapa_de_correcao('anomalia_ar_livre', lambda p: ('g_abs', 'g_teor', 'ca') + (('c_atm',) if int(p.get('atmosferica', 0)) else ()),
+                   ('g_ca',))
+def _anomalia_ar_livre(dados, parametros, instrumentacao):
+    #Anomalia Ar-livre, com a correção atmosférica quando pedida
+    if int(parametros['free_air'])==0:
+        return {'g_ca': np.zeros(len(dados['g_abs']))}
+    g_ca=dados['g_abs']+dados['ca']-dados['g_teor']
+    if int(parametros.get('atmosferica', 0)):
+        g_ca=g_ca+dados['c_atm']
+    return {'g_ca': g_ca}
+
+
+@etapa_de_correcao('anomalia_bouguer', lambda p: ('g_abs', 'g_teor', 'ca', 'cb') + (('c_atm',) if int(p.get('atmosferica', 0)) else ()),
+                   ('g_cb',))
+def _anomalia_bouguer(dados, parametros, instrumentacao):
+    #Anomalia Bouguer Simples, com a correção atmosférica quando pedida
+    if int(parametros['bouguer'])==0:
+        return {'g_cb': np.zeros(len(dados['g_abs']))}
+    g_cb=dados['g_abs']+dados['ca']-dados['cb']-dados['g_teor']
+    if int(parametros.get('atmosferica', 0)):
+        g_cb=g_cb+dados['c_atm']
+    return {'g_cb': g_cb}
+
+
+@etapa_de_correcao('anomalias', ('ç_gabs', 'alt_m', 'sen2_lat'), ('ç_gteor', 'ç_ca', 'ç_gca', 'ç_cb', 'ç_gcb'))
+def _incertezas_anomalias(dados, parametros, instrumentacao):
+    ###Cálculo das Incertezas (ver incertezas.py): ca e cb dependem da mesma altitude
+    n = len(dados['alt_m'])
+    ç=desvios(contribuicoes_anomalias({'g_abs':np.asarray(dados['ç_gabs'],dtype=np.float64)**2},dados['alt_m'],dados['sen2_lat'],parametros,
+                                         parametros.get('incertezas')))
+    ç_gteor,ç_ca,ç_gca,ç_cb,ç_gcb=(np.zeros(n)+ç[q] for q in ('g_teor','ca','g_ca','cb','g_cb'))
+    return {'ç_gteor': ç_gteor, 'ç_ca': ç_ca, 'ç_gca': ç_gca, 'ç_cb': ç_cb, 'ç_gcb': ç_gcb}
+
+
+#Etapas do terreno (ver terreno.py)
+#--------------------------------------------------
+@etapa_de_correcao('terreno', ('Lat_graus_dec', 'Lon_graus_dec', 'alt_m', 'mde'), ('ct', 'ç_ct'))
+def _terreno(dados, parametros, instrumentacao):
+    #Raio, número de processos e incertezas das entradas vêm dos parâmetros, como em lote.reduzir_arquivo
+    return corrigir_terreno(dados, dados['mde'], parametros, parametros.get('raio_terreno', 10000.),
+                            parametros.get('processos_terreno', 1), instrumentacao, parametros.get('incertezas'))
+
+
+@etapa_de_correcao('bouguer_completa', ('g_cb', 'ct'), ('g_cbc',))
+def _bouguer_completa(dados, parametros, instrumentacao):
+    return {'g_cbc': dados['g_cb']+dados['ct']}
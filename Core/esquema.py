@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import re
+import unicodedata
+from collections import namedtuple
+import numpy as np
+
+#--------------------------------------------------
+#Esquema do modelo GRARED_P e validação das leituras
+#--------------------------------------------------
+'''
+Declara as colunas do modelo GRARED_P (nome interno, títulos aceitos no
+cabeçalho e faixa de valores válidos). As colunas do arquivo são
+identificadas pelos títulos do cabeçalho, em qualquer ordem; se o
+cabeçalho não for reconhecido, vale a ordem do modelo. Antes da redução
+todas as células são conferidas de uma só vez, com operações vetorizadas
+sobre a tabela inteira, e todas as linhas com problemas são informadas
+juntas, com o número da linha no arquivo.
+----------------------------
+Declares the columns of the GRARED_P layout (internal name, titles
+accepted in the header and range of valid values). The columns of the file
+are identified by the titles of the header, in any order; when the header
+is not recognized, the order of the layout applies. Before the reduction
+every cell is checked at once, with vectorized operations over the whole
+table, and every row with problems is reported together, with its line
+number in the file.
+'''
+
+#nome interno, títulos aceitos (normalizados: minúsculas, sem acentos, pontuação como espaço),
+#mínimo, máximo e se o máximo é excluído da faixa
+Coluna = namedtuple('Coluna', 'nome titulos minimo maximo maximo_exclusivo')
+
+ESQUEMA_GRARED_P = (
+    Coluna('ponto', ('ponto', 'pt', 'estacao', 'station'), -np.inf, np.inf, False),
+    Coluna('g_l1', ('g l1', 'leit 1', 'leitura 1', 'leituras 1'), 0., np.inf, False),
+    Coluna('g_l2', ('g l2', 'leit 2', 'leitura 2', 'leituras 2'), 0., np.inf, False),
+    Coluna('g_l3', ('g l3', 'leit 3', 'leitura 3', 'leituras 3'), 0., np.inf, False),
+    Coluna('hora', ('hora', 'hor', 'horas', 'tempo da leitura horas', 'tempo da leitura hora'), 0., 24., True),
+    Coluna('minuto', ('minuto', 'min', 'minutos', 'tempo da leitura min', 'tempo da leitura minutos'),
+           0., 60., True),
+    Coluna('h_instrumento', ('h instrumento', 'altura instr', 'altura instr m', 'altura instrumental',
+                             'altura instrumental m'), 0., 10., False),
+    Coluna('Lat_gra', ('lat gra', 'lat g', 'latitude gra', 'latitude graus'), -90., 90., False),
+    Coluna('Lat_min', ('lat min', 'lat m', 'latitude min', 'latitude minutos'), 0., 60., True),
+    Coluna('Lat_seg', ('lat seg', 'lat s', 'latitude seg', 'latitude segundos'), 0., 60., True),
+    Coluna('Lon_gra', ('lon gra', 'lon g', 'longitude gra', 'longitude graus'), -180., 180., False),
+    Coluna('Lon_min', ('lon min', 'lon m', 'longitude min', 'longitude minutos'), 0., 60., True),
+    Coluna('Lon_seg', ('lon seg', 'lon s', 'longitude seg', 'longitude segundos'), 0., 60., True),
+    Coluna('alt_m', ('alt m', 'alt', 'alti', 'altitude', 'altitude m'), -500., 9000., False),
+)
+#Coluna opcional com a data de cada leitura
+COLUNA_DATA_ESQUEMA = Coluna('data', ('data', 'date', 'data da leitura'), None, None, False)
+
+MAXIMO_NA_MENSAGEM = 20 #Problemas listados na mensagem de erro; todos ficam em ErroValidacao.problemas
+
+Problema = namedtuple('Problema', 'linha coluna valor motivo')
+SEM_LEITURAS = 'o arquivo não tem leituras' #Motivo do arquivo só com o cabeçalho, ou vazio
+
+
+class ErroValidacao(ValueError):
+    """
+    Invalid survey file. problemas lists every offending cell as
+    Problema(linha, coluna, valor, motivo), with the line number in the
+    file (coluna is None for a problem of the whole file); the message
+    shows the first MAXIMO_NA_MENSAGEM of them.
+    """
+
+    def __init__(self, problemas, arquivo=''):
+        self.problemas = list(problemas)
+        self.arquivo = arquivo
+        linhas = sorted(set(p.linha for p in self.problemas))
+        texto = ['%d problema(s) em %d linha(s)%s:' % (len(self.problemas), len(linhas),
+                                                       ' de %s' % arquivo if arquivo else '')]
+        texto += ['  linha %d, %s = %s: %s' % (p.linha, p.coluna, p.valor, p.motivo) if p.coluna is not None
+                  else '  linha %d: %s' % (p.linha, p.motivo) for p in self.problemas[:MAXIMO_NA_MENSAGEM]]
+        if len(self.problemas) > MAXIMO_NA_MENSAGEM:
+            texto.append('  ... mais %d' % (len(self.problemas) - MAXIMO_NA_MENSAGEM))
+        super().__init__('\n'.join(texto))
+
+
+def normalizar_titulo(titulo):
+    """
+    Lower case title without accents, with punctuation and underscores
+    turned into single spaces ('Altura_Instr.' -> 'altura instr').
+    """
+    texto = unicodedata.normalize('NFKD', str(titulo)).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', texto).split())
+
+
+def mapear_colunas(titulos, esquema=ESQUEMA_GRARED_P):
+    """
+    Internal name of each column of a file from its header titles, or
+    None when the header is not recognized (then the layout order
+    applies). Unknown extra titles map to None. A header that names only
+    some of the required columns raises ValueError.
+    """
+    por_titulo = {t: c.nome for c in esquema + (COLUNA_DATA_ESQUEMA,) for t in c.titulos}
+    nomes = [por_titulo.get(normalizar_titulo(t)) for t in titulos]
+    encontrados = set(n for n in nomes if n)
+    obrigatorios = [c.nome for c in esquema]
+    faltando = [n for n in obrigatorios if n not in encontrados]
+    if not faltando:
+        vistos = set()
+        return [n if n and not (n in vistos or vistos.add(n)) else None for n in nomes] #Só a 1ª de títulos repetidos
+    if len(faltando) > len(obrigatorios)//2:
+        return None
+    raise ValueError('Colunas não encontradas no cabeçalho: %s (títulos lidos: %s)'
+                     % (', '.join(faltando), ', '.join(str(t) for t in titulos)))
+
+
+def nomes_posicionais(n_campos, esquema=ESQUEMA_GRARED_P):
+    """
+    Internal names of the columns of a file without a recognized header:
+    the layout order, plus the date column when there is one more field.
+    """
+    nomes = [c.nome for c in esquema]
+    if n_campos < len(nomes):
+        raise ValueError('O arquivo tem %d colunas; o modelo GRARED_P tem %d' % (n_campos, len(nomes)))
+    return nomes + [COLUNA_DATA_ESQUEMA.nome] + [None]*(n_campos - len(nomes) - 1) if n_campos > len(nomes) else nomes
+
+
+def numerico(valores):
+    """
+    Column as float64, with cells that are not numbers turned into NaN
+    (they are reported by validar_leituras).
+    """
+    valores = np.asarray(valores)
+    if valores.dtype.kind in 'fiub':
+        return valores.astype(np.float64)
+    import pandas as pd
+    return pd.to_numeric(pd.Series(valores), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def validar_leituras(leituras, tabela=None, linhas=1, esquema=ESQUEMA_GRARED_P, originais=None):
+    """
+    Checks every column of leituras (dictionary of float arrays keyed by
+    the internal names) against the ranges of esquema, the decimal
+    latitude and longitude, the date column (NaT) and, with tabela (a
+    conversao.TabelaConversao), whether the mean of the three readings
+    (the value converted, reported as g_med_lido) falls inside the
+    conversion table. linhas is the line number in the file of each row,
+    or of the first one when the rows are consecutive. originais maps a
+    column to its cells as read, to show non-numeric values in the report. Returns the list of
+    Problema, in line order; a table without rows is one Problema.
+    """
+    nomes = [c.nome for c in esquema]
+    matriz = np.column_stack([leituras[n] for n in nomes])
+    if len(matriz) == 0:
+        return [Problema(linhas if np.ndim(linhas) == 0 else 1, None, None, SEM_LEITURAS)]
+    if np.ndim(linhas) == 0:
+        linhas = linhas + np.arange(len(matriz))
+    linhas = np.asarray(linhas).tolist()
+    minimos = np.array([c.minimo for c in esquema])
+    maximos = np.array([c.maximo for c in esquema])
+    exclusivo = np.array([c.maximo_exclusivo for c in esquema])
+    with np.errstate(invalid='ignore'):
+        ausente = ~np.isfinite(matriz)
+        abaixo = matriz < minimos
+        acima = np.where(exclusivo, matriz >= maximos, matriz > maximos)
+    ruins = ausente | abaixo | acima
+
+    extras = [] #(linhas, coluna, motivo) das conferências que combinam colunas
+    lat = np.abs(matriz[:, 7]) + matriz[:, 8]/60 + matriz[:, 9]/3600
+    lon = np.abs(matriz[:, 10]) + matriz[:, 11]/60 + matriz[:, 12]/3600
+    with np.errstate(invalid='ignore'):
+        extras.append((np.flatnonzero((lat > 90) & ~ruins[:, 7:10].any(axis=1)), 'Lat_gra', 'latitude acima de 90°'))
+        extras.append((np.flatnonzero((lon > 180) & ~ruins[:, 10:13].any(axis=1)), 'Lon_gra',
+                       'longitude acima de 180°'))
+    calculadas = {}
+    if tabela is not None:
+        #Só a média das três leituras passa pela tabela (correcoes.py)
+        minimo, maximo = tabela.faixa()
+        calculadas['g_med_lido'] = (matriz[:, 1] + matriz[:, 2] + matriz[:, 3])/3
+        _, dentro = tabela.localizar(calculadas['g_med_lido'])
+        fora = np.flatnonzero(~dentro & ~ruins[:, 1:4].any(axis=1))
+        extras.append((fora, 'g_med_lido', 'média das leituras fora da tabela de conversão %s (faixa %g a %g)'
+                       % (getattr(tabela, 'grav', '') or '', minimo, maximo)))
+    if 'data' in leituras and np.issubdtype(np.asarray(leituras['data']).dtype, np.datetime64):
+        extras.append((np.flatnonzero(np.isnat(leituras['data'])), 'data', 'data inválida'))
+
+    problemas = []
+    for i, j in zip(*(k.tolist() for k in np.nonzero(ruins))):
+        c = esquema[j]
+        if ausente[i, j]:
+            motivo = 'valor ausente ou não numérico'
+        elif abaixo[i, j]:
+            motivo = 'deve ser >= %g' % c.minimo
+        else:
+            motivo = 'deve ser %s %g' % ('<' if c.maximo_exclusivo else '<=', c.maximo)
+        valor = originais[c.nome][i] if originais and c.nome in originais else matriz[i, j]
+        problemas.append(Problema(linhas[i], c.nome, valor, motivo))
+    for indices, coluna, motivo in extras:
+        valores = calculadas[coluna] if coluna in calculadas else leituras[coluna]
+        if originais and coluna in originais:
+            valores = originais[coluna]
+        problemas.extend(Problema(linhas[i], coluna, valores[i], motivo) for i in indices.tolist())
+    problemas.sort(key=lambda p: p.linha)
+    return problemas
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import json
+import numpy as np
+from instrumentacao import progresso
+from terreno import RAIO_TERRA
+
+#--------------------------------------------------
+#Interpolação das anomalias numa grade regular
+#--------------------------------------------------
+'''
+Interpola uma coluna das estações reduzidas (por exemplo a anomalia
+Bouguer g_cb) numa grade regular em coordenadas geográficas, pronta para
+mapas: curvatura mínima com tensão, inverso da distância (IDW) ou vizinho
+mais próximo. As estações são projetadas (equiretangular local) e indexadas
+uma única vez numa árvore KD (scipy), de modo que a busca dos vizinhos de
+cada nó é logarítmica. A grade é dividida em ladrilhos, calculados em
+processos paralelos; na curvatura mínima cada ladrilho é resolvido com uma
+borda extra de nós (e as estações dela), descartada depois. A curvatura
+mínima é global, então os ladrilhos só se aproximam da grade resolvida de
+uma vez: a diferença cai rapidamente com a borda (com estações esparsas,
+ladrilhos de 40 nós e borda de 8 nós ela chega a alguns por cento da
+amplitude dos valores; com a borda padrão de 32 nós, a 1e-5). A grade vai
+para um .npy mapeável em memória (np.load(..., mmap_mode='r')), com a
+georreferência num .json ao lado, ou para um GeoTIFF (com rasterio). As
+linhas seguem a convenção do MDE (terreno.py): linha 0 ao norte.
+----------------------------
+Interpolates a column of the reduced stations (for example the Bouguer
+anomaly g_cb) onto a regular grid in geographic coordinates, ready for
+maps: minimum curvature with tension, inverse distance weighting (IDW) or
+nearest neighbour. The stations are projected (local equirectangular) and
+indexed once in a KD-tree (scipy), so the neighbour search of each node is
+logarithmic. The grid is split into tiles, computed in parallel processes;
+with minimum curvature each tile is solved with an extra border of nodes
+(and its stations), discarded afterwards. Minimum curvature is global, so
+the tiles only approximate the grid solved at once: the difference falls
+quickly with the border (with sparse stations, 40 node tiles and an 8 node
+border it reaches a few percent of the range of the values; with the
+default 32 node border, 1e-5). The grid goes to a memory-mappable .npy
+(np.load(..., mmap_mode='r')), with the georeference in a .json next to
+it, or to a GeoTIFF (with rasterio). Rows follow the DEM convention
+(terreno.py): row 0 is north.
+'''
+
+METODOS = ('curvatura_minima', 'idw', 'vizinho')
+LADRILHO_PADRAO = 256 #Nós por lado de cada ladrilho
+BORDA_PADRAO = 32 #Nós extras em volta de cada ladrilho da curvatura mínima
+TENSAO_PADRAO = 0.25 #Recomendada para dados de campo potencial (Smith e Wessel, 1990)
+ITERACOES_MAXIMAS = 500 #Por nível da curvatura mínima
+RELAXACAO = 0.5 #Jacobi amortecido: o estêncil biharmônico diverge sem amortecimento acima de 0,625
+
+
+def _arvore(x, y):
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError as erro:
+        raise ImportError('A interpolação em grade precisa do pacote scipy (pip install scipy): %s' % (erro,))
+    return cKDTree(np.column_stack((x, y)))
+
+
+def _rasterio():
+    try:
+        import rasterio
+        from rasterio.transform import Affine
+    except ImportError as erro:
+        raise ImportError('Gravar a grade em GeoTIFF precisa do pacote rasterio (pip install rasterio), '
+                          'ou use a saída .npy: %s' % (erro,))
+    return rasterio, Affine
+
+
+class Grade:
+    """
+    Regular grid in geographic coordinates, in the convention of
+    terreno.ModeloDigitalElevacao: z[linha, coluna], centre of node [0, 0]
+    at (lat0, lon0), steps dlat (negative, north-up) and dlon in degrees.
+    z may be a memory-mapped array.
+    """
+
+    def __init__(self, z, lat0, lon0, dlat, dlon, metadados=None):
+        self.z = z
+        self.lat0, self.lon0 = float(lat0), float(lon0)
+        self.dlat, self.dlon = float(dlat), float(dlon)
+        self.metadados = dict(metadados or {})
+
+    @property
+    def lat(self):
+        return self.lat0 + self.dlat*np.arange(self.z.shape[0])
+
+    @property
+    def lon(self):
+        return self.lon0 + self.dlon*np.arange(self.z.shape[1])
+
+    def georreferencia(self):
+        """
+        Georeference as a dictionary, with the GDAL geotransform of the
+        node corners (for GeoTIFF and GIS tools).
+        """
+        return dict(self.metadados, lat0=self.lat0, lon0=self.lon0, dlat=self.dlat, dlon=self.dlon,
+                    linhas=self.z.shape[0], colunas=self.z.shape[1], crs='EPSG:4326',
+                    geotransform=[self.lon0 - self.dlon/2, self.dlon, 0., self.lat0 - self.dlat/2, 0., self.dlat])
+
+    @classmethod
+    def carregar(cls, caminho):
+        """
+        Opens a grid saved by gradear: the .npy is memory-mapped (read only)
+        and the georeference comes from the .json next to it.
+        """
+        with open(os.path.splitext(caminho)[0] + '.json', encoding='utf-8') as arq:
+            geo = json.load(arq)
+        z = np.load(caminho, mmap_mode='r')
+        metadados = {c: v for c, v in geo.items()
+                     if c not in ('lat0', 'lon0', 'dlat', 'dlon', 'linhas', 'colunas', 'crs', 'geotransform')}
+        return cls(z, geo['lat0'], geo['lon0'], geo['dlat'], geo['dlon'], metadados)
+
+    def salvar_georreferencia(self, caminho):
+        with open(os.path.splitext(caminho)[0] + '.json', 'w', encoding='utf-8') as arq:
+            json.dump(self.georreferencia(), arq, indent=1)
+
+    def salvar_geotiff(self, caminho):
+        """
+        Writes the grid as a float32 GeoTIFF (needs rasterio), with NaN as
+        nodata.
+        """
+        rasterio, Affine = _rasterio()
+        transformacao = Affine.from_gdal(*self.georreferencia()['geotransform'])
+        with rasterio.open(caminho, 'w', driver='GTiff', height=self.z.shape[0], width=self.z.shape[1], count=1,
+                           dtype='float32', crs='EPSG:4326', transform=transformacao, nodata=np.nan,
+                           tiled=True, compress='deflate') as raster:
+            raster.write(np.asarray(self.z, dtype=np.float32), 1)
+
+
+def definir_grade(lat, lon, passo, margem=0.):
+    """
+    Grid covering the stations at lat, lon (decimal degrees) with nodes
+    every passo metres (converted to degrees at the central latitude), plus
+    margem metres on each side. Returns (lat0, lon0, dlat, dlon, linhas,
+    colunas).
+    """
+    lat_min, lat_max = float(np.min(lat)), float(np.max(lat))
+    lon_min, lon_max = float(np.min(lon)), float(np.max(lon))
+    dlat = np.degrees(passo/RAIO_TERRA)
+    dlon = np.degrees(passo/(RAIO_TERRA*np.cos(np.radians((lat_min + lat_max)/2))))
+    margem_lat, margem_lon = dlat*margem/passo, dlon*margem/passo
+    linhas = int(np.floor((lat_max - lat_min + 2*margem_lat)/dlat + 1e-9)) + 1
+    colunas = int(np.floor((lon_max - lon_min + 2*margem_lon)/dlon + 1e-9)) + 1
+    return lat_max + margem_lat, lon_min - margem_lon, -dlat, dlon, linhas, colunas
+
+
+class _Projecao:
+    #Equiretangular local no centro da grade: x para o leste e y para o norte, em metros
+    def __init__(self, lat_centro, lon_centro):
+        self.lat_c, self.lon_c = lat_centro, lon_centro
+        self.cos_c = np.cos(np.radians(lat_centro))
+
+    def __call__(self, lat, lon):
+        return (np.radians(np.asarray(lon) - self.lon_c)*RAIO_TERRA*self.cos_c,
+                np.radians(np.asarray(lat) - self.lat_c)*RAIO_TERRA)
+
+
+def passo_automatico(lat, lon):
+    """
+    Median distance (m) from each station to its nearest neighbour, the
+    default node spacing.
+    """
+    projecao = _Projecao(float(np.mean(lat)), float(np.mean(lon)))
+    x, y = projecao(lat, lon)
+    arvore = _arvore(x, y)
+    d, _ = arvore.query(np.column_stack((x, y)), k=2)
+    d = d[:, 1][d[:, 1] > 0]
+    if len(d) == 0:
+        raise ValueError('As estações estão todas no mesmo ponto: informe o passo da grade')
+    return float(np.median(d))
+
+
+def _curvatura_minima(z, fixos, tensao, iteracoes, tolerancia):
+    """
+    Relaxes z (modified in place) towards the minimum curvature surface
+    with tension, (1-T) laplacian² z - T laplacian z = 0, keeping the nodes
+    where fixos is True. The border is extended linearly (zero curvature
+    across the edges). Returns the number of iterations.
+    """
+    t = tensao
+    denominador = 20*(1 - t) + 4*t
+    for k in range(1, iteracoes + 1):
+        p = np.pad(z, 2, mode='reflect', reflect_type='odd') #Extensão linear: curvatura nula na borda
+        centro = p[2:-2, 2:-2]
+        s4 = p[1:-3, 2:-2] + p[3:-1, 2:-2] + p[2:-2, 1:-3] + p[2:-2, 3:-1]
+        sd = p[1:-3, 1:-3] + p[1:-3, 3:-1] + p[3:-1, 1:-3] + p[3:-1, 3:-1]
+        s2 = p[:-4, 2:-2] + p[4:, 2:-2] + p[2:-2, :-4] + p[2:-2, 4:]
+        novo = ((1 - t)*(8*s4 - 2*sd - s2) + t*s4)/denominador
+        passo = RELAXACAO*(novo - centro)
+        passo[fixos] = 0.
+        z += passo
+        if np.max(np.abs(passo)) < tolerancia:
+            return k
+    return k
+
+
+def _curvatura_minima_direta(z, fixos, tensao):
+    """
+    Minimum curvature surface with tension solved exactly (scipy.sparse):
+    z (modified in place) minimises (1-T)*(zxx² + 2*zxy² + zyy²) + T*(zx²
+    + zy²) summed over the grid, keeping the nodes where fixos is True.
+    Inside the grid this is (1-T) laplacian² z - T laplacian z = 0, the
+    equation relaxed by _curvatura_minima; at the edges it gives the
+    natural (free edge) conditions, so the solution is unique and tiles
+    solved apart agree. Returns False, leaving z untouched, when the fixed
+    nodes do not determine the surface (none, or without tension fewer
+    than three or all on one line).
+    """
+    ny, nx = z.shape
+    fi, fj = np.nonzero(fixos)
+    if len(fi) == 0 or (tensao <= 0 and np.linalg.matrix_rank(np.column_stack((np.ones(len(fi)), fi, fj))) < 3):
+        return False
+    import scipy.sparse as sp
+    from scipy.sparse.linalg import spsolve
+    d1 = lambda n: sp.diags([-np.ones(n - 1), np.ones(n - 1)], [0, 1], shape=(max(n - 1, 0), n))
+    d2 = lambda n: sp.diags([np.ones(n - 2), -2*np.ones(n - 2), np.ones(n - 2)], [0, 1, 2], shape=(max(n - 2, 0), n))
+    Iy, Ix = sp.identity(ny), sp.identity(nx)
+    segundas = sp.vstack([sp.kron(Iy, d2(nx)), sp.kron(d2(ny), Ix), np.sqrt(2)*sp.kron(d1(ny), d1(nx))])
+    primeiras = sp.vstack([sp.kron(Iy, d1(nx)), sp.kron(d1(ny), Ix)])
+    M = ((1 - tensao)*(segundas.T @ segundas) + tensao*(primeiras.T @ primeiras)).tocsr()
+    livres, presos = np.flatnonzero(~fixos.ravel()), np.flatnonzero(fixos.ravel())
+    solucao = z.ravel().astype(np.float64)
+    if len(livres):
+        solucao[livres] = spsolve(M[livres][:, livres].tocsc(), -(M[livres][:, presos] @ solucao[presos]))
+    if not np.all(np.isfinite(solucao)):
+        return False
+    z[...] = solucao.reshape(ny, nx)
+    return True
+
+
+def _resolver_curvatura(x_nos, y_nos, x, y, valores, arvore, valores_arvore, tensao, iteracoes):
+    """
+    Minimum curvature grid over the nodes x_nos (columns, m) by y_nos
+    (rows, m) from the stations x, y, valores. Each station constrains its
+    nearest node (the mean, when several share a node). The equations are
+    solved exactly (_curvatura_minima_direta), so that the only difference
+    between tiles solved apart is the truncation at their border. When the stations do not determine the surface
+    it is relaxed from a coarse grid to the final one instead, starting
+    from the nearest value of valores_arvore, the stations indexed by
+    arvore.
+    """
+    passo_x = x_nos[1] - x_nos[0] if len(x_nos) > 1 else 1.
+    passo_y = y_nos[1] - y_nos[0] if len(y_nos) > 1 else -1. #Negativo: linha 0 ao norte
+
+    def fixar(f):
+        #Nós da grade de passo f com estação, e o valor médio das suas estações
+        xs, ys = x_nos[::f], y_nos[::f]
+        i = np.rint((y - ys[0])/(passo_y*f)).astype(np.int64)
+        j = np.rint((x - xs[0])/(passo_x*f)).astype(np.int64)
+        dentro = (i >= 0) & (i < len(ys)) & (j >= 0) & (j < len(xs))
+        indice = i[dentro]*len(xs) + j[dentro]
+        soma = np.bincount(indice, valores[dentro], len(ys)*len(xs))
+        contagem = np.bincount(indice, minlength=len(ys)*len(xs))
+        fixos = (contagem > 0).reshape(len(ys), len(xs))
+        return xs, ys, fixos, soma[fixos.ravel()]/contagem[fixos.ravel()]
+
+    xs, ys, fixos, medias = fixar(1)
+    z = np.zeros((len(ys), len(xs)))
+    z[fixos] = medias
+    if _curvatura_minima_direta(z, fixos, tensao):
+        return z
+
+    tolerancia = 1e-4*max(float(np.ptp(valores)), 1e-12)
+    niveis = max(0, int(np.log2(max(1, min(len(x_nos), len(y_nos))//8))))
+    z = None
+    for nivel in range(niveis, -1, -1):
+        xs, ys, fixos, medias = fixar(2**nivel)
+        if z is None: #Superfície inicial: o valor da estação mais próxima
+            _, k = arvore.query(np.column_stack([g.ravel() for g in np.meshgrid(xs, ys)]))
+            z = valores_arvore[k].reshape(len(ys), len(xs)).astype(np.float64)
+        else: #Refina a solução do nível anterior, repetindo cada nó
+            z = np.repeat(np.repeat(z, 2, axis=0), 2, axis=1)[:len(ys), :len(xs)]
+        z[fixos] = medias
+        _curvatura_minima(z, fixos, tensao, iteracoes, tolerancia)
+    return z
+
+
+_estado_trabalhador = None
+
+
+def _iniciar_trabalhador(estado):
+    global _estado_trabalhador
+    _estado_trabalhador = estado
+
+
+def _ladrilho_no_trabalhador(i0, i1, j0, j1):
+    return _ladrilho(_estado_trabalhador, i0, i1, j0, j1)
+
+
+def _ladrilho(estado, i0, i1, j0, j1):
+    """
+    Values of the grid rows i0:i1 and columns j0:j1, in the current process.
+    """
+    x_grade, y_grade = estado['x_grade'], estado['y_grade']
+    arvore, valores, metodo = estado['arvore'], estado['valores'], estado['metodo']
+    if metodo == 'curvatura_minima':
+        borda = estado['borda']
+        a0, a1 = max(0, i0 - borda), min(len(y_grade), i1 + borda)
+        b0, b1 = max(0, j0 - borda), min(len(x_grade), j1 + borda)
+        xs, ys = x_grade[b0:b1], y_grade[a0:a1]
+        #Estações do ladrilho com a borda, mais meio nó de folga
+        folga = max(abs(x_grade[1] - x_grade[0]) if len(x_grade) > 1 else 0.,
+                    abs(y_grade[1] - y_grade[0]) if len(y_grade) > 1 else 0.)
+        centro = ((xs[0] + xs[-1])/2, (ys[0] + ys[-1])/2)
+        raio = np.hypot(xs[-1] - xs[0], ys[-1] - ys[0])/2 + folga
+        perto = np.array(arvore.query_ball_point(centro, raio), dtype=np.int64)
+        x, y = arvore.data[perto, 0], arvore.data[perto, 1]
+        meio = folga/2
+        dentro = ((x >= min(xs[0], xs[-1]) - meio) & (x <= max(xs[0], xs[-1]) + meio)
+                  & (y >= min(ys[0], ys[-1]) - meio) & (y <= max(ys[0], ys[-1]) + meio))
+        if dentro.any():
+            z = _resolver_curvatura(xs, ys, x[dentro], y[dentro], valores[perto[dentro]], arvore, valores,
+                                    estado['tensao'], estado['iteracoes'])
+        else: #Ladrilho sem estações: só a extrapolação pela estação mais próxima
+            _, k = arvore.query(np.column_stack([g.ravel() for g in np.meshgrid(xs, ys)]))
+            z = valores[k].reshape(len(ys), len(xs))
+        z = z[i0 - a0:i1 - a0, j0 - b0:j1 - b0]
+    nos = np.column_stack([g.ravel() for g in np.meshgrid(x_grade[j0:j1], y_grade[i0:i1])])
+    if metodo == 'vizinho':
+        d, k = arvore.query(nos)
+        z = valores[k]
+    elif metodo == 'idw':
+        d, k = arvore.query(nos, k=min(estado['vizinhos'], len(valores)))
+        d, k = d.reshape(len(nos), -1), k.reshape(len(nos), -1)
+        with np.errstate(divide='ignore'):
+            pesos = 1/d**estado['potencia']
+        exatos = d[:, 0] == 0 #Nó sobre uma estação: o valor dela
+        z = np.empty(len(nos))
+        z[exatos] = valores[k[exatos, 0]]
+        z[~exatos] = np.sum(pesos[~exatos]*valores[k[~exatos]], axis=1)/np.sum(pesos[~exatos], axis=1)
+        d = d[:, 0]
+    elif estado['distancia_maxima'] is not None:
+        d, _ = arvore.query(nos)
+    z = np.asarray(z, dtype=np.float32).reshape(i1 - i0, j1 - j0)
+    if estado['distancia_maxima'] is not None:
+        z[(d > estado['distancia_maxima']).reshape(z.shape)] = np.nan #Longe das estações: sem valor
+    return z
+
+
+def gradear(lat, lon, valores, passo=None, metodo='curvatura_minima', caminho=None, margem=0.,
+            distancia_maxima=None, potencia=2., vizinhos=8, tensao=TENSAO_PADRAO, iteracoes=ITERACOES_MAXIMAS,
+            ladrilho=LADRILHO_PADRAO, borda=BORDA_PADRAO, n_processos=1, instrumentacao=None, metadados=None):
+    """
+    Interpolates valores of the stations at lat, lon (decimal degrees) onto
+    a regular grid with nodes every passo metres (default: the median
+    distance between neighbouring stations) and returns a Grade. metodo is
+    'curvatura_minima' (with tension tensao, 0 to 1), 'idw' (the vizinhos
+    nearest stations weighted by 1/d**potencia) or 'vizinho'. Nodes farther
+    than distancia_maxima metres from every station are NaN. The grid is
+    computed in tiles of ladrilho nodes, in n_processos worker processes
+    (None uses every core); with minimum curvature each tile is solved with
+    borda extra nodes around it, which sets how closely the tiles match the
+    grid solved at once. With caminho the grid is written to a .npy
+    memory-mapped file (and its .json georeference) as the tiles finish,
+    or to a GeoTIFF when caminho ends with .tif. Stations with NaN values
+    are skipped.
+    """
+    if metodo not in METODOS:
+        raise ValueError('Método de interpolação desconhecido: %s (use %s)' % (metodo, ', '.join(METODOS)))
+    lat, lon, valores = (np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (lat, lon, valores))
+    validos = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(valores)
+    lat, lon, valores = lat[validos], lon[validos], valores[validos]
+    if len(valores) == 0:
+        raise ValueError('Nenhuma estação com valor para interpolar')
+    if passo is None:
+        passo = passo_automatico(lat, lon)
+    lat0, lon0, dlat, dlon, linhas, colunas = definir_grade(lat, lon, float(passo), float(margem))
+    projecao = _Projecao(lat0 + dlat*(linhas - 1)/2, lon0 + dlon*(colunas - 1)/2)
+    x, y = projecao(lat, lon)
+    x_grade = projecao(lat0, lon0 + dlon*np.arange(colunas))[0]
+    y_grade = projecao(lat0 + dlat*np.arange(linhas), lon0)[1]
+    estado = {'arvore': _arvore(x, y), 'valores': valores, 'metodo': metodo, 'x_grade': x_grade,
+              'y_grade': y_grade, 'distancia_maxima': distancia_maxima, 'potencia': float(potencia),
+              'vizinhos': int(vizinhos), 'tensao': float(tensao), 'iteracoes': int(iteracoes), 'borda': int(borda)}
+
+    geotiff = caminho is not None and caminho.lower().endswith(('.tif', '.tiff'))
+    if geotiff:
+        _rasterio() #Falha antes de calcular a grade
+    if caminho is not None and not geotiff:
+        z = np.lib.format.open_memmap(caminho, mode='w+', dtype=np.float32, shape=(linhas, colunas))
+    else:
+        z = np.empty((linhas, colunas), dtype=np.float32)
+    grade = Grade(z, lat0, lon0, dlat, dlon, dict(metadados or {}, metodo=metodo, passo_m=float(passo),
+                                                   estacoes=int(len(valores))))
+
+    ladrilhos = [(i, min(i + ladrilho, linhas), j, min(j + ladrilho, colunas))
+                 for i in range(0, linhas, ladrilho) for j in range(0, colunas, ladrilho)]
+    if n_processos is None:
+        n_processos = os.cpu_count() or 1
+    n_processos = max(1, min(n_processos, len(ladrilhos)))
+    if n_processos == 1:
+        for k, (i0, i1, j0, j1) in enumerate(ladrilhos):
+            z[i0:i1, j0:j1] = _ladrilho(estado, i0, i1, j0, j1)
+            progresso(instrumentacao, 'grade', k + 1, len(ladrilhos))
+    else:
+        from concurrent.futures import ProcessPoolExecutor #O multiprocessing só é carregado quando usado
+        with ProcessPoolExecutor(max_workers=n_processos, initializer=_iniciar_trabalhador,
+                                 initargs=(estado,)) as pool:
+            resultados = pool.map(_ladrilho_no_trabalhador, *zip(*ladrilhos))
+            try:
+                for k, ((i0, i1, j0, j1), parte) in enumerate(zip(ladrilhos, resultados)):
+                    z[i0:i1, j0:j1] = parte
+                    progresso(instrumentacao, 'grade', k + 1, len(ladrilhos))
+            except BaseException:
+                pool.shutdown(cancel_futures=True) #Não espera os ladrilhos que ainda não começaram
+                raise
+
+    if geotiff:
+        grade.salvar_geotiff(caminho)
+    elif caminho is not None:
+        z.flush()
+        grade.salvar_georreferencia(caminho)
+    return grade
+
+
+def gradear_resultados(resultados, coluna='g_cb', caminho=None, **opcoes):
+    """
+    Grid of the column coluna of the reduction results (see gradear for
+    opcoes). Repeated stations are averaged before gridding.
+    """
+    if coluna not in resultados:
+        raise ValueError('A coluna %s não está nos resultados da redução' % coluna)
+    ponto = np.asarray(resultados['ponto'], dtype=np.float64)
+    pontos, inv = np.unique(ponto, return_inverse=True)
+    n = np.bincount(inv, minlength=len(pontos))
+    media = [np.bincount(inv, np.asarray(resultados[c], dtype=np.float64), len(pontos))/n
+             for c in ('Lat_graus_dec', 'Lon_graus_dec', coluna)]
+    return gradear(*media, caminho=caminho, metadados={'coluna': coluna}, **opcoes)
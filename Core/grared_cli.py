@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import sys
+import glob
+import json
+import logging
+import argparse
+from reducao import PARAMETROS_PADRAO, ler_tabela_conversao
+from lote import reduzir_lote, reduzir_rede
+from saida import escrever_txt
+from ajuste import tabela_de_estacoes
+from controle import controlar_repeticoes, tabela_de_circuitos, tabela_de_pares
+from gravidade_normal import ELIPSOIDES, FORMULAS
+from amostras import ESTIMADORES
+from grade import METODOS
+
+#--------------------------------------------------
+#Linha de comando do GRARED (sem GUI)
+#--------------------------------------------------
+'''
+Uso / Usage:
+    python grared_cli.py GRARED_P.xlsx --grav 996 --dia 1 --mes 1 --ano 2017 --g-ref 978600.0
+    python grared_cli.py pasta_de_circuitos/ --saida-dir reduzidos/ --processos 8
+    python grared_cli.py pasta_de_circuitos/ --rede --base 1=978600.0 --base 40=978512.31:0.02
+    python grared_cli.py GRARED_P.xlsx --g-ref 978600.0 --mde srtm.tif --raio-terreno 20000
+    python grared_cli.py GRARED_P.xlsx --g-ref 978600.0 --saidas g_ca,g_cb --atmosferica
+    python grared_cli.py GRARED_P.xlsx --g-ref 978600.0 --grade bouguer.npy --grade-metodo curvatura_minima
+    python grared_cli.py pasta_de_circuitos/ --controle controle.tsv --controle-tolerancia 5
+    python grared_cli.py registro.csv --tipo amostras --estimador mediana --assentamento 30 --g-ref 978600.0
+'''
+
+EXTENSOES_EXCEL = ('.xlsx', '.xls')
+EXTENSOES_TXT = ('.txt', '.dat')
+
+
+def tipo_por_extensao(nome_arquivo):
+    """
+    Returns 'txt' for DAT/TXT files and 'excel' otherwise.
+    """
+    if os.path.splitext(nome_arquivo)[1].lower() in EXTENSOES_TXT:
+        return 'txt'
+    return 'excel'
+
+
+def listar_entradas(entradas, ignorar=()):
+    """
+    Expands files, directories and glob patterns into a sorted list of
+    survey files. Directories contribute every Excel or DAT/TXT file they
+    contain, except the names in ignorar (e.g. the conversion table).
+    """
+    ignorar = set(os.path.abspath(i) for i in ignorar)
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            candidatos = sorted(os.path.join(entrada, n) for n in os.listdir(entrada)
+                                if os.path.splitext(n)[1].lower() in EXTENSOES_EXCEL + EXTENSOES_TXT)
+        elif glob.has_magic(entrada):
+            candidatos = sorted(glob.glob(entrada))
+        else:
+            candidatos = [entrada]
+        for c in candidatos:
+            if os.path.abspath(c) not in ignorar and c not in arquivos:
+                arquivos.append(c)
+    return arquivos
+
+
+def nomes_de_saida(nome_arquivo, args, varios):
+    """
+    Returns the (txt, excel, columnar, uncertainty, grid) output names for one input. With
+    several inputs the file stem is used as prefix so that the outputs do
+    not overwrite each other.
+    """
+    nomes = [args.saida_txt, args.saida_excel, args.saida_colunar, args.incertezas, args.grade]
+    if varios:
+        base = os.path.splitext(os.path.basename(nome_arquivo))[0]
+        nomes = [n and base + '_' + n for n in nomes]
+    if args.saida_dir:
+        nomes = [n and os.path.join(args.saida_dir, n) for n in nomes]
+    return tuple(nomes)
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(prog='grared',
+                                     description='GRARED - redução gravimétrica sem GUI')
+    parser.add_argument('entradas', nargs='+',
+                        help='arquivos de dados, pastas ou padrões glob no modelo GRARED_P')
+    parser.add_argument('--tipo', choices=('excel', 'txt', 'amostras'), default=None,
+                        help="tipo do arquivo de entrada (padrão: pela extensão); 'amostras' é o registro contínuo "
+                             "de um gravímetro, uma amostra por linha (ponto, instante, leitura e dados da estação)")
+    parser.add_argument('--aba', default='Plan1', help='aba da planilha de entrada')
+    parser.add_argument('--conv', default='Tabelas_conv_todas.xlsx', help='planilha de conversão')
+    parser.add_argument('--grav', default='996', help='número do gravímetro')
+    parser.add_argument('--sem-cache', action='store_true',
+                        help='lê a tabela de conversão do Excel sem usar o cache binário')
+    parser.add_argument('--dia', type=int, default=PARAMETROS_PADRAO['dia'])
+    parser.add_argument('--mes', type=int, default=PARAMETROS_PADRAO['mes'])
+    parser.add_argument('--ano', type=int, default=PARAMETROS_PADRAO['ano'])
+    parser.add_argument('--fuso', type=float, default=PARAMETROS_PADRAO['fuso_horario'],
+                        help='fuso horário (padrão: -3)')
+    parser.add_argument('--densidade', type=float, default=PARAMETROS_PADRAO['densidade'],
+                        help='densidade crustal em ton/m³')
+    parser.add_argument('--g-ref', type=float, default=PARAMETROS_PADRAO['g_ref'],
+                        help='aceleração grav. absoluta da primeira estação (mGal)')
+    parser.add_argument('--sem-free-air', action='store_true', help='desliga a correção ar-livre')
+    parser.add_argument('--sem-bouguer', action='store_true', help='desliga a correção Bouguer')
+    parser.add_argument('--elipsoide', choices=tuple(ELIPSOIDES),
+                        default=PARAMETROS_PADRAO['elipsoide'])
+    parser.add_argument('--formula-normal', choices=FORMULAS, default=None,
+                        help='fórmula da gravidade normal (padrão: a do elipsoide; curta para GRS67 e GRS80)')
+    parser.add_argument('--ar-livre-2a-ordem', action='store_true',
+                        help='correção ar-livre de segunda ordem, pela gravidade normal na altitude da estação')
+    parser.add_argument('--atmosferica', action='store_true',
+                        help='soma às anomalias a correção atmosférica (IAG)')
+    parser.add_argument('--eotvos', action='store_true',
+                        help='correção de Eötvös, pela velocidade entre estações (levantamentos em movimento)')
+    parser.add_argument('--estimador', choices=ESTIMADORES, default=PARAMETROS_PADRAO['estimador'],
+                        help='valor de cada ocupação de um registro de amostras (padrão: mediana)')
+    parser.add_argument('--corte-sigma', type=float, default=PARAMETROS_PADRAO['corte_sigma'],
+                        help='descarta as amostras a mais deste número de desvios padrão da mediana (0: sem corte)')
+    parser.add_argument('--fracao-aparada', type=float, default=PARAMETROS_PADRAO['fracao_aparada'],
+                        help='fração descartada em cada ponta pela média aparada (padrão: 0.1)')
+    parser.add_argument('--assentamento', type=float, default=PARAMETROS_PADRAO['assentamento'],
+                        help='segundos descartados no início de cada ocupação (assentamento do gravímetro)')
+    parser.add_argument('--intervalo-maximo', type=float, default=PARAMETROS_PADRAO['intervalo_maximo'],
+                        help='intervalo sem amostras (s) que inicia uma nova ocupação do mesmo ponto (0: desligado)')
+    parser.add_argument('--saida-txt', default='dados_reduzidos.dat',
+                        help="saída DAT/TXT ('' para não gerar)")
+    parser.add_argument('--saida-excel', default='dados_reduzidos.xlsx',
+                        help="saída Excel ('' para não gerar)")
+    parser.add_argument('--saida-colunar', default=None,
+                        help='saída colunar adicional, .parquet ou .feather (precisa do pyarrow)')
+    parser.add_argument('--saida-dir', default=None, help='pasta das saídas')
+    parser.add_argument('--saidas', default=None, metavar='COL,COL',
+                        help='calcula só as colunas pedidas (ex.: g_ca,g_cb), pulando as etapas desnecessárias')
+    parser.add_argument('--blocos', type=int, default=None, metavar='LINHAS',
+                        help='lê arquivos DAT/TXT em blocos deste número de linhas (arquivos grandes)')
+    parser.add_argument('--processos', type=int, default=1,
+                        help='número de processos paralelos (0 = todos os núcleos)')
+    parser.add_argument('--armazem', nargs='?', const='', default=None, metavar='PASTA',
+                        help='reaproveita as etapas já calculadas (maré, conversão, ...) do armazém em disco; '
+                             'sem PASTA usa a pasta de cache')
+    parser.add_argument('--mde', default=None, metavar='ARQUIVO',
+                        help='modelo digital de elevação (GeoTIFF com rasterio, ou .npz) para a correção de terreno')
+    parser.add_argument('--raio-terreno', type=float, default=10000.,
+                        help='raio da correção de terreno em metros (padrão: 10000)')
+    parser.add_argument('--incertezas', default=None, metavar='ARQUIVO',
+                        help='relatório da incerteza de cada estação e da entrada que mais contribui para ela')
+    parser.add_argument('--incerteza', action='append', default=[], metavar='ENTRADA=VALOR',
+                        help='incerteza de uma entrada (leitura, tempo, g_ref, altitude, densidade, posicao, ...); '
+                             'pode ser repetida')
+    parser.add_argument('--monte-carlo', type=int, default=0, metavar='N',
+                        help='acrescenta ao relatório de incertezas N realizações de Monte Carlo')
+    parser.add_argument('--grade', default=None, metavar='ARQUIVO',
+                        help='interpola as estações numa grade regular: .npy mapeável (georreferência no .json) '
+                             'ou .tif (precisa do rasterio); precisa do scipy')
+    parser.add_argument('--grade-coluna', default='g_cb', help='coluna interpolada (padrão: g_cb, anomalia Bouguer)')
+    parser.add_argument('--grade-metodo', choices=METODOS, default='curvatura_minima')
+    parser.add_argument('--grade-passo', type=float, default=None, metavar='METROS',
+                        help='espaçamento dos nós (padrão: a distância mediana entre estações vizinhas)')
+    parser.add_argument('--grade-mascara', type=float, default=None, metavar='METROS',
+                        help='deixa sem valor os nós a mais desta distância de qualquer estação')
+    parser.add_argument('--rede', action='store_true',
+                        help='ajusta todos os arquivos juntos como uma rede (cada arquivo é um circuito)')
+    parser.add_argument('--base', action='append', default=[], metavar='PONTO=VALOR[:INCERTEZA]',
+                        help='base absoluta da rede em mGal (pode ser repetida; padrão: o primeiro ponto com --g-ref)')
+    parser.add_argument('--grau-deriva', type=int, default=1, help='grau do polinômio de deriva de cada circuito')
+    parser.add_argument('--saida-rede', default='estacoes_ajustadas.dat',
+                        help='tabela das estações ajustadas pela rede')
+    parser.add_argument('--controle', default=None, metavar='ARQUIVO',
+                        help='confere as estações repetidas de todos os arquivos: tabela por circuito neste arquivo '
+                             '(separado por tabulações) e pares repetidos em ARQUIVO_pares')
+    parser.add_argument('--controle-tolerancia', type=float, default=5., metavar='METROS',
+                        help='distância até a qual pontos diferentes são o mesmo local (cruzamento)')
+    parser.add_argument('--controle-corte', type=float, default=3.,
+                        help='fechamentos e resíduos além deste número de desvios padrão são suspeitos')
+    parser.add_argument('--etapas', default=None, metavar='JSON',
+                        help='mede tempo, linhas e memória de cada etapa e grava o relatório neste JSON')
+    parser.add_argument('--memoria', action='store_true',
+                        help='mede o pico de memória de cada etapa com o tracemalloc (mais lento)')
+    parser.add_argument('--perfil', action='store_true',
+                        help='perfila a redução com o cProfile (o resultado vai para o relatório de etapas)')
+    return parser
+
+
+def parametros_de_args(args):
+    return {'dia': args.dia, 'mes': args.mes, 'ano': args.ano,
+            'fuso_horario': args.fuso, 'densidade': args.densidade, 'g_ref': args.g_ref,
+            'free_air': 0 if args.sem_free_air else 1,
+            'bouguer': 0 if args.sem_bouguer else 1,
+            'elipsoide': args.elipsoide, 'formula_normal': args.formula_normal,
+            'ar_livre_2a_ordem': 1 if args.ar_livre_2a_ordem else 0,
+            'estimador': args.estimador, 'corte_sigma': args.corte_sigma, 'fracao_aparada': args.fracao_aparada,
+            'assentamento': args.assentamento, 'intervalo_maximo': args.intervalo_maximo,
+            'atmosferica': 1 if args.atmosferica else 0, 'eotvos': 1 if args.eotvos else 0}
+
+
+def bases_de_args(args):
+    """
+    Parses the --base options (PONTO=VALOR or PONTO=VALOR:INCERTEZA).
+    """
+    bases = {}
+    for texto in args.base:
+        ponto, _, valor = texto.partition('=')
+        valor, _, incerteza = valor.partition(':')
+        try:
+            bases[float(ponto)] = (float(valor), float(incerteza)) if incerteza else float(valor)
+        except ValueError:
+            raise SystemExit('Base inválida: %r (use PONTO=VALOR[:INCERTEZA])' % texto)
+    return bases
+
+
+def incertezas_de_args(args):
+    """
+    Parses the --incerteza options (ENTRADA=VALOR).
+    """
+    incertezas = {}
+    for texto in args.incerteza:
+        entrada, _, valor = texto.partition('=')
+        try:
+            incertezas[entrada.strip()] = float(valor)
+        except ValueError:
+            raise SystemExit('Incerteza inválida: %r (use ENTRADA=VALOR)' % texto)
+    return incertezas
+
+
+def opcoes_de_instrumentacao(args):
+    """
+    Options for lote.reduzir_lote: None when no measurement was asked.
+    """
+    if not (args.etapas or args.memoria or args.perfil):
+        return None
+    return {'memoria': args.memoria, 'perfil': args.perfil}
+
+
+def controle_main(args, saida):
+    """
+    Repeat-station control (controle.py) of the files reduced without
+    error; writes the per-loop table to --controle and the repeat pairs
+    next to it.
+    """
+    validos = [r for r in saida if not r['erro']]
+    if not validos:
+        return
+    controle = controlar_repeticoes([r['resultados'] for r in validos], [r['arquivo'] for r in validos],
+                                    tolerancia_m=args.controle_tolerancia, corte=args.controle_corte)
+    caminho = os.path.join(args.saida_dir, args.controle) if args.saida_dir else args.controle
+    raiz, extensao = os.path.splitext(caminho)
+    circuitos = tabela_de_circuitos(controle)
+    circuitos.to_csv(caminho, sep='\t', index=False)
+    tabela_de_pares(controle).to_csv(raiz + '_pares' + (extensao or '.tsv'), sep='\t', index=False)
+    print('Controle: %d pares repetidos (%d suspeitos), sigma = %.3f mGal, %d circuitos com tara suspeita'
+          % (len(controle['pares']['z']), controle['pares']['suspeito'].sum(), controle['sigma'],
+             (circuitos['11_Tara.Susp'] != '').sum()))
+
+
+def rede_main(args, tarefas, tabela, parametros):
+    rede, saida = reduzir_rede(tarefas, tabela, parametros, bases_de_args(args), args.grau_deriva,
+                               n_processos=args.processos or None, retornar_resultados=bool(args.controle))
+    falhas = 0
+    for r in saida:
+        if r['erro']:
+            falhas += 1
+            print('%s: ERRO: %s' % (r['arquivo'], r['erro']), file=sys.stderr)
+        else:
+            print('%s: %d leituras reduzidas' % (r['arquivo'], r['leituras']))
+    print('Rede: %d estações, %d circuitos, sigma0 = %.3f (%d graus de liberdade)'
+          % (len(rede['pontos']), len(rede['circuitos']), rede['sigma0'], rede['graus_de_liberdade']))
+    if args.saida_rede:
+        caminho = os.path.join(args.saida_dir, args.saida_rede) if args.saida_dir else args.saida_rede
+        escrever_txt(tabela_de_estacoes(rede), caminho)
+    if args.controle:
+        controle_main(args, saida)
+    return 1 if falhas else 0
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    instrumentar = opcoes_de_instrumentacao(args)
+    if instrumentar:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    arquivos = listar_entradas(args.entradas, ignorar=[args.conv])
+    if not arquivos:
+        print('Nenhum arquivo de entrada encontrado.', file=sys.stderr)
+        return 2
+    if args.saida_dir:
+        os.makedirs(args.saida_dir, exist_ok=True)
+    saidas = tuple(c.strip() for c in args.saidas.split(',') if c.strip()) if args.saidas else None
+    if saidas and (args.rede or args.armazem is not None or args.blocos or args.incertezas):
+        raise SystemExit('--saidas não pode ser usado com --rede, --armazem, --blocos ou --incertezas')
+    if args.grade and args.rede:
+        raise SystemExit('--grade não pode ser usado com --rede')
+    if saidas and args.grade:
+        saidas += (args.grade_coluna, 'Lat_graus_dec', 'Lon_graus_dec')
+    if saidas and args.controle:
+        saidas += ('g_abs', 'Lat_graus_dec', 'Lon_graus_dec', 'alt_m', 'data', 'hora_dec')
+
+    parametros = parametros_de_args(args)
+    tabela = ler_tabela_conversao(args.conv, args.grav, usar_cache=not args.sem_cache) #Lida uma única vez para todos os arquivos
+    #Com um só arquivo, os processos dividem as estações da correção de terreno e os ladrilhos da grade
+    processos_terreno = (args.processos or os.cpu_count() or 1) if len(arquivos) == 1 and not args.rede else 1
+    tarefas = []
+    for nome_arquivo in arquivos:
+        saida_txt, saida_excel, saida_colunar, saida_incertezas, saida_grade = nomes_de_saida(nome_arquivo, args,
+                                                                                              len(arquivos) > 1)
+        grade = saida_grade and {'caminho': saida_grade, 'coluna': args.grade_coluna, 'metodo': args.grade_metodo,
+                                 'passo': args.grade_passo, 'distancia_maxima': args.grade_mascara,
+                                 'n_processos': processos_terreno}
+        tarefas.append({'arquivo': nome_arquivo, 'tipo': args.tipo or tipo_por_extensao(nome_arquivo),
+                        'aba': args.aba, 'saida_txt': saida_txt, 'saida_excel': saida_excel,
+                        'saida_colunar': saida_colunar, 'conv': args.conv,
+                        'linhas_por_bloco': args.blocos, 'armazem': args.armazem,
+                        'mde': args.mde, 'raio_terreno': args.raio_terreno, 'processos_terreno': processos_terreno,
+                        'saida_incertezas': saida_incertezas, 'incertezas': incertezas_de_args(args),
+                        'monte_carlo': args.monte_carlo, 'saidas': saidas, 'grade': grade})
+
+    if args.rede:
+        return rede_main(args, tarefas, tabela, parametros)
+
+    falhas = 0
+    relatorios = []
+    saida = reduzir_lote(tarefas, tabela, parametros, n_processos=args.processos or None,
+                         retornar_resultados=bool(args.controle), instrumentar=instrumentar)
+    for r in saida:
+        if r['erro']:
+            falhas += 1
+            print('%s: ERRO: %s' % (r['arquivo'], r['erro']), file=sys.stderr)
+        else:
+            print('%s: %d leituras reduzidas' % (r['arquivo'], r['leituras']))
+        if r.get('etapas'):
+            relatorios.append(r['etapas'])
+            if args.perfil and not args.etapas:
+                print(r['etapas']['perfil'], file=sys.stderr)
+    if args.etapas:
+        with open(args.etapas, 'w', encoding='utf-8') as arq:
+            json.dump({'parametros': parametros, 'arquivos': relatorios}, arq, indent=1, ensure_ascii=False)
+    if args.controle:
+        controle_main(args, saida)
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
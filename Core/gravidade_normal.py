@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+from collections import namedtuple
+import numpy as np
+
+#--------------------------------------------------
+#Gravidade normal dos elipsoides de referência
+#--------------------------------------------------
+'''
+Tabela de elipsoides de referência e gravidade normal vetorizada: fórmula
+fechada de Somigliana, sua série em potências de sen²φ e as fórmulas curtas
+publicadas (Fórmula Internacional da Gravidade de 1967 e de 1980). Todas
+recebem sen²φ já calculado, que a redução calcula uma única vez por leitura
+(coluna 'sen2_lat'). Opcionalmente a gravidade normal é levada à altitude h
+com a fórmula de segunda ordem. Para incluir um elipsoide basta acrescentar
+uma entrada em ELIPSOIDES.
+----------------------------
+Table of reference ellipsoids and vectorized normal gravity: closed
+Somigliana formula, its series in powers of sin²φ and the published short
+formulas (International Gravity Formula of 1967 and of 1980). All of them
+take sin²φ already computed, which the reduction computes only once per
+reading ('sen2_lat' column). Optionally the normal gravity is taken to the
+height h with the second-order formula. To add an ellipsoid, just add an
+entry to ELIPSOIDES.
+'''
+
+MS2_PARA_MGAL = 1e5
+
+#a (m), f, e², gravidade normal no equador ge (m/s²), k = b*gp/(a*ge) - 1, m = ω²a²b/GM,
+#coeficientes da fórmula curta (ge em mGal, c1, c2) e fórmula usada por padrão
+Elipsoide = namedtuple('Elipsoide', 'nome a f e2 ge k m curta formula')
+
+ELIPSOIDES = {
+    #Geodetic Reference System 1967 (Bulletin Géodésique, 1971)
+    'grs67': Elipsoide('GRS67', 6378160., 1/298.247167427, 0.006694605328561, 9.78031845584,
+                       0.00193166338321, 0.00344980143430, (978031.8, 0.0053024, 0.0000059), 'curta'),
+    #Geodetic Reference System 1980 (Moritz, 2000)
+    'grs80': Elipsoide('GRS80', 6378137., 1/298.257222101, 0.00669438002290, 9.7803267715,
+                       0.001931851353, 0.00344978600308, (978032.7, 0.0053024, 0.0000058), 'curta'),
+    #WGS84 original (DMA TR 8350.2, 1987), o 'grs84' do GRARED
+    'grs84': Elipsoide('WGS84 (1984)', 6378137., 1/298.257223563, 0.00669437999013, 9.7803267714,
+                       0.00193185138639, 0.00344978650684, None, 'somigliana'),
+    #WGS84 atual (NIMA TR 8350.2, 3ª ed., 2000)
+    'wgs84': Elipsoide('WGS84', 6378137., 1/298.257223563, 0.00669437999013, 9.7803253359,
+                       0.00193185265241, 0.00344978650684, None, 'somigliana'),
+}
+
+FORMULAS = ('somigliana', 'serie', 'curta')
+
+#Valores publicados da gravidade normal (mGal) usados por conferir_valores_publicados
+VALORES_PUBLICADOS = (('grs67', 0., 978031.8456), ('grs67', 90., 983217.7279),
+                      ('grs80', 0., 978032.67715), ('grs80', 90., 983218.63685),
+                      ('grs80', 45., 980619.9203),
+                      ('grs84', 0., 978032.67714),
+                      ('wgs84', 0., 978032.53359), ('wgs84', 90., 983218.49378))
+
+
+def elipsoide(nome):
+    """
+    The Elipsoide with the given name (case insensitive), or nome itself
+    when it already is one.
+    """
+    if isinstance(nome, Elipsoide):
+        return nome
+    try:
+        return ELIPSOIDES[str(nome).lower()]
+    except KeyError:
+        raise ValueError('Elipsoide desconhecido: %r (use %s)' % (nome, ', '.join(ELIPSOIDES)))
+
+
+def seno2(lat_graus):
+    """
+    sin²φ of latitudes in decimal degrees.
+    """
+    return np.sin(np.radians(np.asarray(lat_graus, dtype=np.float64)))**2
+
+
+def coeficientes_serie(nome, ordem=4):
+    """
+    Coefficients a_0..a_ordem of the Somigliana formula as a series,
+    g = ge*(a_0 + a_1*s + ... + a_ordem*s**ordem) with s = sin²φ. They come
+    from (1 + k*s)*(1 - e²*s)**-0.5 expanded in powers of e²*s.
+    """
+    e = elipsoide(nome)
+    n = np.arange(ordem + 1)
+    c = np.ones(ordem + 1) #Coeficientes binomiais de (1 - x)**-0.5
+    for j in range(1, ordem + 1):
+        c[j] = c[j - 1]*(2*j - 1)/(2*j)
+    a = c*e.e2**n
+    a[1:] += e.k*c[:-1]*e.e2**n[:-1]
+    return a
+
+
+def gravidade_normal(sen2_lat, nome='grs84', altura=None, formula=None):
+    """
+    Normal gravity in mGal for sen2_lat = sin²φ (array or scalar) on the
+    ellipsoid nome. formula is 'somigliana' (closed form), 'serie' (fourth
+    order series of the closed form) or 'curta' (published short formula,
+    GRS67 and GRS80 only); by default the one of the ellipsoid table. With
+    altura (metres above the ellipsoid) the second-order height formula is
+    applied: g(h) = g*(1 - 2/a*(1 + f + m - 2*f*sin²φ)*h + 3*h²/a²).
+    """
+    e = elipsoide(nome)
+    s = np.asarray(sen2_lat, dtype=np.float64)
+    formula = formula or e.formula
+    if formula == 'somigliana':
+        g = e.ge*MS2_PARA_MGAL*(1 + e.k*s)/np.sqrt(1 - e.e2*s)
+    elif formula == 'serie':
+        g = e.ge*MS2_PARA_MGAL*np.polynomial.polynomial.polyval(s, coeficientes_serie(e))
+    elif formula == 'curta':
+        if e.curta is None:
+            raise ValueError('O elipsoide %s não tem fórmula curta publicada' % e.nome)
+        ge, c1, c2 = e.curta
+        g = ge*(1 + c1*s - c2*4*s*(1 - s)) #sen²(2φ) = 4*sen²φ*cos²φ
+    else:
+        raise ValueError('Fórmula desconhecida: %r (use %s)' % (formula, ', '.join(FORMULAS)))
+    if altura is not None:
+        h = np.asarray(altura, dtype=np.float64)
+        g = g*(1 - 2/e.a*(1 + e.f + e.m - 2*e.f*s)*h + 3*h*h/e.a**2)
+    return g
+
+
+def gradiente_normal(sen2_lat, nome='grs84', altura=0.):
+    """
+    Vertical gradient -dg/dh of the second-order normal gravity, in
+    mGal/m (about 0.3086): the second-order free-air factor.
+    """
+    e = elipsoide(nome)
+    s = np.asarray(sen2_lat, dtype=np.float64)
+    g = gravidade_normal(s, e)
+    return g*(2/e.a*(1 + e.f + e.m - 2*e.f*s) - 6*np.asarray(altura, dtype=np.float64)/e.a**2)
+
+
+def conferir_valores_publicados(tolerancia=1e-3):
+    """
+    Compares the closed Somigliana formula (and its series) with the
+    published normal gravity values of VALORES_PUBLICADOS. Returns one row
+    (ellipsoid, latitude, published, Somigliana, series) per value and
+    raises AssertionError when a difference exceeds tolerancia (mGal).
+    """
+    linhas = []
+    for nome, lat, publicado in VALORES_PUBLICADOS:
+        s = seno2(lat)
+        exato = float(gravidade_normal(s, nome, formula='somigliana'))
+        serie = float(gravidade_normal(s, nome, formula='serie'))
+        linhas.append((nome, lat, publicado, exato, serie))
+        if abs(exato - publicado) > tolerancia or abs(serie - publicado) > tolerancia:
+            raise AssertionError('Gravidade normal de %s a %g° difere do valor publicado %.5f: %.5f / %.5f'
+                                 % (nome, lat, publicado, exato, serie))
+    return linhas
+
+
+if __name__ == '__main__':
+    for linha in conferir_valores_publicados():
+        print('%-6s %5.1f°  publicado %.5f  Somigliana %.5f  série %.5f' % linha)
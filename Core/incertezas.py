@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from calculos import correcao_bouguer
+from gravidade_normal import gravidade_normal, gradiente_normal, seno2
+
+#--------------------------------------------------
+#Propagação das incertezas pela redução inteira
+#--------------------------------------------------
+'''
+Propaga as incertezas das entradas (leituras, tempo, g de referência,
+altitude, densidade, posição, ...) por toda a cadeia da redução de um
+circuito: deriva linear, g absoluto, gravidade normal, ar-livre e Bouguer.
+No modo analítico as derivadas parciais (jacobianas) de todas as estações
+são calculadas de uma só vez, e a variância de cada saída é separada por
+entrada, o que diz qual entrada domina a incerteza de cada estação. As
+leituras de abertura e de fechamento do circuito entram na deriva de todas
+as estações, e essa correlação é levada em conta. No modo Monte Carlo as N
+realizações perturbadas são calculadas juntas, como arrays N x estações,
+em blocos de realizações, em vez de N reduções completas.
+----------------------------
+Propagates the uncertainties of the inputs (readings, time, reference g,
+altitude, density, position, ...) through the whole reduction chain of a
+loop: linear drift, absolute g, normal gravity, free-air and Bouguer. In
+the analytic mode the partial derivatives (Jacobians) of all stations are
+computed at once, and the variance of each output is split by input,
+which tells which input dominates the uncertainty of each station. The
+opening and closing readings of the loop enter the drift of every station,
+and that correlation is accounted for. In the Monte Carlo mode the N
+perturbed realisations are computed together, as N x stations arrays, in
+blocks of realisations, instead of N full reductions.
+'''
+
+#Incertezas padrão (1 desvio padrão) de cada entrada, as mesmas assumidas pela redução
+INCERTEZAS_PADRAO = {'leitura': 0.5,             #Leitura média, mGal
+                     'altura_instrumental': 0.,  #Altura do instrumento, m
+                     'mare': 0.,                 #Modelo de maré, mGal
+                     'tempo': 0.5/60,            #Hora de cada leitura, h
+                     'g_ref': 0.03,              #g absoluto da estação de referência, mGal
+                     'altitude': 0.5,            #Altitude de cada estação, m
+                     'densidade': 0.01,          #Densidade crustal, ton/m³
+                     'posicao': 0.}              #Posição horizontal de cada estação, m
+
+#Saídas cuja incerteza é propagada
+QUANTIDADES = ('cd', 'g_cd', 'g_abs', 'g_teor', 'ca', 'cb', 'g_ca', 'g_cb')
+
+FATOR_AR_LIVRE = 0.308596 #mGal/m
+RAIO_TERRA = 6371000. #m, para converter a incerteza de posição em latitude
+
+
+def _incertezas(incertezas):
+    saida = dict(INCERTEZAS_PADRAO)
+    saida.update(incertezas or {})
+    desconhecidas = set(saida) - set(INCERTEZAS_PADRAO)
+    if desconhecidas:
+        raise ValueError('Entradas de incerteza desconhecidas: %s (use %s)'
+                         % (', '.join(sorted(desconhecidas)), ', '.join(INCERTEZAS_PADRAO)))
+    return saida
+
+
+def _soma_quadrados(proprio, c0, cN):
+    #Soma dos quadrados dos coeficientes de cada estação sobre as variáveis da própria leitura e das
+    #leituras de abertura (0) e fechamento (N) do circuito; na abertura e no fechamento elas coincidem
+    proprio, c0, cN = proprio.copy(), c0.copy(), cN.copy()
+    proprio[0] += c0[0]
+    c0[0] = 0.
+    proprio[-1] += cN[-1]
+    cN[-1] = 0.
+    return proprio**2 + c0**2 + cN**2
+
+
+def contribuicoes_circuito(g_cls, delta_t, incertezas=None):
+    """
+    Analytic propagation through the linear drift of one closed loop.
+    g_cls are the tide-corrected readings (mGal) and delta_t the elapsed
+    times (h). Returns {quantity: {input: variance array}} for 'cd',
+    'g_cd' and 'g_abs'. Every reading is an independent variable, and the
+    drift of each station depends on its own reading and time and on those
+    of the opening and closing readings.
+    """
+    ç = _incertezas(incertezas)
+    g_cls = np.asarray(g_cls, dtype=np.float64)
+    t = np.asarray(delta_t, dtype=np.float64)
+    T = t[-1] - t[0]
+    u = (t - t[0])/T
+    delta_g = g_cls[-1] - g_cls[0]
+    zeros = np.zeros(len(t))
+
+    #Coeficientes das variáveis de cada leitura (própria, abertura, fechamento)
+    s_cd = _soma_quadrados(zeros, u, -u)
+    s_gcd = _soma_quadrados(zeros + 1, u, -u)
+    s_gabs = _soma_quadrados(zeros + 1, u - 1, -u)
+    s_tempo = _soma_quadrados(zeros + 1, u - 1, -u)*(delta_g/T)**2 #Pela fração u do tempo do circuito
+
+    por_leitura = {'leitura': ç['leitura']**2,
+                   'altura_instrumental': (FATOR_AR_LIVRE*ç['altura_instrumental'])**2,
+                   'mare': ç['mare']**2}
+    saida = {}
+    for nome, s in (('cd', s_cd), ('g_cd', s_gcd), ('g_abs', s_gabs)):
+        saida[nome] = {entrada: s*var for entrada, var in por_leitura.items()}
+        saida[nome]['tempo'] = s_tempo*ç['tempo']**2
+    saida['g_abs']['g_ref'] = zeros + ç['g_ref']**2
+    return saida
+
+
+def contribuicoes_anomalias(var_gabs, alt_m, sen2_lat, params, incertezas=None):
+    """
+    Analytic propagation from the absolute gravity to the normal gravity,
+    free-air and Bouguer corrections and anomalies. var_gabs is
+    {input: variance of g_abs}, e.g. from contribuicoes_circuito or
+    {'rede': ç_gabs**2} after a network adjustment; its errors are
+    independent of the altitude, density and position ones. Returns
+    {quantity: {input: variance array}} for 'g_teor', 'ca', 'cb', 'g_ca'
+    and 'g_cb'. ca and cb share the altitude, so its part of the Bouguer
+    anomaly uses the difference of their gradients.
+    """
+    ç = _incertezas(incertezas)
+    alt_m = np.asarray(alt_m, dtype=np.float64)
+    s = np.asarray(sen2_lat, dtype=np.float64)
+    zeros = np.zeros(len(alt_m))
+    densidade = float(params.get('densidade', 2.67))
+    elipsoide = params.get('elipsoide', 'grs84')
+    formula = params.get('formula_normal') or None
+    free_air = int(params.get('free_air', 1))
+    bouguer = int(params.get('bouguer', 1))
+
+    #Derivadas parciais
+    passo = 1e-7
+    dgteor_ds = (gravidade_normal(s + passo, elipsoide, formula=formula)
+                 - gravidade_normal(s - passo, elipsoide, formula=formula))/(2*passo)
+    dgteor_dpos = dgteor_ds*2*np.sqrt(s*(1 - s))/RAIO_TERRA #ds/dφ = sen(2φ), em módulo
+    if not free_air:
+        dca_dh = zeros
+    elif int(params.get('ar_livre_2a_ordem', 0)):
+        dca_dh = gradiente_normal(s, elipsoide, alt_m)
+    else:
+        dca_dh = zeros + FATOR_AR_LIVRE
+    fator = np.where(alt_m > 0, 0.04192, np.where(alt_m < 0, 0.08384, 0.)) #Como em correcao_bouguer
+    dcb_dh = fator*densidade if bouguer else zeros
+    dcb_drho = fator*alt_m if bouguer else zeros
+
+    var_h = ç['altitude']**2
+    var_rho = ç['densidade']**2
+    var_pos = ç['posicao']**2
+    saida = {'g_teor': {'posicao': dgteor_dpos**2*var_pos},
+             'ca': {'altitude': dca_dh**2*var_h},
+             'cb': {'altitude': dcb_dh**2*var_h, 'densidade': dcb_drho**2*var_rho}}
+    if free_air:
+        saida['g_ca'] = dict(var_gabs, altitude=dca_dh**2*var_h, posicao=dgteor_dpos**2*var_pos)
+    else:
+        saida['g_ca'] = {}
+    if bouguer:
+        saida['g_cb'] = dict(var_gabs, altitude=(dca_dh - dcb_dh)**2*var_h, densidade=dcb_drho**2*var_rho,
+                             posicao=dgteor_dpos**2*var_pos)
+    else:
+        saida['g_cb'] = {}
+    return saida
+
+
+def propagar(resultados, params, incertezas=None, rede=False):
+    """
+    Analytic (first-order) propagation for the results of a reduction.
+    For a single loop the whole chain is propagated from the columns
+    'g_cls' and 'delta_t'; after a network adjustment (rede=True) the
+    'ç_gabs' of the adjustment is taken as one input, 'rede'. Returns
+    {quantity: {input: variance array}}.
+    """
+    if rede:
+        saida = {'g_abs': {'rede': np.asarray(resultados['ç_gabs'], dtype=np.float64)**2}}
+    else:
+        saida = contribuicoes_circuito(resultados['g_cls'], resultados['delta_t'], incertezas)
+    sen2_lat = resultados.get('sen2_lat')
+    if sen2_lat is None:
+        sen2_lat = seno2(resultados['Lat_graus_dec'])
+    saida.update(contribuicoes_anomalias(saida['g_abs'], resultados['alt_m'], sen2_lat, params, incertezas))
+    return saida
+
+
+def desvios(contribuicoes):
+    """
+    Standard deviation of each quantity, from the variances per input.
+    """
+    return {q: np.sqrt(sum(v.values())) if v else 0. for q, v in contribuicoes.items()}
+
+
+def dominantes(contribuicoes, quantidade='g_cb'):
+    """
+    Input with the largest variance for each station, and its share of
+    the total variance of quantidade (0 to 1).
+    """
+    entradas = list(contribuicoes[quantidade])
+    variancias = np.array([contribuicoes[quantidade][e] for e in entradas])
+    total = variancias.sum(axis=0)
+    k = variancias.argmax(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fracao = np.where(total > 0, variancias.max(axis=0)/total, 0.)
+    return np.array(entradas, dtype=object)[k], fracao
+
+
+def monte_carlo(resultados, params, incertezas=None, n=1000, semente=None, bloco=250):
+    """
+    Monte Carlo propagation for a single-loop reduction: n perturbed
+    realisations of every input are reduced together as (realisations x
+    stations) arrays, bloco realisations at a time to bound the memory.
+    Returns the standard deviation of each quantity of QUANTIDADES (an
+    array per station).
+    """
+    ç = _incertezas(incertezas)
+    rng = np.random.default_rng(semente)
+    g_cls = np.asarray(resultados['g_cls'], dtype=np.float64)
+    delta_t = np.asarray(resultados['delta_t'], dtype=np.float64)
+    alt_m = np.asarray(resultados['alt_m'], dtype=np.float64)
+    lat = np.asarray(resultados['Lat_graus_dec'], dtype=np.float64)
+    m = len(g_cls)
+    densidade = float(params.get('densidade', 2.67))
+    g_ref = float(params.get('g_ref', 0.))
+    elipsoide = params.get('elipsoide', 'grs84')
+    formula = params.get('formula_normal') or None
+    free_air = int(params.get('free_air', 1))
+    bouguer = int(params.get('bouguer', 1))
+    segunda_ordem = int(params.get('ar_livre_2a_ordem', 0))
+
+    def ruido(desvio, forma):
+        return rng.normal(0., desvio, forma) if desvio else 0.
+
+    def reduzir(k, ç):
+        #k realizações da cadeia inteira
+        forma = (k, m)
+        g = (g_cls + ruido(ç['leitura'], forma) + FATOR_AR_LIVRE*ruido(ç['altura_instrumental'], forma)
+             + ruido(ç['mare'], forma))*np.ones(forma)
+        t = delta_t + ruido(ç['tempo'], forma)*np.ones(forma)
+        u = (t - t[:, :1])/(t[:, -1:] - t[:, :1])
+        cd = -(g[:, -1:] - g[:, :1])*u
+        g_cd = g + cd
+        g_abs = g_ref + ruido(ç['g_ref'], (forma[0], 1)) + g_cd - g_cd[:, :1]
+        h = alt_m + ruido(ç['altitude'], forma)
+        rho = densidade + ruido(ç['densidade'], (forma[0], 1))
+        s = seno2(lat + np.degrees(ruido(ç['posicao'], forma)/RAIO_TERRA))
+        g_teor = gravidade_normal(s, elipsoide, formula=formula)*np.ones(forma)
+        if not free_air:
+            ca = np.zeros(forma)
+        elif segunda_ordem:
+            ca = g_teor - gravidade_normal(s, elipsoide, h, formula)
+        else:
+            ca = FATOR_AR_LIVRE*h*np.ones(forma)
+        cb = correcao_bouguer(h*np.ones(forma), rho)[0] if bouguer else np.zeros(forma)
+        g_ca = g_abs + ca - g_teor if free_air else np.zeros(forma)
+        g_cb = g_abs + ca - cb - g_teor if bouguer else np.zeros(forma)
+        return {'cd': cd, 'g_cd': g_cd, 'g_abs': g_abs, 'g_teor': g_teor, 'ca': ca, 'cb': cb,
+                'g_ca': g_ca, 'g_cb': g_cb}
+
+    #Desvios em torno dos valores nominais, para não perder precisão em g ~ 978000 mGal
+    nominal = {q: v[0] for q, v in reduzir(1, dict.fromkeys(ç, 0.)).items()}
+    soma = {q: np.zeros(m) for q in QUANTIDADES}
+    soma2 = {q: np.zeros(m) for q in QUANTIDADES}
+    for inicio in range(0, n, bloco):
+        realizacoes = reduzir(min(bloco, n - inicio), ç)
+        for q in QUANTIDADES:
+            d = realizacoes[q] - nominal[q]
+            soma[q] += d.sum(axis=0)
+            soma2[q] += (d*d).sum(axis=0)
+    return {q: np.sqrt(np.maximum(soma2[q]/n - (soma[q]/n)**2, 0.)*n/max(n - 1, 1)) for q in QUANTIDADES}
+
+
+def tabela_de_incertezas(resultados, params, incertezas=None, n_monte_carlo=0, semente=None, dec=4, rede=False):
+    """
+    Per-station uncertainty report: the analytic standard deviation of
+    g_abs, g_ca and g_cb, the input that dominates the uncertainty of g_cb
+    (or of g_abs when there is no Bouguer anomaly) with its share of the
+    variance, and, with n_monte_carlo realisations, the Monte Carlo
+    standard deviations for comparison (single loop only).
+    """
+    import pandas as pd
+    contribuicoes = propagar(resultados, params, incertezas, rede)
+    ç_analitico = desvios(contribuicoes)
+    quantidade = 'g_cb' if contribuicoes['g_cb'] else 'g_abs'
+    entrada, fracao = dominantes(contribuicoes, quantidade)
+    n = len(resultados['ponto'])
+    tabela = {'00_Pt': np.asarray(resultados['ponto'])}
+    for k, q in enumerate(('g_abs', 'g_ca', 'g_cb'), start=1):
+        tabela['%02d_ç.%s' % (k, q)] = np.around(np.broadcast_to(ç_analitico[q], (n,)), dec)
+    tabela['04_Dominante'] = entrada
+    tabela['05_Fracao'] = np.around(fracao, 3)
+    if n_monte_carlo:
+        ç_mc = monte_carlo(resultados, params, incertezas, n_monte_carlo, semente)
+        for k, q in enumerate(('g_abs', 'g_ca', 'g_cb'), start=6):
+            tabela['%02d_ç.MC.%s' % (k, q)] = np.around(ç_mc[q], dec)
+    return pd.DataFrame(tabela)
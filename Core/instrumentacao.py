@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import io
+import json
+import time
+import logging
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+#--------------------------------------------------
+#Medição de tempo e memória por etapa da redução
+#--------------------------------------------------
+'''
+Cada etapa da redução (ingestão, conversão, altura instrumental, maré,
+deriva, g absoluto, gravidade normal, anomalias e saída) pode ser medida
+com with etapa(instrumentacao, 'nome', linhas). Sem instrumentação (None)
+nada é medido e o custo é desprezível. Opcionalmente o tracemalloc mede o
+pico de memória de cada etapa e o cProfile perfila a redução inteira. O
+início e o fim de cada etapa (e o avanço das etapas longas) podem ser
+enviados a uma função, e a redução pode ser cancelada entre etapas, como
+faz a GUI ao reduzir numa thread.
+----------------------------
+Each reduction stage (ingestion, conversion, instrument height, tide,
+drift, absolute g, normal gravity, anomalies and output) can be measured
+with with etapa(instrumentacao, 'name', rows). Without instrumentation
+(None) nothing is measured and the cost is negligible. Optionally
+tracemalloc measures the peak memory of each stage and cProfile profiles
+the whole reduction. The start and end of each stage (and the progress of
+long stages) can be sent to a function, and the reduction can be cancelled
+between stages, as the GUI does when reducing in a thread.
+'''
+
+log = logging.getLogger('grared')
+
+
+class ReducaoCancelada(Exception):
+    """
+    Raised at the start of a stage (or at a progress report) once the
+    reduction was cancelled.
+    """
+
+
+class Instrumentacao:
+    """
+    Records wall time, rows processed and, with memoria=True, the peak
+    traced memory of each stage above what was allocated when it started. With perfil=True the outermost stages run
+    under cProfile. Stages may be nested and repeated (e.g. once per block
+    of a streamed file); relatorio() lists every record and the totals per
+    stage name. The record of a stage is yielded by etapa(), so its rows
+    can be filled in once they are known.
+
+    ao_progresso, when given, is called with one dictionary per event:
+    {'evento': 'inicio' or 'fim', 'etapa', 'nivel', 'linhas'} (plus
+    'tempo_s' at the end) and {'evento': 'parcial', 'etapa', 'feitos',
+    'total'} from progresso(). cancelamento is an object with is_set()
+    (e.g. threading.Event); once it is set the next stage or progress
+    report raises ReducaoCancelada.
+
+    Stages may run at the same time in several threads (pipeline.py): the
+    nesting level is kept per thread (a context variable, so a stage run
+    with contextvars.copy_context() nests under the stage that started
+    it) and the records are appended under a lock. The memory and profile
+    measurements are global to the process, so with memoria or perfil the
+    stages must run one at a time (see medicao_global).
+    """
+
+    def __init__(self, memoria=False, perfil=False, log_etapas=True, ao_progresso=None, cancelamento=None):
+        self.memoria = memoria
+        if perfil:
+            import cProfile #Só quando pedido: o cProfile e o pstats pesam no início de cada processo
+            self.perfil = cProfile.Profile()
+        else:
+            self.perfil = None
+        self.log_etapas = log_etapas
+        self.ao_progresso = ao_progresso
+        self.cancelamento = cancelamento
+        self.registros = []
+        self._picos = [] #[pico já observado, memória no início] de cada etapa aberta
+        self._nivel = contextvars.ContextVar('nivel', default=0) #Próprio de cada thread
+        self._trava = threading.Lock()
+        self._iniciou_tracemalloc = False
+
+    @property
+    def medicao_global(self):
+        """
+        True when tracemalloc or cProfile is on: both measure the whole
+        process, so the stages cannot overlap.
+        """
+        return self.memoria or self.perfil is not None
+
+    def verificar_cancelamento(self):
+        if self.cancelamento is not None and self.cancelamento.is_set():
+            raise ReducaoCancelada('Redução cancelada')
+
+    def progresso(self, nome, feitos, total):
+        """
+        Reports that feitos of total items of stage nome are done, and
+        checks for cancellation.
+        """
+        self.verificar_cancelamento()
+        if self.ao_progresso is not None:
+            self.ao_progresso({'evento': 'parcial', 'etapa': nome, 'feitos': feitos, 'total': total})
+
+    @contextmanager
+    def etapa(self, nome, linhas=None):
+        self.verificar_cancelamento()
+        nivel = self._nivel.get()
+        if self.ao_progresso is not None:
+            self.ao_progresso({'evento': 'inicio', 'etapa': nome, 'nivel': nivel, 'linhas': linhas})
+        if nivel == 0:
+            if self.memoria and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._iniciou_tracemalloc = True
+            if self.perfil is not None:
+                self.perfil.enable()
+        if self.memoria:
+            atual, pico = tracemalloc.get_traced_memory()
+            if self._picos: #O pico da etapa externa é guardado antes de zerar
+                self._picos[-1][0] = max(self._picos[-1][0], pico)
+            tracemalloc.reset_peak()
+            self._picos.append([atual, atual])
+        registro = {'etapa': nome, 'nivel': nivel, 'tempo_s': None, 'linhas': linhas}
+        ficha = self._nivel.set(nivel + 1)
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            duracao = time.perf_counter() - inicio
+            self._nivel.reset(ficha)
+            registro['tempo_s'] = duracao
+            if registro['linhas'] is not None:
+                registro['linhas'] = linhas = int(registro['linhas'])
+            if self.memoria:
+                pico, inicial = self._picos.pop()
+                pico = max(pico, tracemalloc.get_traced_memory()[1])
+                registro['pico_memoria_mb'] = (pico - inicial)/2**20
+                if self._picos:
+                    self._picos[-1][0] = max(self._picos[-1][0], pico)
+            with self._trava:
+                self.registros.append(registro)
+            if self.ao_progresso is not None:
+                self.ao_progresso(dict(registro, evento='fim'))
+            if self.log_etapas:
+                log.info('%s%s: %.4f s%s%s', '  '*nivel, nome, duracao,
+                         '' if linhas is None else ', %d linhas' % linhas,
+                         ', pico %.1f MB' % registro['pico_memoria_mb'] if self.memoria else '')
+            if nivel == 0:
+                if self.perfil is not None:
+                    self.perfil.disable()
+                if self._iniciou_tracemalloc:
+                    tracemalloc.stop()
+                    self._iniciou_tracemalloc = False
+
+    def totais(self):
+        """
+        Total time, rows and largest peak memory per stage name, in the
+        order the stages first appeared.
+        """
+        totais = {}
+        with self._trava:
+            registros = list(self.registros)
+        for r in registros:
+            t = totais.setdefault(r['etapa'], {'etapa': r['etapa'], 'chamadas': 0, 'tempo_s': 0., 'linhas': None})
+            t['chamadas'] += 1
+            t['tempo_s'] += r['tempo_s']
+            if r['linhas'] is not None:
+                t['linhas'] = (t['linhas'] or 0) + r['linhas']
+            if 'pico_memoria_mb' in r:
+                t['pico_memoria_mb'] = max(t.get('pico_memoria_mb', 0.), r['pico_memoria_mb'])
+        return list(totais.values())
+
+    def texto_perfil(self, linhas=30, ordem='cumulative'):
+        """
+        The cProfile statistics of the profiled stages as text, or None when
+        profiling is off.
+        """
+        if self.perfil is None:
+            return None
+        import pstats
+        texto = io.StringIO()
+        pstats.Stats(self.perfil, stream=texto).sort_stats(ordem).print_stats(linhas)
+        return texto.getvalue()
+
+    def salvar_perfil(self, caminho):
+        """
+        Saves the raw cProfile statistics (for pstats, snakeviz, ...).
+        """
+        if self.perfil is not None:
+            self.perfil.dump_stats(caminho)
+
+    def relatorio(self, **metadados):
+        """
+        Structured report: the extra metadados, every stage record, the
+        totals per stage and the profile text when profiling is on.
+        """
+        with self._trava:
+            registros = list(self.registros)
+        relatorio = dict(metadados, etapas=registros, totais=self.totais())
+        if self.perfil is not None:
+            relatorio['perfil'] = self.texto_perfil()
+        return relatorio
+
+    def salvar_json(self, caminho, **metadados):
+        with open(caminho, 'w', encoding='utf-8') as arq:
+            json.dump(self.relatorio(**metadados), arq, indent=1, ensure_ascii=False)
+
+
+def etapa(instrumentacao, nome, linhas=None):
+    """
+    Context manager that measures one stage with instrumentacao, or does
+    nothing when it is None. It yields the stage record (a throwaway
+    dictionary without instrumentation).
+    """
+    if instrumentacao is None:
+        return nullcontext({})
+    return instrumentacao.etapa(nome, linhas)
+
+
+def progresso(instrumentacao, nome, feitos, total):
+    """
+    Progress report of a long stage through instrumentacao (see
+    Instrumentacao.progresso); does nothing when it is None.
+    """
+    if instrumentacao is not None:
+        instrumentacao.progresso(nome, feitos, total)
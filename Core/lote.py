@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import traceback
+import numpy as np
+from reducao import (ler_levantamento, reduce_survey, reduzir_txt_em_blocos, escrever_saida,
+                     corrigir_leituras, corrigir_leituras_em_blocos, corrigir_anomalias)
+from instrumentacao import Instrumentacao, etapa
+from ajuste import ajustar_rede
+from armazem import reduzir_com_armazem
+from terreno import corrigir_terreno, ModeloDigitalElevacao
+from grade import gradear_resultados
+from incertezas import tabela_de_incertezas
+from saida import conferir_saida
+
+#--------------------------------------------------
+#Redução em lote de vários circuitos, em paralelo
+#--------------------------------------------------
+'''
+Cada arquivo (circuito) é reduzido por um processo do pool. A tabela de
+conversão é lida uma única vez pelo processo principal e enviada a cada
+processo trabalhador apenas na sua inicialização. Os MDEs vão nas tarefas
+só pelo caminho e cada trabalhador os lê uma única vez, ao iniciar.
+----------------------------
+Each file (loop) is reduced by one process of the pool. The conversion
+table is read once by the main process and sent to each worker process
+only when it starts. DEMs go in the tasks by path only, and each worker
+reads them once, when it starts.
+'''
+
+_tabela_trabalhador = None #Tabela de conversão do processo trabalhador
+_mdes_trabalhador = {} #MDEs do processo trabalhador, por caminho
+
+
+def _iniciar_trabalhador(tabela, caminhos_mde=()):
+    global _tabela_trabalhador, _mdes_trabalhador
+    _tabela_trabalhador = tabela
+    _mdes_trabalhador = {c: ModeloDigitalElevacao.carregar(c) for c in caminhos_mde}
+
+
+def _caminhos_mde(tarefas):
+    #MDEs dados por caminho nas tarefas, cada um uma vez
+    return tuple(sorted(set(t['mde'] for t in tarefas if isinstance(t.get('mde'), str))))
+
+
+def _mde_da_tarefa(tarefa):
+    #O MDE já lido pelo trabalhador, quando a tarefa traz o caminho
+    mde = tarefa.get('mde')
+    return _mdes_trabalhador.get(mde, mde) if isinstance(mde, str) else mde
+
+
+def reduzir_arquivo(nome_arquivo, tabela, parametros, tipo_arquivo='excel', aba='Plan1',
+                    saida_txt=None, saida_excel=None, retornar_resultados=True, linhas_por_bloco=None,
+                    saida_colunar=None, conv=None, instrumentar=None, armazem=None, mde=None,
+                    raio_terreno=10000., processos_terreno=1, saida_incertezas=None, incertezas=None,
+                    monte_carlo=0, saidas=None, grade=None):
+    """
+    Reads, reduces and writes one survey file. DAT/TXT files are streamed in
+    blocks when linhas_por_bloco is given; conv is the name of the
+    conversion workbook, recorded in the DAT/TXT header. instrumentar turns
+    on the per-stage measurements: True, or a dictionary of options of
+    instrumentacao.Instrumentacao (e.g. {'memoria': True, 'perfil': True}).
+    Returns a dictionary with the file name, the number of readings, the
+    results (or None when retornar_resultados is False), the error message
+    (None on success) and the stage report (None without instrumentar).
+    With armazem (a folder, or '' for the default one) the stages whose
+    input and parameters did not change are reused from the on-disk store
+    of armazem.py. With mde (a DEM file or terreno.ModeloDigitalElevacao)
+    the terrain correction up to raio_terreno metres is added, computed in
+    processos_terreno worker processes. saida_incertezas is a tab separated
+    report of the uncertainty of each station (incertezas.py), for the
+    input uncertainties incertezas and, when monte_carlo > 0, with that
+    many Monte Carlo realisations; incertezas also sets the ç_* columns of
+    the outputs, so that both agree. saidas restricts the reduction to the
+    stages needed for those columns (see correcoes.py); it cannot be
+    combined with armazem, linhas_por_bloco or saida_incertezas. grade is a
+    dictionary of options of grade.gradear_resultados (caminho, coluna,
+    metodo, passo, ...) that grids the reduced stations. Errors are caught
+    so that one bad file does not stop a batch.
+    """
+    instrumentacao = None
+    if instrumentar:
+        instrumentacao = Instrumentacao(**(instrumentar if isinstance(instrumentar, dict) else {}))
+    if incertezas:
+        parametros = dict(parametros, incertezas=incertezas) #As colunas ç_* e o relatório usam as mesmas
+    try:
+        if saida_colunar:
+            conferir_saida(saida_colunar) #Falha antes de reduzir e de escrever as outras saídas
+        with etapa(instrumentacao, 'reducao') as registro:
+            if saidas and (armazem is not None or linhas_por_bloco or saida_incertezas):
+                raise ValueError('saidas não pode ser usado com armazem, linhas_por_bloco ou saida_incertezas')
+            if saidas:
+                leituras = ler_levantamento(nome_arquivo, tipo_arquivo, aba, instrumentacao, tabela, parametros)
+                resultados = reduce_survey(leituras, tabela, dict(parametros, raio_terreno=raio_terreno,
+                                                                  processos_terreno=processos_terreno),
+                                           instrumentacao, saidas=saidas, mde=mde)
+            elif armazem is not None:
+                resultados = reduzir_com_armazem(nome_arquivo, tabela, parametros, tipo_arquivo, aba, armazem or None,
+                                                 linhas_por_bloco, instrumentacao)
+            elif tipo_arquivo == 'txt' and linhas_por_bloco:
+                resultados = reduzir_txt_em_blocos(nome_arquivo, tabela, parametros, linhas_por_bloco, instrumentacao)
+            else:
+                leituras = ler_levantamento(nome_arquivo, tipo_arquivo, aba, instrumentacao, tabela, parametros)
+                resultados = reduce_survey(leituras, tabela, parametros, instrumentacao)
+            if mde is not None and not saidas:
+                with etapa(instrumentacao, 'terreno', len(resultados['ponto'])):
+                    resultados = dict(resultados, **corrigir_terreno(resultados, mde, parametros, raio_terreno,
+                                                                     processos_terreno, instrumentacao,
+                                                                     incertezas))
+            if grade:
+                with etapa(instrumentacao, 'grade', len(resultados['ponto'])):
+                    gradear_resultados(resultados, instrumentacao=instrumentacao, **grade)
+            metadados = dict(parametros, entrada=nome_arquivo, tipo=tipo_arquivo, aba=aba,
+                             conv=conv or '', grav=getattr(tabela, 'grav', ''))
+            escrever_saida(resultados, saida_txt, saida_excel, metadados=metadados, saida_colunar=saida_colunar,
+                           instrumentacao=instrumentacao)
+            if saida_incertezas:
+                with etapa(instrumentacao, 'incertezas', len(resultados['ponto'])):
+                    tabela_de_incertezas(resultados, parametros, incertezas, monte_carlo).to_csv(
+                        saida_incertezas, sep='\t', index=False)
+            registro['linhas'] = len(resultados['ponto'])
+    except Exception as erro:
+        return {'arquivo': nome_arquivo, 'leituras': 0, 'resultados': None,
+                'erro': '%s: %s' % (type(erro).__name__, erro),
+                'traceback': traceback.format_exc(),
+                'etapas': instrumentacao and instrumentacao.relatorio(arquivo=nome_arquivo)}
+    return {'arquivo': nome_arquivo, 'leituras': len(resultados['ponto']),
+            'resultados': resultados if retornar_resultados else None,
+            'erro': None, 'traceback': None,
+            'etapas': instrumentacao and instrumentacao.relatorio(arquivo=nome_arquivo)}
+
+
+def _reduzir_no_trabalhador(tarefa, parametros, retornar_resultados, instrumentar):
+    return reduzir_arquivo(tarefa['arquivo'], _tabela_trabalhador, parametros,
+                           tarefa.get('tipo', 'excel'), tarefa.get('aba', 'Plan1'),
+                           tarefa.get('saida_txt'), tarefa.get('saida_excel'), retornar_resultados,
+                           tarefa.get('linhas_por_bloco'), tarefa.get('saida_colunar'), tarefa.get('conv'),
+                           instrumentar, tarefa.get('armazem'), _mde_da_tarefa(tarefa),
+                           tarefa.get('raio_terreno', 10000.), tarefa.get('processos_terreno', 1),
+                           tarefa.get('saida_incertezas'), tarefa.get('incertezas'), tarefa.get('monte_carlo', 0),
+                           tarefa.get('saidas'), tarefa.get('grade'))
+
+
+def reduzir_lote(tarefas, tabela, parametros, n_processos=None, retornar_resultados=True, instrumentar=None):
+    """
+    Reduces many survey files. tarefas is a list of dictionaries with the
+    keys 'arquivo' and, optionally, 'tipo', 'aba', 'saida_txt',
+    'saida_excel', 'saida_colunar', 'conv', 'linhas_por_bloco', 'armazem',
+    'mde', 'raio_terreno', 'processos_terreno', 'saida_incertezas',
+    'incertezas', 'monte_carlo', 'saidas' and 'grade'. 'mde' should be the
+    path of the DEM, which each worker reads once when it starts, rather
+    than a loaded ModeloDigitalElevacao, which would be copied to the
+    workers with every task. n_processos is the number of worker processes (None uses
+    every core, 1 runs everything in the current process). instrumentar is passed to
+    reduzir_arquivo for every file. Returns one result dictionary per task
+    (see reduzir_arquivo), in the input order.
+    """
+    if n_processos is None:
+        n_processos = os.cpu_count() or 1
+    n_processos = max(1, min(n_processos, len(tarefas)))
+
+    if n_processos == 1:
+        _iniciar_trabalhador(tabela, _caminhos_mde(tarefas))
+        return [_reduzir_no_trabalhador(t, parametros, retornar_resultados, instrumentar) for t in tarefas]
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed #O multiprocessing só é carregado quando usado
+    saida = [None]*len(tarefas)
+    with ProcessPoolExecutor(max_workers=n_processos, initializer=_iniciar_trabalhador,
+                             initargs=(tabela, _caminhos_mde(tarefas))) as pool:
+        futuros = {pool.submit(_reduzir_no_trabalhador, t, parametros, retornar_resultados, instrumentar): k
+                   for k, t in enumerate(tarefas)}
+        for futuro in as_completed(futuros):
+            k = futuros[futuro]
+            try:
+                saida[k] = futuro.result()
+            except Exception as erro: #Falha do próprio processo trabalhador
+                saida[k] = {'arquivo': tarefas[k]['arquivo'], 'leituras': 0, 'resultados': None,
+                            'erro': '%s: %s' % (type(erro).__name__, erro), 'traceback': None,
+                            'etapas': None}
+    return saida
+
+
+def _corrigir_leituras_no_trabalhador(tarefa, parametros):
+    #Etapa por leitura de um circuito da rede; o ajuste roda no processo principal
+    try:
+        if tarefa.get('tipo', 'excel') == 'txt' and tarefa.get('linhas_por_bloco'):
+            parciais = corrigir_leituras_em_blocos(tarefa['arquivo'], _tabela_trabalhador, parametros,
+                                                   tarefa['linhas_por_bloco'])
+        else:
+            leituras = ler_levantamento(tarefa['arquivo'], tarefa.get('tipo', 'excel'), tarefa.get('aba', 'Plan1'),
+                                        tabela=_tabela_trabalhador, params=parametros)
+            parciais = corrigir_leituras(leituras, _tabela_trabalhador, parametros)
+    except Exception as erro:
+        return None, '%s: %s' % (type(erro).__name__, erro)
+    return parciais, None
+
+
+def reduzir_rede(tarefas, tabela, parametros, bases=None, grau_deriva=1, ç_leitura=0.5, n_processos=None,
+                 retornar_resultados=True):
+    """
+    Reduces many survey files as one network: every file is a loop, and
+    the drift of all loops, the gravity of the repeated stations and the
+    tares are adjusted together by ajuste.ajustar_rede instead of the
+    single-loop linear drift. bases maps station -> gravity (or (gravity,
+    uncertainty)); by default the first point of the first file gets
+    parametros['g_ref']. A task may list in 'taras' the row indices of the
+    file where the gravimeter had a tare. The per-reading stage runs in
+    n_processos worker processes, as in reduzir_lote.
+
+    Returns (rede, saida): the network solution of ajustar_rede, and one
+    result dictionary per task as in reduzir_lote. Files that cannot be
+    read are reported with their error and left out of the network.
+    """
+    for t in tarefas: #Uma saída colunar impossível falha antes do ajuste e de qualquer escrita
+        if t.get('saida_colunar'):
+            conferir_saida(t['saida_colunar'])
+    if n_processos is None:
+        n_processos = os.cpu_count() or 1
+    n_processos = max(1, min(n_processos, len(tarefas)))
+    if n_processos == 1:
+        _iniciar_trabalhador(tabela)
+        lidos = [_corrigir_leituras_no_trabalhador(t, parametros) for t in tarefas]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_processos, initializer=_iniciar_trabalhador,
+                                 initargs=(tabela,)) as pool:
+            lidos = list(pool.map(_corrigir_leituras_no_trabalhador, tarefas, [parametros]*len(tarefas)))
+
+    saida = [{'arquivo': t['arquivo'], 'leituras': 0, 'resultados': None, 'erro': erro,
+              'traceback': None, 'etapas': None} for t, (_, erro) in zip(tarefas, lidos)]
+    validos = [k for k, (parciais, _) in enumerate(lidos) if parciais is not None]
+    if not validos:
+        raise ValueError('Nenhum circuito da rede pôde ser lido')
+    parciais = [lidos[k][0] for k in validos]
+    tamanhos = [len(p['ponto']) for p in parciais]
+    juntos = {c: np.concatenate([p[c] for p in parciais]) for c in ('ponto', 'g_cls', 'hora_dec')}
+    circuito = np.repeat(np.arange(len(parciais)), tamanhos)
+    tara = np.zeros(len(circuito), dtype=bool)
+    for k, inicio in zip(validos, np.cumsum([0] + tamanhos[:-1])):
+        tara[inicio + np.asarray(tarefas[k].get('taras', ()), dtype=np.intp)] = True
+    if not bases:
+        bases = {parciais[0]['ponto'][0]: float(parametros.get('g_ref', 0.))}
+    #O terreno roda no processo principal: cada MDE dado por caminho é lido uma única vez
+    mdes = {c: ModeloDigitalElevacao.carregar(c) for c in _caminhos_mde([tarefas[k] for k in validos])}
+
+    rede = ajustar_rede(juntos['ponto'], juntos['g_cls'], juntos['hora_dec'], circuito, bases,
+                        ç_leitura, grau_deriva, tara)
+
+    for k, p, partes in zip(validos, parciais, np.split(np.arange(len(circuito)), np.cumsum(tamanhos)[:-1])):
+        tarefa = tarefas[k]
+        resultados = dict(p)
+        resultados.update({c: rede[c][partes] for c in ('cd', 'g_cd', 'g_abs', 'ç_cd', 'ç_gabs')})
+        resultados['delta_t'] = p['hora_dec'] - p['hora_dec'][0]
+        resultados['ç_gcls'] = np.broadcast_to(np.asarray(ç_leitura, dtype=np.float64), (len(circuito),))[partes]
+        resultados['ç_gcd'] = (resultados['ç_gcls']**2 + resultados['ç_cd']**2)**0.5
+        try:
+            resultados.update(corrigir_anomalias(resultados, dict(parametros, incertezas=tarefa.get('incertezas')
+                                                                  or parametros.get('incertezas'))))
+            if tarefa.get('mde') is not None:
+                resultados.update(corrigir_terreno(resultados, mdes.get(tarefa['mde'], tarefa['mde']), parametros,
+                                                   tarefa.get('raio_terreno', 10000.),
+                                                   incertezas=tarefa.get('incertezas')))
+            metadados = dict(parametros, entrada=tarefa['arquivo'], tipo=tarefa.get('tipo', 'excel'),
+                             aba=tarefa.get('aba', 'Plan1'), conv=tarefa.get('conv') or '',
+                             grav=getattr(tabela, 'grav', ''))
+            escrever_saida(resultados, tarefa.get('saida_txt'), tarefa.get('saida_excel'), metadados=metadados,
+                           saida_colunar=tarefa.get('saida_colunar'))
+            if tarefa.get('saida_incertezas'):
+                tabela_de_incertezas(resultados, parametros, tarefa.get('incertezas'), rede=True).to_csv(
+                    tarefa['saida_incertezas'], sep='\t', index=False)
+        except Exception as erro:
+            saida[k].update(erro='%s: %s' % (type(erro).__name__, erro), traceback=traceback.format_exc())
+            continue
+        saida[k].update(leituras=len(p['ponto']), resultados=resultados if retornar_resultados else None)
+    return rede, saida
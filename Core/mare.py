@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import threading
+import numpy as np
+from datetime import datetime
+from collections import OrderedDict
+from math import sqrt, atan, asin, acos, sin, cos, radians
+
+#--------------------------------------------------
+#Ambiente Correção de Maré por John Leeman
+#--------------------------------------------------
+# PT----------------------------------------------------------------
+            
+# Código de cálculo de  séculos julianos e  Correção de Maré Terrestre
+# por John Leeman  (contato: <john@leemangeophysical.com> )
+# disponível em: <https://github.com/jrleeman/LongmanTide>
+# Licença: MIT
+# Copyright (c) 2017 John Leeman
+
+
+# EN----------------------------------------------------------------
+
+# Code of calculation of Julian centuries and Earth Tidal Correction
+# by John Leeman  (contact: <john@leemangeophysical.com>  )
+# available at: <https://github.com/jrleeman/LongmanTide>
+# License: MIT
+# Copyright (c) 2017 John Leeman
+
+'''
+Start of Longman Tide function
+----------------------------
+Inicio da função Maré de Longman
+'''           
+
+class EphemerisCache():
+    """
+    Bounded LRU cache of the time-only terms of the Longman formulas, keyed
+    by Julian century. Every station read at the same instant reuses the
+    same row, so the astronomical trigonometry is computed once per unique
+    timestamp. Call clear() to invalidate it explicitly. It can be shared by
+    threads (servico.py): lookups and inserts hold a lock, the missing rows
+    are solved outside it.
+    """
+    fields = ('T', 't0', 's', 'p', 'h', 'N', 'I', 'nu', 'xi', 'l', 'p1', 'e1', 'l1', 'd', 'D')
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._trava = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def clear(self):
+        with self._trava:
+            self._rows.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, T, t0, solve):
+        """
+        Returns the ephemeris dictionary for the arrays T and t0, computing
+        with solve(T, t0) only the timestamps that are not cached yet.
+        """
+        T = np.asarray(T, dtype=np.float64)
+        t0 = np.broadcast_to(np.asarray(t0, dtype=np.float64), T.shape)
+        chaves, pos, inv = np.unique(T.ravel(), return_index=True, return_inverse=True)
+        t0_unico = t0.ravel()[pos]
+        tabela = np.empty((len(chaves), len(self.fields)))
+
+        faltando = []
+        with self._trava:
+            for k, chave in enumerate(chaves.tolist()):
+                linha = self._rows.get(chave)
+                if linha is None:
+                    faltando.append(k)
+                else:
+                    self._rows.move_to_end(chave)
+                    tabela[k] = linha
+            self.hits += len(chaves) - len(faltando)
+            self.misses += len(faltando)
+
+        if faltando:
+            faltando = np.array(faltando)
+            novos = solve(chaves[faltando], t0_unico[faltando])
+            novos = np.column_stack([novos[f] for f in self.fields])
+            tabela[faltando] = novos
+            with self._trava:
+                for chave, linha in zip(chaves[faltando].tolist(), novos):
+                    self._rows[chave] = linha
+                while len(self._rows) > self.maxsize:
+                    self._rows.popitem(last=False)
+
+        return {f: tabela[inv, k].reshape(T.shape) for k, f in enumerate(self.fields)}
+
+
+class TideModel():
+    def __init__(self, ephemeris_cache=None):
+        """
+        ephemeris_cache is an optional EphemerisCache shared between calls
+        of solve_longman_array.
+        """
+        self.ephemeris_cache = ephemeris_cache
+
+    def calculate_julian_century(self, timestamp):
+        """
+        Take a datetime object and returns the decimal Julian century and
+        floating point hour. This is in reference to noon on December 31,
+        1899 as stated in the paper.
+        """
+        origin_date = datetime(1899, 12, 31, 12, 00, 00)  # Noon Dec 31, 1899
+        dt = timestamp - origin_date
+        days = dt.days + dt.seconds/3600./24.
+        return days/36525, timestamp.hour + timestamp.minute/60. + timestamp.second/3600.
+
+    def solve_longman(self, lat, lon, alt, time):
+        """
+        Given the location and datetime object, computes the current
+        gravitational tide and associated quantities. Latitude and longitude
+        and in the traditional decimal notation, altitude is in meters, time
+        is a datetime object.
+        """
+
+        T, t0 = self.calculate_julian_century(time)
+
+        if t0 < 0:
+            t0 += 24.
+        if t0 >= 24:
+            t0 -= 24.
+
+        mu = 6.673e-8  # Newton's gravitational constant
+        M = 7.3537e25  # Mass of the moon in grams
+        S = 1.993e33  # Mass of the sun in grams
+        e = 0.05490  # Eccentricity of the moon's orbit
+        m = 0.074804  # Ratio of mean motion of the sun to that of the moon
+        c = 3.84402e10  # Mean distance between the centers of the earth and the moon
+        c1 = 1.495e13  # Mean distance between centers of the earth and sun in cm
+        h2 = 0.612  # Love parameter
+        k2 = 0.303  # Love parameter
+        a = 6.378270e8  # Earth's equitorial radius in cm
+        i = 0.08979719  # (i) Inclination of the moon's orbit to the ecliptic
+        omega = radians(23.452)  # Inclination of the Earth's equator to the ecliptic 23.452 degrees
+        L = -1 * lon  # For some reason his lat/lon is defined with W as + and E as -
+        lamb = radians(lat)  # (lambda) Latitude of point P
+        H = alt * 100.  # (H) Altitude above sea-level of point P in cm
+
+        # Lunar Calculations
+        # (s) Mean longitude of moon in its orbit reckoned from the referred equinox
+        s = 4.72000889397 + 8399.70927456 * T + 3.45575191895e-05 * T * T + 3.49065850399e-08 * T * T * T
+        # (p) Mean longitude of lunar perigee
+        p = 5.83515162814 + 71.0180412089 * T + 0.000180108282532 * T * T + 1.74532925199e-07 * T * T * T
+        # (h) Mean longitude of the sun
+        h = 4.88162798259 + 628.331950894 * T + 5.23598775598e-06 * T * T
+        # (N) Longitude of the moon's ascending node in its orbit reckoned from the referred equinox
+        N = 4.52360161181 - 33.757146295 * T + 3.6264063347e-05 * T * T +  3.39369576777e-08 * T * T * T
+        # (I) Inclination of the moon's orbit to the equator
+        I = acos(cos(omega)*cos(i) - sin(omega)*sin(i)*cos(N))
+        # (nu) Longitude in the celestial equator of its intersection A with the moon's orbit
+        nu = asin(sin(i)*sin(N)/sin(I))
+        # (t) Hour angle of mean sun measured west-ward from the place of observations
+        t = radians(15. * (t0 - 12) - L)
+
+        # (chi) right ascension of meridian of place of observations reckoned from A
+        chi = t + h - nu
+        # cos(alpha) where alpha is defined in eq. 15 and 16
+        cos_alpha = cos(N)*cos(nu)+sin(N)*sin(nu)*cos(omega)
+        # sin(alpha) where alpha is defined in eq. 15 and 16
+        sin_alpha = sin(omega)*sin(N)/sin(I)
+        # (alpha) alpha is defined in eq. 15 and 16
+        alpha = 2*atan(sin_alpha/(1+cos_alpha))
+        # (xi) Longitude in the moon's orbit of its ascending intersection with the celestial equator
+        xi = N-alpha
+
+        # (sigma) Mean longitude of moon in radians in its orbit reckoned from A
+        sigma = s - xi
+        # (l) Longitude of moon in its orbit reckoned from its ascending intersection with the equator
+        l = sigma + 2*e*sin(s-p)+(5./4)*e*e*sin(2*(s-p)) + (15./4)*m*e*sin(s-2*h+p) + (11./8)*m*m*sin(2*(s-h))
+
+        # Sun
+        # (p1) Mean longitude of solar perigee
+        p1 = 4.90822941839 + 0.0300025492114 * T +  7.85398163397e-06 * T * T + 5.3329504922e-08 * T * T * T
+        # (e1) Eccentricity of the Earth's orbit
+        e1 = 0.01675104-0.00004180*T - 0.000000126*T*T
+        # (chi1) right ascension of meridian of place of observations reckoned from the vernal equinox
+        chi1 = t+h
+        # (l1) Longitude of sun in the ecliptic reckoned from the vernal equinox
+        l1 = h + 2*e1*sin(h-p1)
+        # cosine(theta) Theta represents the zenith angle of the moon
+        cos_theta = sin(lamb)*sin(I)*sin(l) + cos(lamb)*(cos(0.5*I)**2 * cos(l-chi) + sin(0.5*I)**2 * cos(l+chi))
+        # cosine(phi) Phi represents the zenith angle of the run
+        cos_phi = sin(lamb)*sin(omega)*sin(l1) + cos(lamb)*(cos(0.5*omega)**2 * cos(l1-chi1)+sin(0.5*omega)**2*cos(l1+chi1))
+
+        # Distance
+        # (C) Distance parameter, equation 34
+        C = sqrt(1./(1+0.006738*sin(lamb)**2))
+        # (r) Distance from point P to the center of the Earth
+        r = C*a + H
+        # (a') Distance parameter, equation 31
+        aprime = 1./(c*(1-e*e))
+        # (a1') Distance parameter, equation 31
+        aprime1 = 1./(c1*(1-e1*e1))
+        # (d) Distance between centers of the Earth and the moon
+        d = 1./((1./c) + aprime*e*cos(s-p)+aprime*e*e*cos(2*(s-p)) + (15./8)*aprime*m*e*cos(s-2*h+p) + aprime*m*m*cos(2*(s-h)))
+        # (D) Distance between centers of the Earth and the sun
+        D = 1./((1./c1) + aprime1*e1*cos(h-p1))
+
+        # (gm) Vertical componet of tidal acceleration due to the moon
+        gm = (mu*M*r/(d*d*d))*(3*cos_theta**2-1) + (3./2)*(mu*M*r*r/(d*d*d*d))*(5*cos_theta**3 - 3*cos_theta)
+        # (gs) Vertical componet of tidal acceleration due to the sun
+        gs = mu*S*r/(D*D*D) * (3*cos_phi**2-1)
+
+        love = (1+h2-1.5*k2)
+        g0 = (gm+gs)*1e3*love
+        return g0
+
+    def calculate_julian_century_array(self, times):
+        """
+        Vectorized version of calculate_julian_century. Takes an array of
+        datetime64 values (UTC) and returns the decimal Julian centuries and
+        floating point hours, with the same whole-second resolution used by
+        the scalar path.
+        """
+        times = np.asarray(times, dtype='datetime64[s]')
+        origin_date = np.datetime64('1899-12-31T12:00:00', 's')  # Noon Dec 31, 1899
+        seconds = (times - origin_date).astype(np.float64)
+        days = np.floor(seconds/86400.) + np.mod(seconds, 86400.)/3600./24.
+        seconds_of_day = (times - times.astype('datetime64[D]')).astype(np.float64)
+        return days/36525, seconds_of_day/3600.
+
+    def solve_longman_array(self, lat, lon, alt, times):
+        """
+        Vectorized version of solve_longman. Latitude, longitude and altitude
+        are arrays (or scalars) in the same units as the scalar function, and
+        times is either an array of datetime64 values (UTC) or an array of
+        Julian centuries. All inputs are broadcast against each other and the
+        whole tide vector is returned in a single pass.
+        """
+        times = np.asarray(times)
+        if np.issubdtype(times.dtype, np.datetime64):
+            T, t0 = self.calculate_julian_century_array(times)
+        else:
+            T = times.astype(np.float64)
+            # Hora do dia a partir dos séculos julianos (origem ao meio-dia)
+            t0 = np.mod(T*36525 + 0.5, 1.)*24.
+
+        t0 = np.where(t0 < 0, t0 + 24., t0)
+        t0 = np.where(t0 >= 24, t0 - 24., t0)
+
+        if self.ephemeris_cache is None:
+            eph = self.solve_ephemeris_array(T, t0)
+        else:
+            eph = self.ephemeris_cache.get(T, t0, self.solve_ephemeris_array)
+        return self.solve_station_array(eph, lat, lon, alt)
+
+    def solve_ephemeris_array(self, T, t0):
+        """
+        Computes the astronomical terms of the Longman formulas that depend
+        only on time (Julian centuries T and hour t0), for arrays of times.
+        Returns a dictionary of arrays keyed by EphemerisCache.fields.
+        """
+        T = np.asarray(T, dtype=np.float64)
+        e = 0.05490  # Eccentricity of the moon's orbit
+        m = 0.074804  # Ratio of mean motion of the sun to that of the moon
+        c = 3.84402e10  # Mean distance between the centers of the earth and the moon
+        c1 = 1.495e13  # Mean distance between centers of the earth and sun in cm
+        i = 0.08979719  # (i) Inclination of the moon's orbit to the ecliptic
+        omega = radians(23.452)  # Inclination of the Earth's equator to the ecliptic 23.452 degrees
+
+        # Lunar Calculations
+        s = 4.72000889397 + 8399.70927456 * T + 3.45575191895e-05 * T * T + 3.49065850399e-08 * T * T * T
+        p = 5.83515162814 + 71.0180412089 * T + 0.000180108282532 * T * T + 1.74532925199e-07 * T * T * T
+        h = 4.88162798259 + 628.331950894 * T + 5.23598775598e-06 * T * T
+        N = 4.52360161181 - 33.757146295 * T + 3.6264063347e-05 * T * T +  3.39369576777e-08 * T * T * T
+        I = np.arccos(cos(omega)*cos(i) - sin(omega)*sin(i)*np.cos(N))
+        nu = np.arcsin(sin(i)*np.sin(N)/np.sin(I))
+        cos_alpha = np.cos(N)*np.cos(nu)+np.sin(N)*np.sin(nu)*cos(omega)
+        sin_alpha = sin(omega)*np.sin(N)/np.sin(I)
+        alpha = 2*np.arctan(sin_alpha/(1+cos_alpha))
+        xi = N-alpha
+        sigma = s - xi
+        l = sigma + 2*e*np.sin(s-p)+(5./4)*e*e*np.sin(2*(s-p)) + (15./4)*m*e*np.sin(s-2*h+p) + (11./8)*m*m*np.sin(2*(s-h))
+
+        # Sun
+        p1 = 4.90822941839 + 0.0300025492114 * T +  7.85398163397e-06 * T * T + 5.3329504922e-08 * T * T * T
+        e1 = 0.01675104-0.00004180*T - 0.000000126*T*T
+        l1 = h + 2*e1*np.sin(h-p1)
+
+        # Distance
+        aprime = 1./(c*(1-e*e))
+        aprime1 = 1./(c1*(1-e1*e1))
+        d = 1./((1./c) + aprime*e*np.cos(s-p)+aprime*e*e*np.cos(2*(s-p)) + (15./8)*aprime*m*e*np.cos(s-2*h+p) + aprime*m*m*np.cos(2*(s-h)))
+        D = 1./((1./c1) + aprime1*e1*np.cos(h-p1))
+
+        return {'T': T, 't0': np.asarray(t0, dtype=np.float64), 's': s, 'p': p, 'h': h, 'N': N,
+                'I': I, 'nu': nu, 'xi': xi, 'l': l, 'p1': p1, 'e1': e1, 'l1': l1, 'd': d, 'D': D}
+
+    def solve_station_array(self, eph, lat, lon, alt):
+        """
+        Combines the time-only terms returned by solve_ephemeris_array with
+        the station coordinates (same units as solve_longman) and returns the
+        gravitational tide.
+        """
+        mu = 6.673e-8  # Newton's gravitational constant
+        M = 7.3537e25  # Mass of the moon in grams
+        S = 1.993e33  # Mass of the sun in grams
+        h2 = 0.612  # Love parameter
+        k2 = 0.303  # Love parameter
+        a = 6.378270e8  # Earth's equitorial radius in cm
+        omega = radians(23.452)  # Inclination of the Earth's equator to the ecliptic 23.452 degrees
+        L = -1 * np.asarray(lon, dtype=np.float64)  # W as + and E as -, as in the scalar function
+        lamb = np.radians(np.asarray(lat, dtype=np.float64))  # (lambda) Latitude of point P
+        H = np.asarray(alt, dtype=np.float64) * 100.  # (H) Altitude above sea-level of point P in cm
+
+        I, l, l1 = eph['I'], eph['l'], eph['l1']
+        d, D = eph['d'], eph['D']
+        t = np.radians(15. * (eph['t0'] - 12) - L)
+        chi = t + eph['h'] - eph['nu']
+        chi1 = t + eph['h']
+        cos_theta = np.sin(lamb)*np.sin(I)*np.sin(l) + np.cos(lamb)*(np.cos(0.5*I)**2 * np.cos(l-chi) + np.sin(0.5*I)**2 * np.cos(l+chi))
+        cos_phi = np.sin(lamb)*sin(omega)*np.sin(l1) + np.cos(lamb)*(cos(0.5*omega)**2 * np.cos(l1-chi1)+sin(0.5*omega)**2*np.cos(l1+chi1))
+
+        C = np.sqrt(1./(1+0.006738*np.sin(lamb)**2))
+        r = C*a + H
+
+        gm = (mu*M*r/(d*d*d))*(3*cos_theta**2-1) + (3./2)*(mu*M*r*r/(d*d*d*d))*(5*cos_theta**3 - 3*cos_theta)
+        gs = mu*S*r/(D*D*D) * (3*cos_phi**2-1)
+
+        love = (1+h2-1.5*k2)
+        g0 = (gm+gs)*1e3*love
+        return g0
+
+    '''
+    End of Longman Tide function
+    ----------------------------
+    Fim da função Maré de Longman
+    '''
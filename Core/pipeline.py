@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import threading
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from instrumentacao import etapa
+
+#--------------------------------------------------
+#Pipeline de correções com grafo de dependências
+#--------------------------------------------------
+'''
+Cada etapa da redução declara as colunas de que precisa (entradas) e as
+que produz (saídas). Pedidas as saídas desejadas, o pipeline escolhe só as
+etapas necessárias, seguindo as dependências para trás a partir das
+colunas já disponíveis, e executa cada etapa assim que as suas entradas
+ficam prontas; etapas independentes (por exemplo maré e terreno) rodam ao
+mesmo tempo em threads, já que o NumPy libera o GIL nas operações sobre
+arrays. Para acrescentar uma correção basta registrar uma nova etapa (ver
+correcoes.py).
+----------------------------
+Each reduction stage declares the columns it needs (inputs) and the ones
+it produces (outputs). Given the wanted outputs, the pipeline picks only
+the stages needed, following the dependencies backwards from the columns
+already available, and runs each stage as soon as its inputs are ready;
+independent stages (for example tide and terrain) run at the same time in
+threads, since NumPy releases the GIL in array operations. To add a
+correction, just register a new stage (see correcoes.py).
+'''
+
+#entradas é uma tupla de colunas ou uma função dos parâmetros que a retorna (entradas que dependem
+#de uma opção, como a correção atmosférica); funcao(dados, parametros, instrumentacao) retorna um
+#dicionário com as saídas (instrumentacao serve às etapas longas, para o progresso e o cancelamento)
+Etapa = namedtuple('Etapa', 'nome entradas saidas funcao')
+
+#Pools de threads compartilhados por todas as execuções, um por número de threads: criar um pool a cada
+#redução custa mais do que as próprias etapas
+_pools = {}
+_trava_pools = threading.Lock()
+
+
+def _pool(max_threads):
+    with _trava_pools:
+        if max_threads not in _pools:
+            _pools[max_threads] = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='pipeline')
+        return _pools[max_threads]
+
+
+class Pipeline:
+    """
+    Registry of reduction stages and scheduler. Stages are registered with
+    the registrar decorator and run by executar.
+    """
+
+    def __init__(self):
+        self.etapas = {} #Na ordem de registro, que é a ordem de execução sem threads
+
+    def registrar(self, nome, entradas, saidas):
+        """
+        Decorator that registers funcao(dados, parametros, instrumentacao)
+        as the stage nome.
+        A stage registered again with the same name replaces the old one.
+        """
+        def decorador(funcao):
+            self.etapas[nome] = Etapa(nome, entradas, tuple(saidas), funcao)
+            return funcao
+        return decorador
+
+    def entradas(self, etapa, parametros):
+        return tuple(etapa.entradas(parametros) if callable(etapa.entradas) else etapa.entradas)
+
+    def planejar(self, saidas, disponiveis, parametros):
+        """
+        Stages needed to produce saidas from the columns disponiveis, in
+        registration order. Raises ValueError naming the columns that no
+        stage produces, or a dependency cycle.
+        """
+        produtor = {}
+        for e in self.etapas.values():
+            for s in e.saidas:
+                produtor.setdefault(s, e)
+        escolhidas = {}
+        faltando = []
+        pendentes = [s for s in saidas if s not in disponiveis]
+        while pendentes:
+            s = pendentes.pop()
+            e = produtor.get(s)
+            if e is None:
+                faltando.append(s)
+            elif e.nome not in escolhidas:
+                escolhidas[e.nome] = e
+                pendentes.extend(x for x in self.entradas(e, parametros) if x not in disponiveis)
+        if faltando:
+            raise ValueError('Nenhuma etapa produz %s (colunas disponíveis: %s)'
+                             % (', '.join(sorted(set(faltando))), ', '.join(sorted(disponiveis))))
+        plano = [e for e in self.etapas.values() if e.nome in escolhidas]
+        #Confere que não há ciclo: cada etapa deve ficar pronta depois das anteriores
+        prontas = set(disponiveis)
+        restantes = list(plano)
+        while restantes:
+            rodaveis = [e for e in restantes if set(self.entradas(e, parametros)) <= prontas]
+            if not rodaveis:
+                raise ValueError('Dependência circular entre as etapas %s' % ', '.join(e.nome for e in restantes))
+            for e in rodaveis:
+                restantes.remove(e)
+                prontas.update(e.saidas)
+        return plano
+
+    def executar(self, dados, saidas, parametros, instrumentacao=None, max_threads=None):
+        """
+        Runs the stages needed for saidas over dados (dictionary of
+        columns, not modified) and returns dados plus every column
+        produced. Stages whose inputs are ready run at the same time in up
+        to max_threads threads of a pool shared by every call (1 runs them
+        one by one, in registration order). Each stage runs in a copy of
+        the caller's context, so with instrumentacao it nests under the
+        caller's stage; when instrumentacao measures memory or profiles
+        (medicao_global), the stages run one by one.
+        """
+        dados = dict(dados)
+        plano = self.planejar(saidas, dados, parametros)
+        linhas = len(dados['ponto']) if 'ponto' in dados else None
+        sequencial = (max_threads == 1 or len(plano) < 2
+                      or (instrumentacao is not None and instrumentacao.medicao_global))
+
+        def rodar(e):
+            with etapa(instrumentacao, e.nome, linhas):
+                return e.funcao(dados, parametros, instrumentacao)
+
+        def prontas(pendentes, rodando):
+            #Entradas disponíveis e que nenhuma etapa ainda por rodar vai (re)escrever
+            futuras = set(s for e in pendentes + rodando for s in e.saidas)
+            return [e for e in pendentes
+                    if all(x in dados and x not in futuras for x in self.entradas(e, parametros))]
+
+        pendentes = list(plano)
+        if sequencial:
+            while pendentes:
+                e = prontas(pendentes, [])[0]
+                pendentes.remove(e)
+                dados.update(rodar(e))
+            return dados
+
+        pool = _pool(max_threads)
+        rodando = {}
+        try:
+            while pendentes or rodando:
+                for e in prontas(pendentes, list(rodando.values())):
+                    pendentes.remove(e)
+                    rodando[pool.submit(contextvars.copy_context().run, rodar, e)] = e
+                feitos, _ = wait(rodando, return_when=FIRST_COMPLETED)
+                for futuro in feitos:
+                    del rodando[futuro]
+                    dados.update(futuro.result())
+        except BaseException:
+            for futuro in rodando: #O pool é compartilhado: só as etapas desta execução são canceladas
+                futuro.cancel()
+            raise
+        return dados
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+from conversao import TabelaConversao, tabela_do_cache, salvar_no_cache
+from calculos import datas_das_leituras, virada_de_dia
+from saida import conferir_saida, escrever, escrever_excel, escrever_txt, tabela_de_saida
+from instrumentacao import etapa
+from gravidade_normal import seno2
+from correcoes import PIPELINE, SAIDAS_LEITURAS, saidas_circuito, saidas_anomalias
+from esquema import (ErroValidacao, Problema, SEM_LEITURAS, mapear_colunas, nomes_posicionais, numerico,
+                     validar_leituras)
+from amostras import AGREGACAO_PADRAO, COLUNAS_AMOSTRAS, ler_amostras, leituras_das_amostras
+
+#--------------------------------------------------
+#Redução gravimétrica independente da GUI
+#--------------------------------------------------
+'''
+Núcleo de redução do GRARED, sem dependência do Tkinter. Pode ser importado
+por scripts, pela linha de comando (grared_cli.py) ou pela GUI (GRARED.py).
+----------------------------
+GRARED reduction core, without any Tkinter dependency. It can be imported
+by scripts, by the command line (grared_cli.py) or by the GUI (GRARED.py).
+'''
+
+#Ordem das 14 colunas do modelo GRARED_P
+COLUNAS_LEVANTAMENTO = ('ponto', 'g_l1', 'g_l2', 'g_l3', 'hora', 'minuto', 'h_instrumento',
+                        'Lat_gra', 'Lat_min', 'Lat_seg', 'Lon_gra', 'Lon_min', 'Lon_seg', 'alt_m')
+#Coluna opcional (15ª) com a data de cada leitura, para levantamentos de vários dias
+COLUNA_DATA = 'data'
+
+#Parâmetros da redução com os mesmos valores padrão da GUI
+PARAMETROS_PADRAO = {'dia': 1, 'mes': 1, 'ano': 2017, 'fuso_horario': -3,
+                     'densidade': 2.67, 'g_ref': 0.0,
+                     'free_air': 1, 'bouguer': 1, 'elipsoide': 'grs84',
+                     'formula_normal': None, 'ar_livre_2a_ordem': 0,
+                     'atmosferica': 0, 'eotvos': 0,
+                     'incertezas': None} #Incertezas das entradas (ver incertezas.INCERTEZAS_PADRAO)
+PARAMETROS_PADRAO.update(AGREGACAO_PADRAO) #Registros de amostras (ver amostras.py)
+
+def _colunas_do_txt(nome_arquivo):
+    #Nomes internos das colunas pelos títulos do cabeçalho; sem cabeçalho reconhecido, as 14 colunas
+    #do modelo GRARED_P, mais a data quando a primeira leitura tem 15 campos
+    with open(nome_arquivo) as arq:
+        titulos = arq.readline().split()
+        campos = arq.readline().split()
+    if not campos: #Só o cabeçalho, ou arquivo vazio
+        raise ErroValidacao([Problema(2, None, None, SEM_LEITURAS)], nome_arquivo)
+    nomes = mapear_colunas(titulos)
+    if nomes is None:
+        return nomes_posicionais(len(campos))
+    if len(campos) > len(nomes): #Campos sem título: a data, se não tiver título próprio
+        nomes += [COLUNA_DATA if COLUNA_DATA not in nomes else None] + [None]*(len(campos) - len(nomes) - 1)
+    return nomes
+
+
+def _titulos_do_excel(cabecalho):
+    #Título de cada coluna das duas linhas de cabeçalho do modelo ('Leituras' + '1', 'Latitude' + 'Gra.')
+    import pandas as pd
+    def texto(celula):
+        return '%g' % celula if isinstance(celula, float) else str(celula) #2.0 -> '2'
+    grupo = ''
+    titulos = []
+    for superior, inferior in zip(cabecalho.iloc[0], cabecalho.iloc[1]):
+        if not pd.isna(superior):
+            grupo = texto(superior)
+        titulos.append(grupo + ('' if pd.isna(inferior) else ' ' + texto(inferior)))
+    return titulos
+
+
+def _validar(colunas, tabela, linhas):
+    """
+    Survey columns as read (keyed by the internal names) converted to
+    float arrays, with the date column as datetime64[D], and checked
+    against ESQUEMA_GRARED_P (see esquema.py). Returns the readings and
+    the list of problems.
+    """
+    leituras, originais = {}, {}
+    for c in COLUNAS_LEVANTAMENTO:
+        leituras[c] = numerico(colunas[c])
+        if np.asarray(colunas[c]).dtype.kind not in 'fiub':
+            originais[c] = np.asarray(colunas[c])
+    if COLUNA_DATA in colunas:
+        leituras[COLUNA_DATA] = datas_das_leituras(colunas[COLUNA_DATA])
+        originais[COLUNA_DATA] = np.asarray(colunas[COLUNA_DATA])
+    return leituras, validar_leituras(leituras, tabela, linhas, originais=originais)
+
+
+def ler_levantamento(nome_arquivo, tipo_arquivo='excel', aba='Plan1', instrumentacao=None, tabela=None, params=None):
+    """
+    Reads a survey file in the GRARED_P layout (Excel or DAT/TXT) and returns
+    a dictionary of arrays keyed by COLUNAS_LEVANTAMENTO. The columns are
+    found by their header titles, in any order, or by position when the
+    header is not recognized. An optional 15th column with the date of each
+    reading (Excel date, YYYYMMDD, YYYY-MM-DD or DD/MM/YYYY) is returned
+    under COLUNA_DATA as datetime64[D]. Every cell is checked against
+    ESQUEMA_GRARED_P and, with tabela (a TabelaConversao), the readings
+    against the conversion table; all offending rows are reported at once
+    in an ErroValidacao. tipo_arquivo 'amostras' reads a long-format log
+    of a continuous-recording gravimeter and aggregates its samples into
+    one row per occupation, with the options of AGREGACAO_PADRAO taken
+    from params (see amostras.py). instrumentacao (see instrumentacao.py)
+    measures the 'ingestao' stage.
+    """
+    if tipo_arquivo not in ('excel', 'txt', 'amostras'):
+        raise ValueError("Tipo de arquivo desconhecido: %r (use 'excel', 'txt' ou 'amostras')" % (tipo_arquivo,))
+    if tipo_arquivo == 'amostras':
+        parametros = _parametros(params or {})
+        with etapa(instrumentacao, 'ingestao') as registro:
+            amostras = ler_amostras(nome_arquivo)
+            registro['linhas'] = len(amostras['leitura'])
+        with etapa(instrumentacao, 'agregacao') as registro:
+            try:
+                leituras = leituras_das_amostras(amostras, tabela, **{k: parametros[k] for k in AGREGACAO_PADRAO})
+            except ErroValidacao as erro:
+                raise ErroValidacao(erro.problemas, nome_arquivo)
+            registro['linhas'] = len(leituras['ponto'])
+        return leituras
+    with etapa(instrumentacao, 'ingestao') as registro:
+        if tipo_arquivo == 'excel':
+            import pandas as pd
+            p_mat_ler = pd.read_excel(nome_arquivo, sheet_name=aba, header=None) #Leitura interna da planilha de dados primária
+            nomes = mapear_colunas(_titulos_do_excel(p_mat_ler.iloc[:2])) or nomes_posicionais(p_mat_ler.shape[1])
+            p_mat_ler = p_mat_ler.iloc[2:].dropna(how='all') #Linhas vazias da planilha são ignoradas
+            colunas = {n: p_mat_ler.iloc[:, k].to_numpy() for k, n in enumerate(nomes) if n}
+            linhas = p_mat_ler.index.to_numpy() + 1 #Linha na planilha
+        else:
+            colunas = next(ler_txt_em_blocos(nome_arquivo, None))
+            linhas = 2 #Primeira linha depois do cabeçalho
+        leituras, problemas = _validar(colunas, tabela, linhas)
+        registro['linhas'] = len(leituras['ponto'])
+    if problemas:
+        raise ErroValidacao(problemas, nome_arquivo)
+    return leituras
+
+
+def ler_tabela_conversao(planilha_conv, grav, usar_cache=True):
+    """
+    Reads the conversion table of gravimeter grav from the workbook
+    planilha_conv and returns it as a TabelaConversao. With usar_cache the
+    binary cache of conversao.py is used and refreshed when needed.
+    """
+    if usar_cache:
+        tabela = tabela_do_cache(planilha_conv, grav)
+        if tabela is not None:
+            return tabela
+    import pandas as pd
+    p_conv_ler = pd.read_excel(planilha_conv, sheet_name=str(grav), header=None, dtype=float) #Leitura interna da planilha de conversão
+    p_matriz_c = p_conv_ler.values.T #Salvamento da planilha lida em matriz transposta de arrays
+    tabela = TabelaConversao(p_matriz_c[0], p_matriz_c[1], p_matriz_c[2], grav=grav)
+    if usar_cache:
+        salvar_no_cache(tabela, planilha_conv, grav)
+    return tabela
+
+
+def _parametros(params):
+    parametros = dict(PARAMETROS_PADRAO)
+    parametros.update(params)
+    return parametros
+
+
+def corrigir_leituras(readings, conversion_table, params, instrumentacao=None):
+    """
+    Per-reading stage of the reduction: coordinates in decimal degrees,
+    mean reading, conversion to mGal, instrument height and tide. Every
+    output depends only on its own row, so this stage can run over chunks
+    of a file. Returns the small per-reading summary used by
+    corrigir_circuito. The corrections are the stages of correcoes.py, run
+    by the pipeline; instrumentacao measures each of them ('coordenadas',
+    'tempo', 'conversao', 'altura_instrumental', 'mare' and 'g_cls').
+    """
+    parametros = _parametros(params)
+    if not isinstance(conversion_table, TabelaConversao):
+        conversion_table = TabelaConversao(*conversion_table)
+    dados = dict(readings, tabela=conversion_table)
+    dados['data_lida'] = dados.pop(COLUNA_DATA, None) #A etapa 'tempo' produz a coluna 'data' completa
+    dados = PIPELINE.executar(dados, SAIDAS_LEITURAS, parametros, instrumentacao)
+
+    parciais = {c: dados[c] for c in SAIDAS_LEITURAS}
+    parciais['alt_m'] = np.asarray(parciais['alt_m'], dtype=np.float64)
+    #Número e dispersão das amostras de cada ocupação, quando as leituras vêm de um registro contínuo
+    parciais.update({c: readings[c] for c in COLUNAS_AMOSTRAS if c in readings})
+    return parciais
+
+
+def corrigir_circuito(parciais, params, instrumentacao=None):
+    """
+    Loop-level stage of the reduction: drift and absolute gravity of one
+    closed loop (with the Eötvös correction when params['eotvos'] is
+    set), then the stages of corrigir_anomalias, plus the uncertainties.
+    parciais is the summary returned by corrigir_leituras (or the
+    concatenation of the summaries of every chunk of a file). Returns the
+    complete results. The drift and the normal gravity do not depend on
+    each other and may run at the same time.
+    """
+    parametros = _parametros(params)
+    saidas = saidas_circuito(parametros) + saidas_anomalias(parametros)
+    dados = PIPELINE.executar(parciais, saidas, parametros, instrumentacao)
+    resultados = dict(parciais)
+    resultados.update({c: dados[c] for c in saidas})
+    return resultados
+
+
+def corrigir_anomalias(resultados, params, instrumentacao=None):
+    """
+    Normal gravity, free-air and Bouguer stage of the reduction, from the
+    absolute gravity g_abs (and its uncertainty ç_gabs) of each reading.
+    Used after the single-loop drift of corrigir_circuito or after the
+    network adjustment of ajuste.py. Returns the new columns. The normal
+    gravity uses the formula_normal of gravidade_normal.py (by default the
+    one of the ellipsoid) and, with ar_livre_2a_ordem, the free-air
+    correction is the second-order one of the ellipsoid instead of
+    0.308596*h. With atmosferica, the IAG atmospheric correction 'c_atm'
+    is added to both anomalies.
+    """
+    parametros = _parametros(params)
+    dados = dict(resultados)
+    if 'sen2_lat' not in dados: #sen²φ calculado uma única vez, na etapa das leituras
+        dados['sen2_lat'] = seno2(dados['Lat_graus_dec'])
+    saidas = saidas_anomalias(parametros)
+    dados = PIPELINE.executar(dados, saidas, parametros, instrumentacao)
+    return {c: dados[c] for c in saidas}
+
+
+def reduce_survey(readings, conversion_table, params, instrumentacao=None, saidas=None, mde=None):
+    """
+    Reduces one survey loop. readings is the dictionary returned by
+    ler_levantamento, conversion_table is a TabelaConversao (or the tuple
+    (gc1, gc2, gf0)) and params holds the same fields as the GUI form (see
+    PARAMETROS_PADRAO). Returns a dictionary with every intermediate column
+    and its uncertainty. instrumentacao (an instrumentacao.Instrumentacao)
+    records the time, rows and memory of each stage.
+
+    With saidas (names of result columns, e.g. ('g_ca',) or ('ca', 'cb',
+    'g_teor')) only the stages needed for them run, in one pipeline over
+    the whole loop: the tide is skipped when no requested column depends
+    on it, and so on. mde (a terreno.ModeloDigitalElevacao) makes the
+    terrain columns 'ct' and 'g_cbc' available, computed at the same time
+    as the tide; the returned dictionary then holds the requested columns
+    plus every column computed on the way.
+    """
+    if saidas is None and mde is None:
+        parciais = corrigir_leituras(readings, conversion_table, params, instrumentacao)
+        return corrigir_circuito(parciais, params, instrumentacao)
+    parametros = _parametros(params)
+    if not isinstance(conversion_table, TabelaConversao):
+        conversion_table = TabelaConversao(*conversion_table)
+    if saidas is None:
+        saidas = (SAIDAS_LEITURAS + saidas_circuito(parametros) + saidas_anomalias(parametros)
+                  + ('ct', 'ç_ct', 'g_cbc'))
+    dados = dict(readings, tabela=conversion_table)
+    dados['data_lida'] = dados.pop(COLUNA_DATA, None)
+    if mde is not None:
+        dados['mde'] = mde
+    dados = PIPELINE.executar(dados, tuple(saidas), parametros, instrumentacao)
+    for c in ('tabela', 'mde', 'data_lida'):
+        dados.pop(c, None)
+    return dados
+
+
+def ler_txt_em_blocos(nome_arquivo, linhas_por_bloco=100000):
+    """
+    Reads a DAT/TXT survey in the GRARED_P layout in blocks of at most
+    linhas_por_bloco rows (None reads it whole), with the pandas C parser.
+    Yields one dictionary keyed by COLUNAS_LEVANTAMENTO (plus COLUNA_DATA
+    when the file has the date column) per block, with the cells as read:
+    cells that are not numbers are only reported by the validation.
+    """
+    import pandas as pd
+    nomes = _colunas_do_txt(nome_arquivo)
+    colunas = [n for n in nomes if n]
+    leitor = pd.read_csv(nome_arquivo, sep=r'\s+', header=None, skiprows=1,
+                         names=[n or '_%d' % k for k, n in enumerate(nomes)], usecols=colunas,
+                         chunksize=linhas_por_bloco or 2**62, engine='c')
+    with leitor:
+        for bloco in leitor:
+            yield {c: bloco[c].to_numpy() for c in colunas}
+
+
+def corrigir_leituras_em_blocos(nome_arquivo, conversion_table, params, linhas_por_bloco=100000, instrumentacao=None):
+    """
+    Reads a DAT/TXT survey in blocks and runs corrigir_leituras on each
+    block as soon as it is read. Only the per-reading summaries are kept;
+    they are returned concatenated, as for the whole file. Every block is
+    validated as in ler_levantamento; after the first invalid block the
+    rest of the file is only validated, and all the problems are raised
+    together in an ErroValidacao.
+    """
+    if not isinstance(conversion_table, TabelaConversao):
+        conversion_table = TabelaConversao(*conversion_table)
+    parametros = _parametros(params)
+    data_base = np.datetime64('%04d-%02d-%02d' % (int(parametros['ano']), int(parametros['mes']), int(parametros['dia'])), 'D')
+    blocos = []
+    problemas = []
+    linha = 2 #Linha no arquivo da primeira leitura do bloco
+    anterior = None #(dia, hora) da última leitura do bloco anterior, para a virada de dia
+    leitor = ler_txt_em_blocos(nome_arquivo, linhas_por_bloco)
+    while True:
+        with etapa(instrumentacao, 'ingestao') as registro: #Um registro por bloco lido
+            bloco = next(leitor, None)
+            if bloco is not None:
+                bloco, problemas_bloco = _validar(bloco, conversion_table, linha)
+                problemas += problemas_bloco
+                linha += len(bloco['ponto'])
+            registro['linhas'] = 0 if bloco is None else len(bloco['ponto'])
+        if bloco is None:
+            break
+        if problemas:
+            continue
+        if COLUNA_DATA not in bloco:
+            hora_dec = bloco['hora'] + bloco['minuto']/60
+            dias = virada_de_dia(hora_dec, anterior)
+            anterior = (dias[-1], hora_dec[-1])
+            bloco[COLUNA_DATA] = data_base + dias.astype('timedelta64[D]')
+        blocos.append(corrigir_leituras(bloco, conversion_table, params, instrumentacao))
+    if problemas:
+        raise ErroValidacao(problemas, nome_arquivo)
+    if not blocos:
+        raise ErroValidacao([Problema(2, None, None, SEM_LEITURAS)], nome_arquivo)
+    return {k: np.concatenate([b[k] for b in blocos]) for k in blocos[0]}
+
+
+def reduzir_txt_em_blocos(nome_arquivo, conversion_table, params, linhas_por_bloco=100000, instrumentacao=None):
+    """
+    Streaming version of reduce_survey for large DAT/TXT files: see
+    corrigir_leituras_em_blocos. corrigir_circuito then runs once over the
+    whole loop. Gives the same results as reduce_survey, up to the last
+    digit of the text parser.
+    """
+    parciais = corrigir_leituras_em_blocos(nome_arquivo, conversion_table, params, linhas_por_bloco, instrumentacao)
+    return corrigir_circuito(parciais, params, instrumentacao)
+
+
+def escrever_saida(resultados, saida_txt=None, saida_excel=None, dec=3, metadados=None, saida_colunar=None,
+                   instrumentacao=None):
+    """
+    Writes the reduced columns to the Excel, DAT/TXT and/or columnar
+    (.parquet or .feather) outputs, rounded to dec decimal places. An empty
+    or None name skips that output. metadados (input file, tab, conversion
+    table, gravimeter and the reduction parameters) fills the header of the
+    DAT/TXT output; see saida.cabecalho. instrumentacao measures each
+    output as a 'saida' stage. A columnar output that cannot be written
+    (unknown extension, no pyarrow) fails before the other outputs.
+    """
+    if saida_colunar:
+        conferir_saida(saida_colunar)
+    if metadados is not None:
+        metadados = dict(metadados, saidas=(saida_txt, saida_excel, saida_colunar))
+    n = len(resultados['ponto'])
+    #Excel
+    if saida_excel:
+        with etapa(instrumentacao, 'saida', n):
+            escrever_excel(tabela_de_saida(resultados, dec, titulos='excel'), saida_excel)
+    #DAT/TXT
+    if saida_txt:
+        with etapa(instrumentacao, 'saida', n):
+            escrever_txt(tabela_de_saida(resultados, dec), saida_txt, metadados, dec)
+    #Parquet/Feather
+    if saida_colunar:
+        with etapa(instrumentacao, 'saida', n):
+            escrever(resultados, saida_colunar, dec=dec)
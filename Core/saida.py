@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+from datetime import datetime, timezone
+from importlib.util import find_spec
+import numpy as np
+
+#--------------------------------------------------
+#Saída dos dados reduzidos
+#--------------------------------------------------
+'''
+A tabela de saída é montada uma única vez, com todas as colunas, e
+escrita de uma só vez em Excel, Parquet/Feather ou DAT/TXT (TSV com o
+cabeçalho de metadados de Supply/Como_deve_ser_saida.txt).
+----------------------------
+The output table is built once, with every column, and written in a single
+pass to Excel, Parquet/Feather or DAT/TXT (TSV with the metadata header of
+Supply/Como_deve_ser_saida.txt).
+'''
+
+VERSAO = 'GRARED v. Hawking 1.0'
+
+#Colunas de saída: (chave do resultado, título Excel, título DAT/TXT)
+COLUNAS_SAIDA = (('ponto', 'Ponto', '00_Pt'),
+                 ('g_med_lido', 'Leitura média Gravímetro', '01_LG'),
+                 ('g_conv', 'Leitura média mGal', '02_LC'),
+                 ('c_ai', 'Corr. Alt. Instr.', '03_C.HI'),
+                 ('g_ai', 'g. Corr. Alt. Instrum.', '04_g.HI'),
+                 ('cls', 'Correção de Maré', '05_C.Mar'),
+                 ('g_cls', 'g. Corr. Maré ', '06_g.Mar'),
+                 ('cd', 'Corr. Deriva', '07_C.Der'),
+                 ('g_cd', 'g. corr. Deriva', '08_g.Der'),
+                 ('g_abs', 'g. Obs.', '09_g.Obs'),
+                 ('g_teor', 'g Teórico', '10_g.Teo'),
+                 ('ca', 'Corr. Ar-livre', '11_C.FrA'),
+                 ('g_ca', 'Anom. Ar-livre', '12_A.FrA'),
+                 ('cb', 'Corr. Bouguer', '13_C.Bg'),
+                 ('g_cb', 'Anom. Bouguer', '14_A.Bg'))
+
+#Colunas escritas só quando presentes nos resultados (ex.: correção de terreno, terreno.py)
+COLUNAS_OPCIONAIS = (('ct', 'Corr. Terreno', '15_C.Ter'),
+                     ('g_cbc', 'Anom. Bouguer Completa', '16_A.BgC'),
+                     ('n_amostras', 'Nº de Amostras', '17_N.Amo'),
+                     ('ç_amostras', 'Disp. das Amostras', '18_D.Amo'),
+                     ('c_atm', 'Corr. Atmosférica', '19_C.Atm'),
+                     ('c_eot', 'Corr. Eötvös', '20_C.Eot'))
+
+FORMATOS = {'.xlsx': 'excel', '.parquet': 'parquet', '.feather': 'feather',
+            '.dat': 'txt', '.txt': 'txt', '.tsv': 'txt'}
+
+
+def tabela_de_saida(resultados, dec=3, titulos='txt'):
+    """
+    Builds the output table once as a single DataFrame. titulos chooses the
+    column names: 'txt' (00_Pt, 01_LG, ...) or 'excel' (Ponto, Leitura
+    média Gravímetro, ...). Values are rounded to dec decimal places. Only
+    the columns present in resultados are written, so a reduction that
+    asked for some outputs only (reduce_survey with saidas) is written too.
+    """
+    import pandas as pd
+    k = 2 if titulos == 'txt' else 1
+    dados = {}
+    for coluna in (c for c in COLUNAS_SAIDA + COLUNAS_OPCIONAIS if c[0] in resultados):
+        valores = np.asarray(resultados[coluna[0]])
+        dados[coluna[k]] = valores if coluna[0] == 'ponto' else np.around(valores, decimals=dec)
+    return pd.DataFrame(dados, copy=False)
+
+
+def cabecalho(metadados):
+    """
+    Returns the metadata header lines of the DAT/TXT output, in the layout of
+    Supply/Como_deve_ser_saida.txt. Missing fields are left blank.
+    """
+    m = dict(metadados or {})
+    agora = datetime.now(timezone.utc)
+    sim_nao = lambda v: 'Yes' if int(v) else 'No'
+    aba = m.get('aba') if m.get('tipo', 'excel') == 'excel' else '-'
+    return [VERSAO,
+            '----------------------',
+            'Reduction metadata:',
+            'Processed in: %s%03d" UTC' % (agora.strftime("%d/%m/%Y %Hh:%M'%S."), agora.microsecond//1000),
+            'Data Entry:"%s"(Tab:%s)' % (m.get('entrada', ''), aba or ''),
+            'Conversion Table:"%s" Gravimeter:%s ' % (m.get('conv', ''), m.get('grav', '')),
+            'Time Zone:%s' % (('%g' % m['fuso_horario']) if 'fuso_horario' in m else ''),
+            'Free-air:%s  Bouguer:%s' % (sim_nao(m.get('free_air', 1)), sim_nao(m.get('bouguer', 1))),
+            'Reference Elipsoid:%s' % str(m.get('elipsoide', '')).upper(),
+            'Data output:%s' % ' and '.join('"%s"' % s for s in m.get('saidas', ()) if s),
+            '----------------------']
+
+
+def escrever_excel(tabela, caminho):
+    """
+    Writes the table to one sheet in a single pass. When xlsxwriter is
+    installed its constant-memory mode is used: rows are written in order
+    and flushed to disk as they go. Otherwise pandas writes it with
+    openpyxl in a single to_excel call.
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        import pandas as pd
+        with pd.ExcelWriter(caminho, engine='openpyxl') as excel_writer:
+            tabela.to_excel(excel_writer, sheet_name='Plan1', index=False)
+        return
+    #O modo de memória constante exige escrita linha a linha, em ordem
+    livro = xlsxwriter.Workbook(caminho, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        planilha = livro.add_worksheet('Plan1')
+        planilha.write_row(0, 0, [str(c) for c in tabela.columns])
+        for linha, valores in enumerate(tabela.itertuples(index=False, name=None), start=1):
+            planilha.write_row(linha, 0, valores)
+    finally:
+        livro.close()
+
+
+def blocos_txt(tabela, dec=3, linhas=50000):
+    """
+    Yields the tab separated text of the table: the title line, then the
+    rows in blocks of linhas rows. Rows are formatted with a single format
+    string per block, which is several times faster than DataFrame.to_csv
+    for large tables.
+    """
+    formatos = ['%g' if str(c) in ('00_Pt', 'Ponto', '17_N.Amo', 'Nº de Amostras') else '%%.%df' % dec
+                for c in tabela.columns]
+    linha = '\t'.join(formatos) + '\n'
+    valores = tabela.to_numpy(dtype=np.float64)
+    yield '\t'.join(str(c) for c in tabela.columns) + '\n'
+    for k in range(0, len(valores), linhas):
+        yield ''.join([linha % r for r in map(tuple, valores[k:k+linhas].tolist())])
+
+
+def escrever_txt(tabela, caminho, metadados=None, dec=3):
+    """
+    Writes the table as tab separated text (see blocos_txt), overwriting
+    any previous file. When metadados is given the header of cabecalho()
+    comes first.
+    """
+    with open(caminho, 'w', encoding='utf-8', newline='') as arq:
+        if metadados is not None:
+            arq.write('\n'.join(cabecalho(metadados)) + '\n')
+        for bloco in blocos_txt(tabela, dec):
+            arq.write(bloco)
+
+
+def escrever_colunar(tabela, caminho, formato='parquet'):
+    """
+    Writes the table as Parquet or Feather for downstream processing.
+    Needs pyarrow (or fastparquet for Parquet).
+    """
+    try:
+        if formato == 'feather':
+            tabela.to_feather(caminho)
+        else:
+            tabela.to_parquet(caminho, index=False)
+    except ImportError as erro:
+        raise ImportError('A saída %s precisa do pacote pyarrow (pip install pyarrow): %s' % (formato, erro))
+
+
+def conferir_saida(caminho):
+    """
+    Format of the output caminho, from its extension. Raises ValueError
+    for an unknown extension and ImportError when the package of a
+    Parquet/Feather output is missing, so that it fails before anything is
+    written.
+    """
+    formato = FORMATOS.get(os.path.splitext(caminho)[1].lower())
+    if formato is None:
+        raise ValueError('Formato de saída desconhecido: %s (use %s)' % (caminho, ', '.join(sorted(FORMATOS))))
+    motores = {'parquet': ('pyarrow', 'fastparquet'), 'feather': ('pyarrow',)}.get(formato, ())
+    if motores and not any(find_spec(m) for m in motores): #Só procura o pacote, sem importá-lo
+        raise ImportError('A saída %s precisa do pacote pyarrow (pip install pyarrow)' % formato)
+    return formato
+
+
+def escrever(resultados, caminho, metadados=None, dec=3):
+    """
+    Writes the results to caminho in the format given by its extension
+    (.xlsx, .parquet, .feather, .dat, .txt or .tsv).
+    """
+    formato = conferir_saida(caminho)
+    if formato == 'excel':
+        escrever_excel(tabela_de_saida(resultados, dec, titulos='excel'), caminho)
+    elif formato == 'txt':
+        escrever_txt(tabela_de_saida(resultados, dec), caminho, metadados, dec)
+    else:
+        escrever_colunar(tabela_de_saida(resultados, dec), caminho, formato)
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import tempfile
+import itertools
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from reducao import ler_tabela_conversao, PARAMETROS_PADRAO
+from lote import reduzir_arquivo
+from saida import tabela_de_saida, blocos_txt
+from correcoes import efemerides
+
+#--------------------------------------------------
+#Serviço local de redução (daemon)
+#--------------------------------------------------
+'''
+Processo de longa duração que atende reduções pela rede local (HTTP em
+127.0.0.1 ou num socket Unix). O interpretador, o pandas e as tabelas de
+conversão são carregados uma única vez, e as efemérides da maré e as
+constantes dos elipsoides ficam em memória entre os pedidos; cada redução
+custa só o seu próprio cálculo. Os pedidos entram numa fila limitada,
+atendida por um grupo de threads trabalhadoras; com a fila cheia o pedido
+é recusado (503) em vez de acumular. O resultado volta em pedaços
+(transferência chunked), no mesmo formato do DAT/TXT de saída.
+
+O serviço não tem autenticação. Os pedidos só são aceitos com
+Content-Type: application/json, que um navegador não envia a outro site
+sem consulta prévia (CORS), e os caminhos que eles citam ("arquivo",
+"conv", "saida_txt" e "saida_excel") são relativos à pasta do serviço
+(--pasta, padrão: a pasta onde ele foi iniciado) e não podem sair dela.
+
+    python servico.py --conv Tabelas_conv_todas.xlsx --grav 996 --trabalhadores 4 --pasta /dados
+    curl -H 'Content-Type: application/json' -d '{"arquivo": "circuito.txt", "tipo": "txt", "grav": "996",
+         "g_ref": 978600.0, "esperar": true}' http://127.0.0.1:8765/reducoes
+
+Rotas: POST /reducoes (pedido em JSON; responde 202 com o id, ou o
+resultado com "esperar"), GET /reducoes/<id> (estado do pedido),
+GET /reducoes/<id>/resultado (espera e envia o resultado) e GET /estado.
+O pedido traz o arquivo ("arquivo", caminho na pasta do serviço) ou o seu
+texto ("conteudo", que não pode ser uma planilha Excel), "tipo", "aba", "conv", "grav", "saidas", "saida_txt",
+"saida_excel" e os parâmetros do formulário (dia, mes, ano, fuso_horario,
+densidade, g_ref, free_air, bouguer, elipsoide, ...; ver
+reducao.PARAMETROS_PADRAO).
+----------------------------
+Long-running process that serves reductions on the local machine (HTTP on
+127.0.0.1 or a Unix socket). The interpreter, pandas and the conversion
+tables are loaded only once, and the tide ephemerides and the ellipsoid
+constants stay in memory between requests; each reduction costs only its
+own computation. Requests go into a bounded queue served by a pool of
+worker threads; when the queue is full the request is refused (503)
+instead of piling up. The result is sent back in pieces (chunked
+transfer), in the same format as the DAT/TXT output.
+
+The service has no authentication. Requests are only accepted with
+Content-Type: application/json, which a browser does not send to another
+site without a preflight (CORS), and the paths they name ("arquivo",
+"conv", "saida_txt" and "saida_excel") are relative to the folder of the
+service (--pasta, default: the folder it was started in) and cannot leave
+it.
+
+Routes: POST /reducoes (JSON request; answers 202 with the id, or the
+result with "esperar"), GET /reducoes/<id> (request state),
+GET /reducoes/<id>/resultado (waits and sends the result) and GET /estado.
+The request carries the file ("arquivo", a path in the folder of the
+service) or its text ("conteudo", which cannot be an Excel workbook), "tipo", "aba", "conv", "grav", "saidas", "saida_txt",
+"saida_excel" and the parameters of the form (dia, mes, ano, fuso_horario,
+densidade, g_ref, free_air, bouguer, elipsoide, ...; see
+reducao.PARAMETROS_PADRAO).
+'''
+
+ENDERECO_PADRAO = '127.0.0.1'
+PORTA_PADRAO = 8765
+TAMANHO_FILA_PADRAO = 64
+PEDIDOS_GUARDADOS = 256 #Pedidos terminados mantidos para GET /reducoes/<id>; os mais antigos são descartados
+LINHAS_POR_PEDACO = 1000 #Linhas da tabela por pedaço da resposta
+CAMPOS_DO_PEDIDO = ('arquivo', 'conteudo', 'tipo', 'aba', 'conv', 'grav', 'saidas', 'saida_txt', 'saida_excel',
+                    'esperar')
+CAMPOS_CAMINHO = ('arquivo', 'conv', 'saida_txt', 'saida_excel') #Confinados à pasta do serviço
+
+
+class FilaCheia(Exception):
+    """
+    The job queue of the service is full.
+    """
+
+
+class ServicoReducao:
+    """
+    Warm caches, bounded job queue and worker pool of the reduction
+    service. The HTTP layer (Manipulador) only calls submeter, pedido and
+    estado, so the service can also be used directly from Python. The
+    paths of the requests are confined to pasta (default: the current
+    folder); conv, the default workbook, is not.
+    """
+
+    def __init__(self, conv='Tabelas_conv_todas.xlsx', trabalhadores=None, tamanho_fila=TAMANHO_FILA_PADRAO,
+                 usar_cache=True, pasta=None):
+        self.conv = conv
+        self.pasta = os.path.realpath(pasta or os.getcwd())
+        self.usar_cache = usar_cache
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.pedidos = OrderedDict()
+        self._trava = threading.Lock()
+        self._tabelas = {} #(planilha, grav) -> (data de modificação, TabelaConversao)
+        self._trava_tabelas = threading.Lock()
+        self._ids = itertools.count(1)
+        self.inicio = time.time()
+        self.threads = [threading.Thread(target=self._trabalhar, name='reducao-%d' % k, daemon=True)
+                        for k in range(max(1, trabalhadores or os.cpu_count() or 1))]
+        for t in self.threads:
+            t.start()
+
+    def tabela(self, conv, grav):
+        """
+        Conversion table of gravimeter grav, kept in memory and read again
+        only when the workbook changes.
+        """
+        conv = os.path.abspath(conv or self.conv)
+        chave = (conv, str(grav))
+        modificado = os.path.getmtime(conv)
+        with self._trava_tabelas:
+            guardada = self._tabelas.get(chave)
+            if guardada is None or guardada[0] != modificado:
+                guardada = (modificado, ler_tabela_conversao(conv, grav, self.usar_cache))
+                self._tabelas[chave] = guardada
+        return guardada[1]
+
+    def caminho(self, caminho, campo):
+        """
+        Absolute path of caminho (relative to the folder of the service),
+        or ValueError when it leaves that folder.
+        """
+        if not isinstance(caminho, str) or not caminho:
+            raise ValueError('"%s" deve ser um caminho' % campo)
+        real = os.path.realpath(os.path.join(self.pasta, caminho))
+        if os.path.commonpath([self.pasta, real]) != self.pasta:
+            raise ValueError('"%s" fora da pasta do serviço (%s): %s' % (campo, self.pasta, caminho))
+        return real
+
+    def submeter(self, pedido):
+        """
+        Checks the request (dictionary, see the module docstring), puts it in
+        the queue and returns its id. Raises ValueError for an invalid
+        request and FilaCheia when the queue is full.
+        """
+        desconhecidos = [c for c in pedido if c not in CAMPOS_DO_PEDIDO and c not in PARAMETROS_PADRAO]
+        if desconhecidos:
+            raise ValueError('Campos desconhecidos no pedido: %s' % ', '.join(sorted(desconhecidos)))
+        if ('arquivo' in pedido) == ('conteudo' in pedido):
+            raise ValueError('O pedido deve ter "arquivo" ou "conteudo"')
+        if 'conteudo' in pedido and pedido.get('tipo') == 'excel':
+            raise ValueError('Planilhas Excel só podem ser enviadas por "arquivo"; use "conteudo" com tipo txt')
+        if 'grav' not in pedido:
+            raise ValueError('O pedido deve ter "grav" (gravímetro da tabela de conversão)')
+        pedido = dict(pedido, **{c: self.caminho(pedido[c], c) for c in CAMPOS_CAMINHO if pedido.get(c) is not None})
+        registro = {'id': str(next(self._ids)), 'estado': 'na_fila', 'pedido': pedido,
+                    'recebido': time.time(), 'pronto': threading.Event(), 'resultado': None}
+        try:
+            self.fila.put_nowait(registro)
+        except queue.Full:
+            raise FilaCheia('Fila cheia (%d pedidos); tente de novo em instantes' % self.fila.maxsize)
+        with self._trava:
+            self.pedidos[registro['id']] = registro
+            while len(self.pedidos) > PEDIDOS_GUARDADOS:
+                antigo = next(iter(self.pedidos.values()))
+                if not antigo['pronto'].is_set():
+                    break
+                self.pedidos.popitem(last=False)
+        return registro['id']
+
+    def pedido(self, id_pedido):
+        """
+        Record of request id_pedido, or None when unknown or discarded.
+        """
+        with self._trava:
+            return self.pedidos.get(id_pedido)
+
+    def estado(self):
+        """
+        State of the service: queue, workers and warm caches.
+        """
+        with self._trava:
+            estados = [r['estado'] for r in self.pedidos.values()]
+        return {'fila': self.fila.qsize(), 'tamanho_fila': self.fila.maxsize, 'trabalhadores': len(self.threads),
+                'pedidos': {e: estados.count(e) for e in set(estados)},
+                'tabelas': sorted('%s:%s' % (os.path.basename(c), g) for c, g in self._tabelas),
+                'efemerides': {'linhas': len(efemerides), 'acertos': efemerides.hits, 'faltas': efemerides.misses},
+                'ativo_ha_s': round(time.time() - self.inicio, 1)}
+
+    def encerrar(self):
+        """
+        Stops the workers after the requests already in the queue.
+        """
+        for _ in self.threads:
+            self.fila.put(None)
+        for t in self.threads:
+            t.join()
+
+    def _trabalhar(self):
+        while True:
+            registro = self.fila.get()
+            if registro is None:
+                return
+            registro['estado'] = 'reduzindo'
+            registro['iniciado'] = time.time()
+            try:
+                registro['resultado'] = self._reduzir(registro['pedido'])
+            except Exception as erro: #Pedido com tabela ou parâmetros inválidos: não derruba o trabalhador
+                registro['resultado'] = {'resultados': None, 'leituras': 0,
+                                         'erro': '%s: %s' % (type(erro).__name__, erro)}
+            registro['estado'] = 'erro' if registro['resultado']['erro'] else 'pronto'
+            registro['terminado'] = time.time()
+            registro['pronto'].set()
+
+    def _reduzir(self, pedido):
+        tabela = self.tabela(pedido.get('conv'), pedido['grav'])
+        parametros = {c: v for c, v in pedido.items() if c in PARAMETROS_PADRAO}
+        saidas = pedido.get('saidas')
+        if isinstance(saidas, str):
+            saidas = [c.strip() for c in saidas.split(',') if c.strip()]
+        tipo = pedido.get('tipo', 'txt')
+        nome_arquivo = pedido.get('arquivo')
+        temporario = None
+        if nome_arquivo is None: #Texto enviado no pedido: a leitura é a mesma de um arquivo local
+            sufixo = {'excel': '.xlsx', 'amostras': '.csv'}.get(tipo, '.txt')
+            with tempfile.NamedTemporaryFile('w', suffix=sufixo, delete=False, encoding='utf-8') as arq:
+                arq.write(pedido['conteudo'])
+            nome_arquivo = temporario = arq.name
+        try:
+            return reduzir_arquivo(nome_arquivo, tabela, parametros, tipo, pedido.get('aba', 'Plan1'),
+                                   pedido.get('saida_txt'), pedido.get('saida_excel'), True,
+                                   conv=pedido.get('conv') or self.conv, saidas=tuple(saidas) if saidas else None)
+        finally:
+            if temporario:
+                os.remove(temporario)
+
+
+def resumo(registro):
+    """
+    JSON-ready summary of a request record.
+    """
+    saida = {'id': registro['id'], 'estado': registro['estado']}
+    if 'iniciado' in registro:
+        saida['espera_ms'] = round(1000*(registro['iniciado'] - registro['recebido']), 1)
+    if 'terminado' in registro:
+        saida['reducao_ms'] = round(1000*(registro['terminado'] - registro['iniciado']), 1)
+        saida['leituras'] = registro['resultado']['leituras']
+        saida['erro'] = registro['resultado']['erro']
+    return saida
+
+
+class Manipulador(BaseHTTPRequestHandler):
+    """
+    HTTP routes of the service (see the module docstring).
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GRARED'
+
+    @property
+    def servico(self):
+        return self.server.servico
+
+    def address_string(self):
+        #Conexões pelo socket Unix não têm endereço
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, formato, *args):
+        if not self.server.silencioso:
+            super().log_message(formato, *args)
+
+    def _json(self, codigo, dados, cabecalhos=()):
+        corpo = json.dumps(dados, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in cabecalhos:
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _resultado(self, registro, espera=None):
+        if not registro['pronto'].wait(espera):
+            return self._json(202, resumo(registro))
+        resultado = registro['resultado']
+        if resultado['erro']:
+            return self._json(422, resumo(registro))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/tab-separated-values; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for nome, valor in (('X-Reducao-Id', registro['id']), ('X-Reducao-Ms', resumo(registro)['reducao_ms'])):
+            self.send_header(nome, str(valor))
+        self.end_headers()
+        for bloco in blocos_txt(tabela_de_saida(resultado['resultados']), linhas=LINHAS_POR_PEDACO):
+            dados = bloco.encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(dados), dados))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_GET(self):
+        partes = [p for p in self.path.split('?')[0].split('/') if p]
+        if partes == ['estado']:
+            return self._json(200, self.servico.estado())
+        if len(partes) in (2, 3) and partes[0] == 'reducoes' and partes[2:] in ([], ['resultado']):
+            registro = self.servico.pedido(partes[1])
+            if registro is None:
+                return self._json(404, {'erro': 'Pedido %s desconhecido' % partes[1]})
+            return self._resultado(registro) if partes[2:] else self._json(200, resumo(registro))
+        self._json(404, {'erro': 'Rota desconhecida: %s' % self.path})
+
+    def do_POST(self):
+        if self.path.split('?')[0].strip('/') != 'reducoes':
+            return self._json(404, {'erro': 'Rota desconhecida: %s' % self.path})
+        tipo = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if tipo != 'application/json': #Um formulário ou text/plain de outro site chega sem consulta prévia
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return self._json(415, {'erro': 'O pedido deve ter Content-Type: application/json'})
+        try:
+            pedido = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(pedido, dict):
+                raise ValueError('O pedido deve ser um objeto JSON')
+            id_pedido = self.servico.submeter(pedido)
+        except FilaCheia as erro:
+            return self._json(503, {'erro': str(erro)}, [('Retry-After', '1')])
+        except ValueError as erro:
+            return self._json(400, {'erro': str(erro)})
+        registro = self.servico.pedido(id_pedido)
+        if pedido.get('esperar'):
+            return self._resultado(registro)
+        self._json(202, resumo(registro), [('Location', '/reducoes/%s' % id_pedido)])
+
+
+CONEXOES_PENDENTES = 128 #Fila de conexões do socket; o padrão do socketserver (5) recusa rajadas de clientes
+
+
+class ServidorHTTP(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = CONEXOES_PENDENTES
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = CONEXOES_PENDENTES
+
+
+def criar_servidor(servico, endereco=ENDERECO_PADRAO, porta=PORTA_PADRAO, socket_unix=None, silencioso=False):
+    """
+    HTTP server of servico on endereco:porta, or on the Unix socket
+    socket_unix (a path; a stale socket file is replaced).
+    """
+    if socket_unix:
+        if not hasattr(socketserver, 'UnixStreamServer'):
+            raise ValueError('Sockets Unix não estão disponíveis neste sistema')
+        if os.path.exists(socket_unix):
+            os.remove(socket_unix)
+        servidor = ServidorUnix(socket_unix, Manipulador)
+    else:
+        servidor = ServidorHTTP((endereco, porta), Manipulador)
+    servidor.servico = servico
+    servidor.silencioso = silencioso
+    return servidor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serviço local de redução do GRARED')
+    parser.add_argument('--endereco', default=ENDERECO_PADRAO,
+                        help='endereço de escuta (padrão: 127.0.0.1, só a máquina local)')
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    parser.add_argument('--socket', default=None, metavar='CAMINHO', help='escuta num socket Unix em vez de TCP')
+    parser.add_argument('--conv', default='Tabelas_conv_todas.xlsx', help='planilha de conversão padrão')
+    parser.add_argument('--grav', action='append', default=[],
+                        help='gravímetro cuja tabela é carregada já na partida (pode ser repetida)')
+    parser.add_argument('--trabalhadores', type=int, default=None,
+                        help='threads que reduzem os pedidos (padrão: número de núcleos)')
+    parser.add_argument('--fila', type=int, default=TAMANHO_FILA_PADRAO, help='pedidos aceitos à espera')
+    parser.add_argument('--pasta', default=None,
+                        help='pasta dos arquivos e saídas citados nos pedidos (padrão: a pasta atual)')
+    parser.add_argument('--silencioso', action='store_true', help='não registra cada pedido no terminal')
+    args = parser.parse_args(argv)
+
+    servico = ServicoReducao(args.conv, args.trabalhadores, args.fila, pasta=args.pasta)
+    for grav in args.grav:
+        servico.tabela(args.conv, grav)
+    servidor = criar_servidor(servico, args.endereco, args.porta, args.socket, args.silencioso)
+    print('Serviço GRARED em %s (%d trabalhadores, fila de %d, pasta %s)'
+          % (args.socket or 'http://%s:%d' % (args.endereco, args.porta), len(servico.threads), args.fila,
+             servico.pasta),
+          file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) #kill encerra como Ctrl+C, removendo o socket
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servico.encerrar()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+from functools import lru_cache
+import numpy as np
+from instrumentacao import progresso
+from incertezas import INCERTEZAS_PADRAO
+
+#--------------------------------------------------
+#Correção de terreno a partir de um modelo digital de elevação (MDE)
+#--------------------------------------------------
+'''
+Completa a correção Bouguer simples com o efeito do relevo em torno de cada
+estação, calculado num MDE regular em coordenadas geográficas (GeoTIFF ou
+grade NumPy .npz). As células do MDE próximas a cada estação são escolhidas
+diretamente pelos índices da grade. As células da zona interna são somadas
+como prismas retos (fórmula exata de Nagy/Plouff) e as demais como massas
+lineares verticais. As distâncias de cada deslocamento (núcleos) dependem
+só do espaçamento da grade e do raio, e são calculadas uma única vez.
+----------------------------
+Completes the simple Bouguer correction with the effect of the relief
+around each station, computed from a regular DEM in geographic coordinates
+(GeoTIFF or NumPy .npz grid). The DEM cells near each station are picked
+directly by grid index. Cells of the inner zone are summed as right
+rectangular prisms (exact Nagy/Plouff formula) and the others as vertical
+line masses. The distances of each offset (kernels) depend only on the
+grid spacing and the radius, and are computed only once.
+'''
+
+G = 6.674e-11 #Constante gravitacional (m³/kg/s²)
+RAIO_TERRA = 6371000. #Raio médio da Terra (m), para a projeção local da grade
+SI_PARA_MGAL = 1e5
+
+
+class ModeloDigitalElevacao:
+    """
+    Regular DEM in geographic coordinates: z[linha, coluna] in metres, with
+    the centre of cell [0, 0] at (lat0, lon0) and steps dlat, dlon in
+    degrees (dlat is usually negative, north-up). Cells without data are
+    NaN and do not contribute.
+    """
+
+    def __init__(self, z, lat0, lon0, dlat, dlon):
+        self.z = np.asarray(z, dtype=np.float64)
+        self.lat0, self.lon0 = float(lat0), float(lon0)
+        self.dlat, self.dlon = float(dlat), float(dlon)
+        #Projeção local equiretangular, na latitude central da grade
+        lat_centro = self.lat0 + self.dlat*(self.z.shape[0] - 1)/2
+        self.dy = abs(np.radians(self.dlat))*RAIO_TERRA
+        self.dx = abs(np.radians(self.dlon))*RAIO_TERRA*np.cos(np.radians(lat_centro))
+
+    @classmethod
+    def carregar(cls, caminho):
+        """
+        Reads a GeoTIFF (needs rasterio) or a .npz with the arrays z, lat0,
+        lon0, dlat and dlon.
+        """
+        if caminho.lower().endswith('.npz'):
+            with np.load(caminho) as npz:
+                return cls(npz['z'], npz['lat0'], npz['lon0'], npz['dlat'], npz['dlon'])
+        try:
+            import rasterio
+        except ImportError as erro:
+            raise ImportError('Ler um MDE GeoTIFF precisa do pacote rasterio (pip install rasterio), '
+                              'ou converta-o para .npz: %s' % (erro,))
+        with rasterio.open(caminho) as raster:
+            z = raster.read(1, masked=True).astype(np.float64).filled(np.nan)
+            t = raster.transform
+            if raster.crs is not None and not raster.crs.is_geographic:
+                raise ValueError('O MDE deve estar em coordenadas geográficas (lat/lon): %s' % caminho)
+        return cls(z, t.f + t.e/2, t.c + t.a/2, t.e, t.a)
+
+    def salvar(self, caminho):
+        np.savez(caminho, z=self.z, lat0=self.lat0, lon0=self.lon0, dlat=self.dlat, dlon=self.dlon)
+
+
+@lru_cache(maxsize=32)
+def _nucleo(dx, dy, raio, raio_interno):
+    """
+    Cell offsets (di, dj) within raio of a station, split into the inner
+    zone (exact prisms) and the outer zone, with the horizontal distance of
+    each outer offset. Depends only on the grid spacing, so it is shared by
+    every station.
+    """
+    ni, nj = int(np.ceil(raio/dy)), int(np.ceil(raio/dx))
+    di, dj = np.meshgrid(np.arange(-ni, ni + 1), np.arange(-nj, nj + 1), indexing='ij')
+    r = np.hypot(di*dy, dj*dx)
+    dentro = r <= raio
+    interno = dentro & (r <= raio_interno)
+    externo = dentro & ~interno
+    return {'di_int': di[interno], 'dj_int': dj[interno],
+            'di_ext': di[externo], 'dj_ext': dj[externo], 'r_ext': r[externo]}
+
+
+def _prismas(x1, x2, y1, y2, dh):
+    """
+    Vertical attraction, divided by G*rho, of prisms [x1, x2] x [y1, y2]
+    (metres, relative to the station) between the station level and dh
+    above it (below it when dh < 0). Always positive, as a terrain effect.
+    Finite when the station lies on a prism edge or corner.
+    """
+    total = np.zeros(np.broadcast(x1, dh).shape)
+    z1, z2 = np.zeros_like(total), -np.asarray(dh, dtype=np.float64) #z para baixo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for x, sx in ((x1, -1), (x2, 1)):
+            for y, sy in ((y1, -1), (y2, 1)):
+                for z, sz in ((z1, -1), (z2, 1)):
+                    r = np.sqrt(x*x + y*y + z*z)
+                    #x*log(y + r) como x*asinh(y/hypot(x, z)): a diferença não depende de y e se
+                    #anula na soma, e não há cancelamento em y + r com y < 0; cada termo é 0 no eixo
+                    termo_x = np.where(x == 0, 0., x*np.arcsinh(y/np.hypot(x, z)))
+                    termo_y = np.where(y == 0, 0., y*np.arcsinh(x/np.hypot(y, z)))
+                    termo_z = np.where(z == 0, 0., z*np.arctan(x*y/(z*r)))
+                    total += sx*sy*sz*(termo_x + termo_y - termo_z)
+    return np.abs(total)
+
+
+def _terreno_estacoes(mde, lat, lon, alt, raio, raio_interno):
+    """
+    Terrain effect per unit G*rho (m) of each station, in the current process.
+    """
+    nucleo = _nucleo(mde.dx, mde.dy, raio, raio_interno)
+    ny, nx = mde.z.shape
+    area = mde.dx*mde.dy
+    fi = (np.asarray(lat) - mde.lat0)/mde.dlat
+    fj = (np.asarray(lon) - mde.lon0)/mde.dlon
+    saida = np.zeros(len(fi))
+    for k in range(len(fi)):
+        i0, j0 = int(np.rint(fi[k])), int(np.rint(fj[k]))
+        #Posição da estação em relação ao centro da sua célula (m)
+        ey = (fi[k] - i0)*mde.dy*np.sign(mde.dlat) #Para o norte
+        ex = (fj[k] - j0)*mde.dx*np.sign(mde.dlon) #Para o leste
+        soma = 0.
+        for zona in ('int', 'ext'):
+            i = i0 + nucleo['di_' + zona]
+            j = j0 + nucleo['dj_' + zona]
+            ok = (i >= 0) & (i < ny) & (j >= 0) & (j < nx)
+            dh = np.nan_to_num(mde.z[i[ok], j[ok]] - alt[k])
+            if zona == 'int':
+                xc = nucleo['dj_int'][ok]*mde.dx*np.sign(mde.dlon) - ex
+                yc = nucleo['di_int'][ok]*mde.dy*np.sign(mde.dlat) - ey
+                soma += _prismas(xc - mde.dx/2, xc + mde.dx/2, yc - mde.dy/2, yc + mde.dy/2, dh).sum()
+            else:
+                r = nucleo['r_ext'][ok]
+                soma += area*np.sum(1/r - 1/np.sqrt(r*r + dh*dh)) #Massa linear vertical
+        saida[k] = soma
+    return saida
+
+
+_mde_trabalhador = None
+
+
+def _iniciar_trabalhador(mde):
+    global _mde_trabalhador
+    _mde_trabalhador = mde
+
+
+def _terreno_no_trabalhador(lat, lon, alt, raio, raio_interno):
+    return _terreno_estacoes(_mde_trabalhador, lat, lon, alt, raio, raio_interno)
+
+
+def correcao_terreno(lat, lon, alt_m, mde, densidade, raio=10000., raio_interno=None, n_processos=1,
+                     instrumentacao=None):
+    """
+    Terrain correction (mGal, always positive) of stations at lat, lon
+    (decimal degrees) and altitude alt_m (m), from the DEM mde (a
+    ModeloDigitalElevacao or a file path), for a crustal density in
+    ton/m³. Cells up to raio metres are used; within raio_interno (default:
+    two cell diagonals) they are exact prisms. n_processos splits the
+    stations between worker processes (None uses every core). The
+    progress is reported to instrumentacao after each group of stations,
+    which may also cancel the computation (see instrumentacao.py).
+    """
+    if not isinstance(mde, ModeloDigitalElevacao):
+        mde = ModeloDigitalElevacao.carregar(mde)
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    alt = np.atleast_1d(np.asarray(alt_m, dtype=np.float64))
+    if raio_interno is None:
+        raio_interno = 2*np.hypot(mde.dx, mde.dy)
+    raio, raio_interno = float(raio), float(raio_interno)
+    if n_processos is None:
+        n_processos = os.cpu_count() or 1
+    n_processos = max(1, min(n_processos, len(lat)))
+
+    #Grupos de estações: a unidade de trabalho dos processos e do aviso de progresso
+    partes = np.array_split(np.arange(len(lat)), min(len(lat), max(4*n_processos, 50)))
+    efeito = np.zeros(len(lat))
+    if n_processos == 1:
+        for p in partes:
+            efeito[p] = _terreno_estacoes(mde, lat[p], lon[p], alt[p], raio, raio_interno)
+            progresso(instrumentacao, 'terreno', int(p[-1]) + 1, len(lat))
+    else:
+        from concurrent.futures import ProcessPoolExecutor #O multiprocessing só é carregado quando usado
+        with ProcessPoolExecutor(max_workers=n_processos, initializer=_iniciar_trabalhador,
+                                 initargs=(mde,)) as pool:
+            resultados = pool.map(_terreno_no_trabalhador, [lat[p] for p in partes], [lon[p] for p in partes],
+                                  [alt[p] for p in partes], [raio]*len(partes), [raio_interno]*len(partes))
+            try:
+                for p, parte in zip(partes, resultados):
+                    efeito[p] = parte
+                    progresso(instrumentacao, 'terreno', int(p[-1]) + 1, len(lat))
+            except BaseException:
+                pool.shutdown(cancel_futures=True) #Não espera os grupos que ainda não começaram
+                raise
+    return G*densidade*1000*efeito*SI_PARA_MGAL
+
+
+def corrigir_terreno(resultados, mde, params, raio=10000., n_processos=1, instrumentacao=None, incertezas=None):
+    """
+    Terrain stage of the reduction: returns the terrain correction 'ct',
+    its uncertainty from the density uncertainty and, when resultados has
+    the simple Bouguer anomaly g_cb, the complete one 'g_cbc' = g_cb + ct.
+    The density uncertainty is the 'densidade' entry of incertezas (or of
+    params['incertezas']), by default the one of INCERTEZAS_PADRAO.
+    """
+    densidade = float(params.get('densidade', 2.67))
+    incertezas = incertezas if incertezas is not None else params.get('incertezas')
+    ç_densidade = float(dict(INCERTEZAS_PADRAO, **(incertezas or {}))['densidade'])
+    ct = correcao_terreno(resultados['Lat_graus_dec'], resultados['Lon_graus_dec'], resultados['alt_m'],
+                          mde, densidade, raio, n_processos=n_processos, instrumentacao=instrumentacao)
+    saida = {'ct': ct, 'ç_ct': ct*ç_densidade/densidade}
+    if 'g_cb' in resultados:
+        saida['g_cbc'] = resultados['g_cb'] + ct
+    return saida
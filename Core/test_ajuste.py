@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from ajuste import ajustar_rede
+
+#--------------------------------------------------
+#Testes do ajuste de rede
+#--------------------------------------------------
+
+
+def _rede(semente=0, circuitos=4, estacoes=8, grau=1):
+    #Circuitos sem ruído que abrem e fecham na base 0 e reocupam estações sorteadas
+    rng = np.random.default_rng(semente)
+    g = np.r_[978600., 978600. + rng.uniform(-30, 30, estacoes - 1)]
+    deriva = rng.uniform(-0.1, 0.1, (circuitos, 1 + grau))
+    deriva[:, 0] = rng.uniform(-5, 5, circuitos) #Desvio do gravímetro em cada circuito
+    ponto, leitura, tempo, circuito = [], [], [], []
+    for k in range(circuitos):
+        est = np.r_[0, rng.permutation(np.arange(1, estacoes)), rng.choice(np.arange(1, estacoes), 3), 0]
+        t = 8 + k*24 + 0.3*np.arange(len(est))
+        dt = t - t[0]
+        ponto.append(est)
+        leitura.append(g[est] + np.polyval(deriva[k, ::-1], dt))
+        tempo.append(t)
+        circuito.append(np.full(len(est), k))
+    return g, deriva, *(np.concatenate(v) for v in (ponto, leitura, tempo, circuito))
+
+
+def test_circuito_aba_ba_calculado_a_mao():
+    #A = 1000, B = 1005, leituras com desvio 2 e deriva 0,1 mGal/h, uma leitura por hora
+    ponto = np.array([0, 1, 0, 1, 0])
+    tempo = np.arange(5.)
+    leitura = np.array([1000., 1005., 1000., 1005., 1000.]) + 2 + 0.1*tempo
+    rede = ajustar_rede(ponto, leitura, tempo, np.zeros(5), {0: 1000.})
+    np.testing.assert_allclose(rede['g'], [1000., 1005.], atol=1e-9)
+    np.testing.assert_allclose(rede['deriva'], [[2., 0.1]], atol=1e-9)
+    np.testing.assert_allclose(rede['cd'], -0.1*tempo, atol=1e-9)
+    np.testing.assert_allclose(rede['g_abs'], [1000., 1005., 1000., 1005., 1000.], atol=1e-9)
+    np.testing.assert_allclose(rede['residuos'], 0., atol=1e-9)
+    assert rede['graus_de_liberdade'] == 5 + 1 - 2 - 2
+
+
+@pytest.mark.parametrize('grau', [1, 2])
+def test_recupera_estacoes_e_deriva(grau):
+    g, deriva, ponto, leitura, tempo, circuito = _rede(grau=grau)
+    rede = ajustar_rede(ponto, leitura, tempo, circuito, {0: g[0]}, grau_deriva=grau)
+    np.testing.assert_array_equal(rede['pontos'], np.arange(len(g)))
+    np.testing.assert_allclose(rede['g'], g, atol=1e-8)
+    np.testing.assert_allclose(rede['deriva'], deriva, atol=1e-8)
+    np.testing.assert_allclose(rede['sigma0'], 0., atol=1e-6)
+    assert np.all(rede['ç_g'][1:] > rede['ç_g'][0])
+
+
+def test_recupera_tara():
+    g, deriva, ponto, leitura, tempo, circuito = _rede()
+    tara = np.zeros(len(ponto), dtype=bool)
+    j = np.flatnonzero(circuito == 2)[6]
+    tara[j] = True
+    leitura = leitura + np.where((circuito == 2) & (tempo >= tempo[j]), 0.8, 0.)
+    rede = ajustar_rede(ponto, leitura, tempo, circuito, {0: g[0]}, tara=tara)
+    np.testing.assert_allclose(rede['taras'], [0.8], atol=1e-8)
+    np.testing.assert_array_equal(rede['linhas_taras'], [j])
+    np.testing.assert_allclose(rede['g'], g, atol=1e-8)
+    np.testing.assert_allclose(rede['deriva'], deriva, atol=1e-8)
+
+
+def test_duas_bases():
+    g, deriva, ponto, leitura, tempo, circuito = _rede()
+    #Bases coerentes com as leituras: a solução não muda
+    rede = ajustar_rede(ponto, leitura, tempo, circuito, {0: g[0], 3: (g[3], 0.01)})
+    np.testing.assert_allclose(rede['g'], g, atol=1e-8)
+    #A 2ª base 1 mGal acima: o ajuste fica entre as leituras e as bases, mais perto da base mais precisa
+    rede = ajustar_rede(ponto, leitura, tempo, circuito, {0: g[0], 3: (g[3] + 1., 0.001)}, ç_leitura=0.05)
+    assert 0.5 < rede['g'][3] - g[3] < 1.
+    assert rede['sigma0'] > 0
+
+
+def test_rede_sem_solucao_unica():
+    g, deriva, ponto, leitura, tempo, circuito = _rede(circuitos=2)
+    #O 2º circuito só passa por estações que o 1º não ocupa: o desvio dele fica indeterminado
+    isolado = circuito == 1
+    ponto = np.where(isolado, ponto + 100, ponto)
+    with pytest.raises(ValueError, match='solução única'):
+        ajustar_rede(ponto, leitura, tempo, circuito, {0: g[0]})
+    with pytest.raises(ValueError, match='ao menos uma base'):
+        ajustar_rede(ponto, leitura, tempo, circuito, {})
+    with pytest.raises(ValueError, match='não foi ocupada'):
+        ajustar_rede(ponto, leitura, tempo, circuito, {50: g[0]})
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from amostras import agregar_amostras, ocupacoes
+
+#--------------------------------------------------
+#Testes da agregação das amostras contra um laço por ocupação
+#--------------------------------------------------
+
+
+def _agregar_em_laco(ponto, instante, leitura, estimador, corte_sigma, iteracoes_sigma, fracao_aparada,
+                     assentamento):
+    #Cada ocupação separadamente, com as funções do numpy
+    ocup = ocupacoes(ponto, instante)
+    valores, desvios, usadas = [], [], []
+    for k in range(ocup[-1] + 1):
+        linhas = np.flatnonzero(ocup == k)
+        segundos = (instante[linhas] - instante[linhas[0]]).astype(np.float64)/1e9
+        x = leitura[linhas][np.isfinite(leitura[linhas]) & (segundos >= assentamento)]
+        for _ in range(iteracoes_sigma if corte_sigma else 0):
+            novo = x[np.abs(x - np.median(x)) <= corte_sigma*(np.std(x, ddof=1) if len(x) > 1 else 0.)]
+            if len(novo) == len(x):
+                break
+            x = novo
+        if estimador == 'media':
+            valores.append(np.mean(x))
+        elif estimador == 'mediana':
+            valores.append(np.median(x))
+        else:
+            corte = int(np.floor(fracao_aparada*len(x)))
+            valores.append(np.mean(np.sort(x)[corte:len(x) - corte]))
+        desvios.append(np.std(x, ddof=1) if len(x) > 1 else 0.)
+        usadas.append(len(x))
+    return np.array(valores), np.array(desvios), np.array(usadas)
+
+
+def _fluxo(semente=0, ocupacoes_=40):
+    #Amostras a 1 Hz, com deriva de assentamento no início, picos e leituras inválidas
+    rng = np.random.default_rng(semente)
+    n = rng.integers(5, 60, ocupacoes_)
+    ponto = np.repeat(np.arange(ocupacoes_) % 7, n)
+    decorridos = np.concatenate([np.arange(m) for m in n])
+    segundos = decorridos + np.repeat(np.cumsum(n)*2, n)
+    instante = np.datetime64('2020-05-01T08:00:00', 'ns') + (segundos*1e9).astype('timedelta64[ns]')
+    leitura = np.repeat(rng.uniform(3000, 4000, ocupacoes_), n) + rng.normal(0, 0.01, n.sum())
+    leitura += 0.3*np.exp(-decorridos) #Assentamento
+    picos = rng.random(n.sum()) < 0.05
+    leitura[picos] += rng.choice([-1., 1.], picos.sum())*rng.uniform(0.1, 2., picos.sum())
+    leitura[rng.random(n.sum()) < 0.01] = np.nan
+    return ponto, instante, leitura
+
+
+@pytest.mark.parametrize('estimador', ['media', 'mediana', 'aparada'])
+@pytest.mark.parametrize('corte_sigma, assentamento', [(0., 0.), (3., 0.), (2., 3.)])
+def test_agregar_igual_ao_laco(estimador, corte_sigma, assentamento):
+    ponto, instante, leitura = _fluxo()
+    opcoes = dict(estimador=estimador, corte_sigma=corte_sigma, iteracoes_sigma=5, fracao_aparada=0.1,
+                  assentamento=assentamento)
+    agregado = agregar_amostras(ponto, instante, leitura, **opcoes)
+    valor, desvio, usadas = _agregar_em_laco(ponto, instante, leitura, **opcoes)
+    np.testing.assert_array_equal(agregado['n_amostras'], usadas)
+    np.testing.assert_allclose(agregado['leitura'], valor, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(agregado['ç_amostras'], desvio, rtol=0, atol=1e-9)
+
+
+def test_corte_sigma_remove_picos():
+    ponto = np.zeros(12)
+    instante = np.datetime64('2020-05-01T08:00:00', 's') + np.arange(12).astype('timedelta64[s]')
+    leitura = np.r_[1000 + 0.01*np.array([1, -1, 2, -2, 0, 1, -1, 0, 2, -2, 0]), 1005.]
+    sem_corte = agregar_amostras(ponto, instante, leitura, estimador='media', corte_sigma=0.)
+    com_corte = agregar_amostras(ponto, instante, leitura, estimador='media', corte_sigma=3.)
+    assert sem_corte['leitura'][0] > 1000.4
+    np.testing.assert_allclose(com_corte['leitura'], [1000.], atol=1e-9)
+    assert com_corte['n_amostras'][0] == 11 and com_corte['n_total'][0] == 12
+    #Instante médio das amostras usadas: 5 s depois da primeira
+    assert com_corte['instante'][0] == np.datetime64('2020-05-01T08:00:05', 'ns')
+
+
+def test_estimador_desconhecido():
+    with pytest.raises(ValueError, match='Estimador desconhecido'):
+        agregar_amostras([0], np.array(['2020-05-01T08:00'], dtype='datetime64[s]'), [1.], estimador='moda')
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from calculos import dms_para_graus, tempo_decorrido, correcao_bouguer
+
+#--------------------------------------------------
+#Testes de regressão das etapas vetorizadas
+#--------------------------------------------------
+'''
+Compara as etapas vetorizadas de calculos.py com os laços originais da
+redução (np.append elemento a elemento), que ficam aqui como referência.
+----------------------------
+Compares the vectorized stages of calculos.py with the original loops of
+the reduction (np.append element by element), kept here as the reference.
+'''
+
+
+def _dms_em_laco(gra, mn, seg):
+    saida = []
+    for k in range(len(gra)):
+        if gra[k] >= 0:
+            gd = gra[k]+(mn[k]/60)+(seg[k]/3600)
+        else:
+            gd = gra[k]-(mn[k]/60)-(seg[k]/3600)
+        saida = np.append(saida, gd)
+    return saida
+
+
+def _tempo_em_laco(hora_dec):
+    delta_t = np.zeros(1)
+    contador = 1
+    while len(delta_t) != len(hora_dec):
+        delta_t = np.append(delta_t, hora_dec[contador]-hora_dec[0])
+        contador = contador+1
+    return delta_t
+
+
+def _bouguer_em_laco(alt_m, densidade, ç_densidade, ç_alt):
+    cb, ç_cb = [], []
+    for item in alt_m:
+        if item > 0:
+            cb = np.append(cb, 0.04192*densidade*item)
+            ç_cb = np.append(ç_cb, 0.04192*(item**2*ç_densidade**2+densidade**2*ç_alt**2)**0.5)
+        elif item < 0:
+            cb = np.append(cb, 0.08384*densidade*item)
+            ç_cb = np.append(ç_cb, 0.08384*(item**2*ç_densidade**2+densidade**2*ç_alt**2)**0.5)
+        else:
+            cb = np.append(cb, 0)
+            ç_cb = np.append(ç_cb, 0)
+    return cb, ç_cb
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(2017)
+
+
+def test_dms_para_graus(rng):
+    n = 500
+    gra = rng.integers(-89, 90, n).astype(np.float64)
+    gra[:3] = (0., -0., -1.)
+    mn = rng.integers(0, 60, n).astype(np.float64)
+    seg = rng.uniform(0, 60, n)
+    np.testing.assert_array_equal(dms_para_graus(gra, mn, seg), _dms_em_laco(gra, mn, seg))
+
+
+def test_tempo_decorrido(rng):
+    hora_dec = 8 + np.cumsum(rng.uniform(0, 0.5, 300))
+    np.testing.assert_array_equal(tempo_decorrido(hora_dec), _tempo_em_laco(hora_dec))
+
+
+@pytest.mark.parametrize('ç_densidade, ç_alt', [(0.01, 0.5), (0.05, 2.)])
+def test_correcao_bouguer(rng, ç_densidade, ç_alt):
+    alt_m = np.concatenate((rng.uniform(1, 3000, 200), -rng.uniform(1, 400, 50), np.zeros(10)))
+    rng.shuffle(alt_m)
+    cb, ç_cb = correcao_bouguer(alt_m, 2.67, ç_densidade, ç_alt)
+    cb_ref, ç_cb_ref = _bouguer_em_laco(alt_m, 2.67, ç_densidade, ç_alt)
+    np.testing.assert_array_equal(cb, cb_ref)
+    np.testing.assert_array_max_ulp(ç_cb, ç_cb_ref, maxulp=2) #A raiz do array (sqrt) e a potência escalar (pow) diferem nos últimos bits
+    assert np.all(cb[alt_m == 0] == 0) and np.all(ç_cb[alt_m == 0] == 0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from controle import pares_proximos, controlar_repeticoes
+
+#--------------------------------------------------
+#Testes do controle das estações repetidas
+#--------------------------------------------------
+
+
+def _campanha(semente=0, circuitos=3, estacoes=12, ruido=0.01):
+    #Circuitos que passam duas vezes pelas mesmas estações, abrindo e fechando na base (ponto 0)
+    rng = np.random.default_rng(semente)
+    lat = rng.uniform(-23, -22, estacoes)
+    lon = rng.uniform(-47, -46, estacoes)
+    alt = rng.uniform(300, 1500, estacoes)
+    g = rng.normal(978500, 50, estacoes)
+    resultados = []
+    for k in range(circuitos):
+        est = np.r_[0, rng.permutation(np.arange(1, estacoes)), rng.permutation(np.arange(1, estacoes)), 0]
+        resultados.append({'ponto': est.astype(np.float64), 'g_abs': g[est] + rng.normal(0, ruido, len(est)),
+                           'Lat_graus_dec': lat[est], 'Lon_graus_dec': lon[est], 'alt_m': alt[est],
+                           'hora_dec': 8 + 0.2*np.arange(len(est)),
+                           'data': np.full(len(est), np.datetime64('2017-03-01') + k)})
+    return resultados
+
+
+def test_pares_proximos_igual_a_forca_bruta():
+    rng = np.random.default_rng(1)
+    x, y = rng.uniform(0, 100, 2000), rng.uniform(0, 100, 2000)
+    i, j = pares_proximos(x, y, 3.)
+    d = np.hypot(x[:, None] - x, y[:, None] - y)
+    I, J = np.nonzero(np.triu(d <= 3., 1))
+    assert set(zip(i.tolist(), j.tolist())) == set(zip(I.tolist(), J.tolist()))
+
+
+def test_pico_isolado_nao_e_tara():
+    resultados = _campanha()
+    resultados[1]['g_abs'][12:] += 0.5 #Tara no circuito 1, a partir da linha 12
+    resultados[2]['g_abs'][5] += 1. #Uma só leitura discrepante no circuito 2
+    controle = controlar_repeticoes(resultados)
+    c = controle['por_circuito']
+    assert c['tara_suspeita'].tolist() == [False, True, False]
+    assert c['tara_linha'][1] == 12
+    assert c['tara'][1] == pytest.approx(0.5, abs=0.05)
+    assert 5 in c['discrepantes'][2]
+
+
+def test_cruzamento_entre_pontos_vizinhos():
+    resultados = _campanha(circuitos=2)
+    r = resultados[1]
+    um = r['ponto'] == 1
+    #O ponto 1 do segundo circuito foi anotado como 99, a 1 m e 0,5 m acima do original
+    r['ponto'] = np.where(um, 99., r['ponto'])
+    r['Lat_graus_dec'] = np.where(um, r['Lat_graus_dec'] + 1/111000, r['Lat_graus_dec'])
+    r['g_abs'] = np.where(um, r['g_abs'] - 0.5*0.308596, r['g_abs'])
+    r['alt_m'] = np.where(um, r['alt_m'] + 0.5, r['alt_m'])
+    pares = controlar_repeticoes(resultados)['pares']
+    cruzados = pares['ponto_a'] != pares['ponto_b']
+    assert cruzados.sum() == 1
+    assert abs(pares['fechamento'][cruzados][0]) < 0.1 #Levado à mesma altitude pelo gradiente ar-livre
+    pares = controlar_repeticoes(resultados, tolerancia_m=0.5)['pares']
+    assert not np.any(pares['ponto_a'] != pares['ponto_b'])
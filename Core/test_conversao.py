@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from conversao import TabelaConversao
+
+#--------------------------------------------------
+#Testes da conversão pela tabela contra o laço original
+#--------------------------------------------------
+
+
+def _converter_em_laco(g_med_lido, gc1, gc2, gf0):
+    #Conversão como era feita antes do índice ordenado (cada leitura contra todas as linhas)
+    g_conv = []
+    contador = int(0)
+    while len(g_conv) != len(g_med_lido):
+        for item in gc1:
+            diferença = g_med_lido[contador] - item
+            if diferença < 100 and diferença >= 0:
+                gc1l = gc1.tolist()
+                gc_pos = gc1l.index(item)
+                gp = gc2[gc_pos] + (gf0[gc_pos]*(diferença))
+                g_conv = np.append(g_conv, gp)
+        contador = contador + 1
+    return g_conv
+
+
+def _tabela(semente=0):
+    #Tabela no formato das do fabricante, com as linhas fora de ordem
+    rng = np.random.default_rng(semente)
+    gc1 = np.arange(0., 7000., 100.)
+    gf0 = rng.uniform(1.00, 1.05, len(gc1))
+    gc2 = np.r_[0., np.cumsum(100*gf0[:-1])]
+    ordem = rng.permutation(len(gc1))
+    return gc1[ordem], gc2[ordem], gf0[ordem]
+
+
+def test_converter_igual_ao_laco():
+    gc1, gc2, gf0 = _tabela()
+    leituras = np.r_[np.random.default_rng(1).uniform(0, 7000, 2000), 0., 100., 6999.999]
+    esperado = _converter_em_laco(leituras, gc1, gc2, gf0)
+    tabela = TabelaConversao(gc1, gc2, gf0)
+    np.testing.assert_array_equal(tabela.converter(leituras), esperado)
+    np.testing.assert_array_equal(tabela.converter(leituras, fora_da_faixa='nan'), esperado)
+
+
+def test_leituras_fora_da_tabela():
+    gc1, gc2, gf0 = _tabela()
+    tabela = TabelaConversao(gc1, gc2, gf0, grav='teste')
+    leituras = np.array([-0.5, 50., 7000., 3210.5, np.nan])
+    with pytest.raises(ValueError, match=r'3 leitura\(s\) fora da tabela de conversão teste .*índices 0, 2, 4'):
+        tabela.converter(leituras)
+    convertidas = tabela.converter(leituras, fora_da_faixa='nan')
+    np.testing.assert_array_equal(np.isnan(convertidas), [True, False, True, False, True])
+    np.testing.assert_array_equal(convertidas[[1, 3]], _converter_em_laco(leituras[[1, 3]], gc1, gc2, gf0))
+    with pytest.raises(ValueError, match='fora_da_faixa'):
+        tabela.converter(leituras[[1, 3]], fora_da_faixa='zero')
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from conversao import TabelaConversao
+from esquema import ESQUEMA_GRARED_P, SEM_LEITURAS, ErroValidacao, validar_leituras
+from reducao import PARAMETROS_PADRAO, corrigir_leituras_em_blocos, ler_levantamento
+
+#--------------------------------------------------
+#Testes da validação das leituras
+#--------------------------------------------------
+
+
+def _leituras(g_l1, g_l2, g_l3):
+    #Linhas válidas em todas as colunas, com as leituras dadas
+    n = len(g_l1)
+    validos = {'ponto': 1., 'hora': 10., 'minuto': 30., 'h_instrumento': 0.2, 'Lat_gra': -22., 'Lat_min': 30.,
+               'Lat_seg': 0., 'Lon_gra': -47., 'Lon_min': 15., 'Lon_seg': 0., 'alt_m': 600.}
+    leituras = {c.nome: np.full(n, validos.get(c.nome, np.nan)) for c in ESQUEMA_GRARED_P}
+    leituras.update(g_l1=np.asarray(g_l1, dtype=np.float64), g_l2=np.asarray(g_l2, dtype=np.float64),
+                    g_l3=np.asarray(g_l3, dtype=np.float64))
+    return leituras
+
+
+def test_so_a_media_das_leituras_passa_pela_tabela():
+    tabela = TabelaConversao([1000., 1100., 1200.], [1010., 1111., 1212.], [1.01, 1.01, 1.01], grav='teste')
+    #Faixa 1000 a 1300: a 1ª linha tem uma leitura abaixo, mas a média dentro; a 2ª tem a média abaixo
+    leituras = _leituras([999.99, 990., 1299.], [1000.02, 995., 1299.], [1000.01, 1000., 1300.5])
+    problemas = validar_leituras(leituras, tabela, linhas=2)
+    assert [(p.linha, p.coluna) for p in problemas] == [(3, 'g_med_lido')]
+    assert np.isclose(problemas[0].valor, 995.)
+
+
+@pytest.mark.parametrize('conteudo', ['', 'Pt.\tLeit.1\tLeit.2\tLeit.3\tHor.\tMin.\tAltura_Instr.\tLat_G\tLat_M\tLat_S'
+                                          '\tLon_G\tLon_M\tLon_S\tAlti.\n\n'])
+def test_arquivo_sem_leituras(tmp_path, conteudo):
+    arquivo = tmp_path / 'sem_leituras.txt'
+    arquivo.write_text(conteudo)
+    tabela = TabelaConversao([1000., 1100., 1200.], [1010., 1111., 1212.], [1.01, 1.01, 1.01])
+    for ler in (lambda: ler_levantamento(str(arquivo), 'txt', tabela=tabela),
+                lambda: corrigir_leituras_em_blocos(str(arquivo), tabela, PARAMETROS_PADRAO, 10)):
+        with pytest.raises(ErroValidacao, match='linha 2: o arquivo não tem leituras') as erro:
+            ler()
+        assert [p.motivo for p in erro.value.problemas] == [SEM_LEITURAS]
+    assert [p.motivo for p in validar_leituras(_leituras([], [], []), tabela)] == [SEM_LEITURAS]
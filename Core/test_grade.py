@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from grade import BORDA_PADRAO, gradear
+
+#--------------------------------------------------
+#Testes da grade por curvatura mínima em ladrilhos
+#--------------------------------------------------
+
+
+def _estacoes(semente=0, n=3000, lado=1.):
+    #Anomalia suave com ruído, ptp em torno de 47 mGal
+    rng = np.random.default_rng(semente)
+    lat = rng.uniform(-23, -23 + lado, n)
+    lon = rng.uniform(-47, -47 + lado, n)
+    valores = 10*np.sin(15*lat) + 8*np.cos(12*lon) + 5*np.sin(9*(lat + lon)) + rng.normal(0, 1, n)
+    return lat, lon, valores
+
+
+@pytest.mark.parametrize('ladrilho, borda', [(30, 16), (40, 16), (40, 32)])
+def test_ladrilhos_iguais_a_grade_unica(ladrilho, borda):
+    lat, lon, valores = _estacoes()
+    unica = gradear(lat, lon, valores, ladrilho=100000).z
+    em_ladrilhos = gradear(lat, lon, valores, ladrilho=ladrilho, borda=borda).z
+    assert unica.shape[0] > 2*ladrilho and unica.shape[1] > 2*ladrilho
+    assert np.max(np.abs(em_ladrilhos - unica)) < 1e-4*np.ptp(valores)
+
+
+def test_borda_controla_a_diferenca_dos_ladrilhos():
+    #Estações esparsas (400 em ~55 km, nós a cada 500 m): a curvatura mínima se estende longe de cada estação
+    lat, lon, valores = _estacoes(n=400, lado=0.5)
+    unica = gradear(lat, lon, valores, passo=500., ladrilho=100000).z
+    diferenca = {borda: np.max(np.abs(gradear(lat, lon, valores, passo=500., ladrilho=40, borda=borda).z - unica))
+                 for borda in (8, BORDA_PADRAO)}
+    assert diferenca[BORDA_PADRAO] < 1e-4*np.ptp(valores)
+    assert diferenca[8] > 100*diferenca[BORDA_PADRAO]
+
+
+def test_curvatura_minima_respeita_as_estacoes():
+    lat, lon, valores = _estacoes(n=200, lado=0.05)
+    grade = gradear(lat, lon, valores, passo=100.)
+    i = np.rint((lat - grade.lat0)/grade.dlat).astype(np.int64)
+    j = np.rint((lon - grade.lon0)/grade.dlon).astype(np.int64)
+    sozinhas = np.bincount(i*grade.z.shape[1] + j, minlength=grade.z.size)[i*grade.z.shape[1] + j] == 1
+    np.testing.assert_allclose(grade.z[i, j][sozinhas], valores[sozinhas], atol=1e-4)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from gravidade_normal import VALORES_PUBLICADOS, gradiente_normal, gravidade_normal, seno2
+
+#--------------------------------------------------
+#Testes da gravidade normal contra os valores publicados
+#--------------------------------------------------
+
+
+@pytest.mark.parametrize('nome, lat, publicado', VALORES_PUBLICADOS)
+@pytest.mark.parametrize('formula', ['somigliana', 'serie'])
+def test_valores_publicados(nome, lat, publicado, formula):
+    assert abs(float(gravidade_normal(seno2(lat), nome, formula=formula)) - publicado) < 1e-3
+
+
+@pytest.mark.parametrize('nome', ['grs67', 'grs80'])
+def test_formula_curta_perto_de_somigliana(nome):
+    #A fórmula curta publicada é arredondada a 0,1 mGal
+    s = seno2(np.linspace(-90, 90, 181))
+    diferenca = gravidade_normal(s, nome, formula='curta') - gravidade_normal(s, nome, formula='somigliana')
+    assert np.max(np.abs(diferenca)) < 0.1
+
+
+def test_formula_curta_sem_elipsoide_publicado():
+    with pytest.raises(ValueError, match='fórmula curta'):
+        gravidade_normal(0.5, 'wgs84', formula='curta')
+
+
+def test_gradiente_da_formula_de_altura():
+    #-dg/dh de 2ª ordem: a diferença entre 0 e 1000 m é exata no meio do intervalo
+    s = seno2(np.array([0., 23.5, 45., 90.]))
+    queda = (gravidade_normal(s) - gravidade_normal(s, altura=1000.))/1000.
+    np.testing.assert_allclose(gradiente_normal(s, altura=500.), queda, rtol=1e-10)
+    np.testing.assert_allclose(gradiente_normal(s), 0.3086, atol=3e-4)
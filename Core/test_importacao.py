@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import pytest
+from benchmark import PACOTES_PESADOS, ORCAMENTO_IMPORTACAO, tempo_de_importacao
+
+#--------------------------------------------------
+#Testes do custo de importação dos módulos
+#--------------------------------------------------
+'''
+Cada módulo de benchmark.ORCAMENTO_IMPORTACAO é importado em interpretadores
+novos: não pode carregar nenhum dos PACOTES_PESADOS e deve ficar dentro do
+seu orçamento, em múltiplos do tempo de importação do NumPy.
+----------------------------
+Each module of benchmark.ORCAMENTO_IMPORTACAO is imported in fresh
+interpreters: it must not load any of PACOTES_PESADOS and must stay within
+its budget, in multiples of the import time of NumPy.
+'''
+
+REPETICOES = 5 #O mínimo de poucas repetições ainda tem ruído
+
+
+@pytest.fixture(scope='module')
+def numpy_ms():
+    return tempo_de_importacao('numpy', REPETICOES)[0]
+
+
+@pytest.mark.parametrize('modulo, orcamento', ORCAMENTO_IMPORTACAO)
+def test_importacao(modulo, orcamento, numpy_ms):
+    tempo, carregados = tempo_de_importacao(modulo, REPETICOES)
+    pesados = sorted(p for p in PACOTES_PESADOS if p in carregados)
+    assert not pesados, '%s carrega %s ao ser importado' % (modulo, ', '.join(pesados))
+    assert tempo <= numpy_ms*orcamento, ('%s leva %.1f ms para importar (orçamento: %.1f ms)'
+                                         % (modulo, tempo, numpy_ms*orcamento))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+from lote import reduzir_arquivo
+from reducao import PARAMETROS_PADRAO, ler_tabela_conversao
+
+#--------------------------------------------------
+#Testes das incertezas informadas pelo usuário
+#--------------------------------------------------
+
+CONV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tabelas_conv_todas.xlsx')
+
+
+def _reduzir(tmp_path, circuito, incertezas=None, **opcoes):
+    #Redução do circuito sintético com o relatório de incertezas
+    (tmp_path / 'circuito.txt').write_text(circuito(), encoding='utf-8')
+    tabela = ler_tabela_conversao(CONV, '996', usar_cache=False)
+    resultado = reduzir_arquivo(str(tmp_path / 'circuito.txt'), tabela, dict(PARAMETROS_PADRAO, g_ref=978600.),
+                                tipo_arquivo='txt', saida_incertezas=str(tmp_path / 'incertezas.tsv'),
+                                incertezas=incertezas, **opcoes)
+    assert resultado['erro'] is None, resultado['erro']
+    return resultado['resultados'], pd.read_csv(tmp_path / 'incertezas.tsv', sep='\t')
+
+
+def test_colunas_concordam_com_o_relatorio(tmp_path, circuito):
+    incertezas = {'leitura': 0.02, 'mare': 0.01, 'altura_instrumental': 0.002, 'g_ref': 0.005, 'altitude': 0.1}
+    padrao, _ = _reduzir(tmp_path, circuito)
+    resultados, relatorio = _reduzir(tmp_path, circuito, incertezas)
+    np.testing.assert_allclose(resultados['ç_gai'], (0.02**2 + (0.308596*0.002)**2)**0.5)
+    np.testing.assert_allclose(resultados['ç_gcls'], (resultados['ç_gai']**2 + 0.01**2)**0.5)
+    for coluna, relatada in (('ç_gabs', '01_ç.g_abs'), ('ç_gca', '02_ç.g_ca'), ('ç_gcb', '03_ç.g_cb')):
+        assert np.all(resultados[coluna] < padrao[coluna])
+        np.testing.assert_allclose(relatorio[relatada], resultados[coluna], atol=1e-4)
+
+
+def test_incertezas_entram_na_chave_do_armazem(tmp_path, circuito):
+    armazem = str(tmp_path / 'armazem')
+    padrao, _ = _reduzir(tmp_path, circuito, armazem=armazem)
+    menores, _ = _reduzir(tmp_path, circuito, {'leitura': 0.02}, armazem=armazem)
+    assert np.all(menores['ç_gcd'] < padrao['ç_gcd'])
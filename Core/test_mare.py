@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from mare import EphemerisCache, TideModel
+
+#--------------------------------------------------
+#Testes da maré de Longman vetorizada contra a função escalar
+#--------------------------------------------------
+
+
+def _estacoes(semente=0, n=500):
+    #Estações e instantes sorteados, em segundos inteiros como no caminho escalar
+    rng = np.random.default_rng(semente)
+    lat = rng.uniform(-60, 60, n)
+    lon = rng.uniform(-180, 180, n)
+    alt = rng.uniform(0, 3000, n)
+    segundos = rng.integers(0, 40*365*86400, n)
+    tempos = np.datetime64('1990-01-01T00:00:00', 's') + segundos.astype('timedelta64[s]')
+    escalar = np.array([TideModel().solve_longman(la, lo, al, t.astype(object))
+                        for la, lo, al, t in zip(lat, lon, alt, tempos)])
+    return lat, lon, alt, tempos, escalar
+
+
+@pytest.mark.parametrize('cache', [None, EphemerisCache()])
+def test_vetorizada_igual_a_escalar(cache):
+    lat, lon, alt, tempos, escalar = _estacoes()
+    modelo = TideModel(ephemeris_cache=cache)
+    np.testing.assert_allclose(modelo.solve_longman_array(lat, lon, alt, tempos), escalar, rtol=0, atol=1e-9)
+    #Segunda chamada: as efemérides vêm do cache
+    np.testing.assert_allclose(modelo.solve_longman_array(lat, lon, alt, tempos), escalar, rtol=0, atol=1e-9)
+    if cache is not None:
+        assert cache.hits == len(np.unique(tempos)) and cache.misses == len(np.unique(tempos))
+
+
+def test_seculos_julianos_igual_a_escalar():
+    lat, lon, alt, tempos, escalar = _estacoes(semente=1)
+    modelo = TideModel()
+    T, _ = modelo.calculate_julian_century_array(tempos)
+    np.testing.assert_allclose(modelo.solve_longman_array(lat, lon, alt, T), escalar, rtol=0, atol=1e-9)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import time
+import threading
+import pytest
+from pipeline import Pipeline
+from instrumentacao import Instrumentacao, etapa
+
+#--------------------------------------------------
+#Testes do pipeline com etapas em paralelo e instrumentação
+#--------------------------------------------------
+
+
+def _pipeline(espera=0.05):
+    #Quatro etapas independentes e uma que depende de todas; cada uma anota o intervalo em que rodou
+    pipeline = Pipeline()
+    intervalos = {}
+
+    def etapa_lenta(nome, entrada):
+        def funcao(dados, parametros, instrumentacao):
+            inicio = time.perf_counter()
+            with etapa(instrumentacao, nome + '_interna'):
+                time.sleep(espera)
+            intervalos[nome] = (inicio, time.perf_counter(), threading.current_thread().name)
+            return {nome: dados[entrada] + 1}
+        return funcao
+
+    for nome in ('a', 'b', 'c', 'd'):
+        pipeline.registrar(nome, ('x',), (nome,))(etapa_lenta(nome, 'x'))
+    pipeline.registrar('soma', ('a', 'b', 'c', 'd'), ('soma',))(
+        lambda dados, parametros, instrumentacao: {'soma': dados['a'] + dados['b'] + dados['c'] + dados['d']})
+    return pipeline, intervalos
+
+
+def _sobrepostas(intervalos):
+    fim_primeira = min(fim for _, fim, _ in intervalos.values())
+    return sum(inicio < fim_primeira for inicio, _, _ in intervalos.values())
+
+
+def test_etapas_em_paralelo_com_instrumentacao():
+    pipeline, intervalos = _pipeline()
+    eventos = []
+    instrumentacao = Instrumentacao(log_etapas=False, ao_progresso=eventos.append)
+    with etapa(instrumentacao, 'reducao'):
+        dados = pipeline.executar({'x': 1}, ('soma',), {}, instrumentacao, max_threads=4)
+    assert dados['soma'] == 8
+    assert _sobrepostas(intervalos) > 1
+    assert len(set(t for _, _, t in intervalos.values())) > 1
+    niveis = {r['etapa']: r['nivel'] for r in instrumentacao.registros}
+    assert niveis == {'reducao': 0, 'a': 1, 'b': 1, 'c': 1, 'd': 1, 'soma': 1,
+                      'a_interna': 2, 'b_interna': 2, 'c_interna': 2, 'd_interna': 2}
+    assert sum(e['evento'] == 'fim' for e in eventos) == len(instrumentacao.registros)
+
+
+@pytest.mark.parametrize('opcoes', [{'memoria': True}, {'perfil': True}])
+def test_medicao_global_roda_uma_etapa_por_vez(opcoes):
+    pipeline, intervalos = _pipeline(espera=0.02)
+    instrumentacao = Instrumentacao(log_etapas=False, **opcoes)
+    pipeline.executar({'x': 1}, ('soma',), {}, instrumentacao, max_threads=4)
+    assert _sobrepostas(intervalos) == 1
+    assert all(r['nivel'] == (r['etapa'].endswith('_interna')) for r in instrumentacao.registros)
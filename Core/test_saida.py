@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import pytest
+import saida
+from lote import reduzir_arquivo
+from reducao import PARAMETROS_PADRAO, escrever_saida, ler_tabela_conversao
+
+#--------------------------------------------------
+#Testes das saídas que não podem ser escritas
+#--------------------------------------------------
+
+CONV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tabelas_conv_todas.xlsx')
+
+
+@pytest.fixture
+def sem_pyarrow(monkeypatch):
+    #Como num ambiente sem pyarrow nem fastparquet
+    monkeypatch.setattr(saida, 'find_spec', lambda nome: None)
+
+
+def test_colunar_sem_pyarrow_falha_antes_de_escrever(tmp_path, circuito, sem_pyarrow):
+    (tmp_path / 'circuito.txt').write_text(circuito(), encoding='utf-8')
+    tabela = ler_tabela_conversao(CONV, '996', usar_cache=False)
+    parametros = dict(PARAMETROS_PADRAO, g_ref=978600.)
+    for colunar in ('saida.parquet', 'saida.feather'):
+        resultado = reduzir_arquivo(str(tmp_path / 'circuito.txt'), tabela, parametros, tipo_arquivo='txt',
+                                    saida_txt=str(tmp_path / 'saida.dat'), saida_colunar=str(tmp_path / colunar),
+                                    saida_incertezas=str(tmp_path / 'incertezas.tsv'))
+        assert 'pyarrow' in resultado['erro']
+    assert os.listdir(tmp_path) == ['circuito.txt']
+
+
+def test_escrever_saida_confere_antes(tmp_path, sem_pyarrow):
+    resultados = {'ponto': [1.], 'g': [978600.]}
+    with pytest.raises(ImportError, match='pyarrow'):
+        escrever_saida(resultados, saida_txt=str(tmp_path / 'saida.dat'), saida_colunar=str(tmp_path / 'saida.parquet'))
+    with pytest.raises(ValueError, match='desconhecido'):
+        escrever_saida(resultados, saida_txt=str(tmp_path / 'saida.dat'), saida_colunar=str(tmp_path / 'saida.csv'))
+    assert os.listdir(tmp_path) == []
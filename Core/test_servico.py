@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import os
+import json
+import socket
+import threading
+import http.client
+import pytest
+import servico
+from servico import FilaCheia, ServicoReducao, criar_servidor
+
+#--------------------------------------------------
+#Testes do serviço local de redução
+#--------------------------------------------------
+
+CONV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tabelas_conv_todas.xlsx')
+
+
+@pytest.fixture
+def servidor(tmp_path):
+    #Serviço com a pasta tmp_path, atendendo HTTP numa porta livre
+    servico_ = ServicoReducao(CONV, trabalhadores=2, tamanho_fila=4, usar_cache=False, pasta=str(tmp_path))
+    http_ = criar_servidor(servico_, porta=0, silencioso=True)
+    thread = threading.Thread(target=http_.serve_forever, daemon=True)
+    thread.start()
+    yield servico_, http_.server_address[1]
+    http_.shutdown()
+    http_.server_close()
+    servico_.encerrar()
+
+
+def _post(porta, pedido, tipo='application/json'):
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    corpo = json.dumps(pedido).encode('utf-8')
+    conexao.request('POST', '/reducoes', corpo, {'Content-Type': tipo})
+    resposta = conexao.getresponse()
+    return resposta.status, dict(resposta.getheaders()), resposta.read()
+
+
+def test_resultado_em_pedacos(servidor, monkeypatch, circuito):
+    servico_, porta = servidor
+    monkeypatch.setattr(servico, 'LINHAS_POR_PEDACO', 4)
+    pedido = {'conteudo': circuito(), 'tipo': 'txt', 'grav': '996', 'g_ref': 978600., 'esperar': True}
+    corpo = json.dumps(pedido).encode('utf-8')
+    with socket.create_connection(('127.0.0.1', porta), timeout=30) as conexao:
+        conexao.sendall(b'POST /reducoes HTTP/1.1\r\nHost: local\r\nContent-Type: application/json\r\n'
+                        b'Content-Length: %d\r\nConnection: close\r\n\r\n%s' % (len(corpo), corpo))
+        bruto = b''
+        while True:
+            parte = conexao.recv(65536)
+            if not parte:
+                break
+            bruto += parte
+    cabecalho, resto = bruto.split(b'\r\n\r\n', 1)
+    assert cabecalho.startswith(b'HTTP/1.1 200') and b'Transfer-Encoding: chunked' in cabecalho
+    pedacos = []
+    while True:
+        tamanho, resto = resto.split(b'\r\n', 1)
+        if int(tamanho, 16) == 0:
+            break
+        pedacos.append(resto[:int(tamanho, 16)])
+        resto = resto[int(tamanho, 16) + 2:]
+    texto = b''.join(pedacos).decode('utf-8')
+    assert len(pedacos) > 2
+    assert len(texto.splitlines()) == 1 + 13 #Cabeçalho e uma linha por leitura
+
+
+def test_pedido_sem_json_recusado(servidor, tmp_path, circuito):
+    servico_, porta = servidor
+    pedido = {'conteudo': circuito(), 'grav': '996', 'saida_txt': 'saida.dat', 'esperar': True}
+    status, _, _ = _post(porta, pedido, tipo='text/plain')
+    assert status == 415
+    assert not os.path.exists(tmp_path / 'saida.dat')
+
+
+def test_caminhos_confinados_a_pasta(servidor, tmp_path, circuito):
+    servico_, porta = servidor
+    (tmp_path / 'circuito.txt').write_text(circuito(), encoding='utf-8')
+    for campo, valor in (('saida_txt', '../fora.dat'), ('saida_excel', '/tmp/fora.xlsx'), ('conv', '/etc/passwd')):
+        status, _, corpo = _post(porta, {'arquivo': 'circuito.txt', 'grav': '996', campo: valor})
+        assert status == 400 and 'fora da pasta' in json.loads(corpo)['erro']
+    status, _, corpo = _post(porta, {'arquivo': '/etc/passwd', 'grav': '996'})
+    assert status == 400
+    status, _, _ = _post(porta, {'arquivo': 'circuito.txt', 'grav': '996', 'g_ref': 978600.,
+                                 'saida_txt': 'saida.dat', 'esperar': True})
+    assert status == 200 and os.path.exists(tmp_path / 'saida.dat')
+
+
+def test_excel_por_conteudo_recusado(servidor):
+    servico_, porta = servidor
+    status, _, corpo = _post(porta, {'conteudo': 'x', 'tipo': 'excel', 'grav': '996'})
+    assert status == 400 and 'Excel' in json.loads(corpo)['erro']
+
+
+def test_fila_cheia(tmp_path, circuito):
+    servico_ = ServicoReducao(CONV, trabalhadores=1, tamanho_fila=1, usar_cache=False, pasta=str(tmp_path))
+    liberar = threading.Event()
+    servico_._reduzir = lambda pedido: liberar.wait() and {'resultados': None, 'leituras': 0, 'erro': None}
+    http_ = criar_servidor(servico_, porta=0, silencioso=True)
+    threading.Thread(target=http_.serve_forever, daemon=True).start()
+    try:
+        pedido = {'conteudo': circuito(), 'grav': '996'}
+        primeiro = servico_.submeter(pedido)
+        while servico_.pedido(primeiro)['estado'] != 'reduzindo': #O trabalhador pegou o 1º; o 2º fica na fila
+            threading.Event().wait(0.01)
+        servico_.submeter(pedido)
+        with pytest.raises(FilaCheia):
+            servico_.submeter(pedido)
+        status, cabecalhos, _ = _post(http_.server_address[1], pedido)
+        assert status == 503 and cabecalhos['Retry-After'] == '1'
+    finally:
+        liberar.set()
+        http_.shutdown()
+        http_.server_close()
+        servico_.encerrar()
+    assert servico_.estado()['pedidos'] == {'pronto': 2}
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------
+#Import das bibliotecas
+#--------------------------------------------------
+import numpy as np
+import pytest
+from terreno import G, SI_PARA_MGAL, ModeloDigitalElevacao, _prismas, correcao_terreno
+
+#--------------------------------------------------
+#Testes da correção de terreno por prismas
+#--------------------------------------------------
+
+
+@pytest.mark.parametrize('dh', [100., -100.])
+def test_placa_plana_igual_a_bouguer(dh):
+    #Placa de 2000 km de lado: 2*pi*h, a menos de h/L
+    np.testing.assert_allclose(_prismas(-1e6, 1e6, -1e6, 1e6, dh), 2*np.pi*100., rtol=1e-4)
+
+
+def test_estacao_na_aresta_do_prisma():
+    #Antes dava 0 e 1,8e308: 0*log(0) e o cancelamento em y + r com y < 0
+    aresta = _prismas(0., 15., -15., 15., 100.)
+    assert np.isfinite(aresta) and aresta > 0
+    np.testing.assert_allclose(_prismas(1e-9, 15., -15., 15., 100.), aresta, rtol=1e-8)
+    np.testing.assert_allclose(2*aresta, _prismas(-15., 15., -15., 15., 100.), rtol=1e-12)
+
+
+def test_mde_plano_com_estacoes_nas_bordas_das_celulas():
+    #MDE de 1" a 100 m; a estação a 0 m, no centro, numa aresta e num canto de célula
+    passo, n, raio, h = 1/3600, 301, 3000., 100.
+    mde = ModeloDigitalElevacao(np.full((n, n), h), -22 + 150*passo, -47 - 150*passo, -passo, passo)
+    lat = np.array([-22., -22., -22 + 0.5*passo])
+    lon = np.array([-47., -47 + 0.5*passo, -47 + 0.5*passo])
+    ct = correcao_terreno(lat, lon, np.zeros(3), mde, 2.67, raio=raio)
+    disco = 2*np.pi*G*2670*(h + raio - np.hypot(raio, h))*SI_PARA_MGAL
+    assert np.all(np.isfinite(ct))
+    np.testing.assert_allclose(ct, disco, rtol=0.02)
+    np.testing.assert_allclose(ct, ct[0], rtol=0.02)